@@ -1,26 +1,80 @@
-import pandas as pd
-import subprocess
+import argparse
+import os
+import sys
 import logging
 import traceback
 
-logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
 
-def execute_scrapy(numero_processo):
-    comando = f"scrapy crawl cpopg -a numero_processo={numero_processo}"
-    subprocess.Popen(comando, shell=True).wait()
+from esaj.saidas import ler_coluna, mesclar
+
+# Argumento que cada spider usa para receber a lista de processos
+ARGUMENTO_SPIDER = {
+    'cpopg': 'numeros_processo',
+    'cposg': 'process_numbers',
+}
+
+
+def ler_numeros_processo(arquivo_csv, pasta_parquet='data/parquet'):
+    if arquivo_csv == '-':
+        for linha in sys.stdin:
+            yield linha.strip()
+        return
+
+    # CSV, arquivo/pasta Parquet, ou o dataset Parquet equivalente a um CSV que não existe
+    yield from ler_coluna(arquivo_csv, 'numero_processo', pasta_parquet)
+
+
+def main(arquivo_csv, spider='cpopg', concorrencia=8, delay=None, fila=None, alimentar=False, so_alimentar=False,
+         recomecar=False):
+    settings = get_project_settings()
+    settings.set('CONCURRENT_REQUESTS', concorrencia)
+    settings.set('CONCURRENT_REQUESTS_PER_DOMAIN', concorrencia)
+    if delay is not None:
+        # Ritmo fixo: o controle por família (esaj/ratecontrol.py) é desligado
+        settings.set('DOWNLOAD_DELAY', delay)
+        settings.set('RATE_CONTROL_ENABLED', False)
+    if fila:
+        # Crawl distribuído (esaj/distributed.py): sem --alimentar, o processo só consome a fila
+        settings.set('DISTRIBUTED_BACKEND', fila)
+        settings.set('DISTRIBUTED_FEED', alimentar or so_alimentar)
+        settings.set('DISTRIBUTED_CONSUME', not so_alimentar)
+        settings.set('DISTRIBUTED_RESET', recomecar)
 
-def main(arquivo_csv):
     try:
-        df = pd.read_csv(arquivo_csv, encoding='utf-8')
-        numeros_processos_vistos = set()
-        for _, linha in df.iterrows():
-            numero_processo = linha['numero_processo']
-            if numero_processo not in numeros_processos_vistos:
-                numeros_processos_vistos.add(numero_processo)
-                execute_scrapy(numero_processo)
+        process = CrawlerProcess(settings)
+        # O nome do arquivo identifica a execução no journal (CrawlState), para retomar depois de uma interrupção
+        job = 'stdin' if arquivo_csv == '-' else os.path.basename(arquivo_csv)
+        process.crawl(spider, job=job, **{ARGUMENTO_SPIDER[spider]: ler_numeros_processo(arquivo_csv, settings.get('PARQUET_DIR'))})
+        process.start()
     except Exception as e:
         logging.error(f"Erro ao processar o arquivo CSV: {e}. Rastreamento de pilha:\n{traceback.format_exc()}")
 
+
 if __name__ == "__main__":
-    arquivo_csv = 'data/cjpg.csv'
-    main(arquivo_csv)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Consulta em lote, em um único processo do Scrapy.')
+    parser.add_argument('arquivo_csv', nargs='?', default='data/cjpg.csv',
+                        help="CSV ou Parquet com a coluna numero_processo, ou '-' para ler um número por linha da entrada padrão")
+    parser.add_argument('--spider', choices=sorted(ARGUMENTO_SPIDER), default='cpopg')
+    parser.add_argument('--concorrencia', type=int, default=8,
+                        help='requisições simultâneas ao e-SAJ')
+    parser.add_argument('--delay', type=float, default=None,
+                        help='ritmo fixo em segundos no lugar do controle por família do settings.py')
+    parser.add_argument('--fila', default=None,
+                        help='backend da fila compartilhada: sqlite:///data/fila.sqlite3 ou redis://host:6379/0')
+    parser.add_argument('--alimentar', action='store_true',
+                        help='coloca os números do arquivo na fila compartilhada, além de consumi-la')
+    parser.add_argument('--so-alimentar', action='store_true',
+                        help='só coloca os números do arquivo na fila compartilhada, sem consultar o e-SAJ')
+    parser.add_argument('--recomecar', action='store_true',
+                        help='esvazia a fila e os números já vistos da spider antes de alimentar')
+    parser.add_argument('--mesclar', nargs='+', metavar='PASTA',
+                        help='junta as pastas data/ de vários nós em data/, sem repetições, e sai')
+    args = parser.parse_args()
+    if args.mesclar:
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+        mesclar(args.mesclar)
+    else:
+        main(args.arquivo_csv, args.spider, args.concorrencia, args.delay, args.fila, args.alimentar,
+             args.so_alimentar, args.recomecar)
@@ -0,0 +1,61 @@
+"""Páginas e documentos gravados do e-SAJ, entregues às spiders sem rede.
+
+Cada caso liga um arquivo de fixtures/ à URL e ao meta com que a resposta
+chegaria ao callback durante um crawl de verdade.
+"""
+import os
+from collections import namedtuple
+
+from scrapy.http import HtmlResponse, Request, Response, TextResponse
+
+from esaj.spiders.cjpg import CjpgSpider
+from esaj.spiders.cjsg import CjsgSpider
+from esaj.spiders.cpopg import CpopgSpider
+from esaj.spiders.cposg import CposgSpider
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+Caso = namedtuple('Caso', 'nome spider argumentos callback fixture url meta')
+
+PROCESSO = '1001234-56.2023.8.26.0100'
+
+CASOS = [
+    Caso('cjsg.parse', CjsgSpider, {'search': 'dano moral'}, 'parse', 'cjsg_resultados.html',
+         'https://esaj.tjsp.jus.br/cjsg/resultadoCompleta.do?conversationId=&dados.buscaInteiroTeor=dano%20moral',
+         {'selector': '#tdResultados table table'}),
+    Caso('cjpg.parse', CjpgSpider, {'search': 'dano moral'}, 'parse', 'cjpg_resultados.html',
+         'https://esaj.tjsp.jus.br/cjpg/trocarDePagina.do?pagina=2', {}),
+    Caso('cpopg.parse (lista)', CpopgSpider, {}, 'parse', 'cpopg_lista_processos.html',
+         f'https://esaj.tjsp.jus.br/cpopg/search.do?dePesquisa={PROCESSO}', {'numero_processo': PROCESSO}),
+    Caso('cpopg.parse', CpopgSpider, {}, 'parse', 'cpopg_show.html',
+         'https://esaj.tjsp.jus.br/cpopg/show.do?processo.codigo=2S000ABC20000', {'numero_processo': PROCESSO}),
+    Caso('cposg.parse', CposgSpider, {}, 'parse', 'cposg_show.html',
+         'https://esaj.tjsp.jus.br/cposg/show.do?processo.codigo=RI00ABC1D0000', {'process_number': PROCESSO}),
+    Caso('cposg.open_pdf', CposgSpider, {}, 'open_pdf', 'cposg_verificar_acesso.txt',
+         'https://esaj.tjsp.jus.br/cposg/verificarAcessoMovimentacao.do?cdDocumento=19000',
+         {'process_number': PROCESSO, 'cddocumento': '19000'}),
+    Caso('cposg.pdf_viewer', CposgSpider, {}, 'pdf_viewer', 'cposg_visualizador.html',
+         'https://esaj.tjsp.jus.br/pastadigital/abrirDocumentoVinculadoMovimentacao.do?cdDocumento=19000',
+         {'process_number': PROCESSO, 'cddocumento': '19000'}),
+    Caso('cposg.save_pdf', CposgSpider, {}, 'save_pdf', 'cposg_documento.pdf',
+         'https://esaj.tjsp.jus.br/pastadigital/getPDF.do?cdDocumento=19000',
+         {'process_number': PROCESSO, 'cddocumento': '19000', 'cdprocesso': 'RI00ABC1D0000',
+          'title': 'Acórdão registrado', 'description': 'Documento 0'}),
+]
+
+
+def ler_fixture(fixture):
+    with open(os.path.join(FIXTURES, fixture), 'rb') as file:
+        return file.read()
+
+
+def resposta(caso, body=None):
+    """Resposta do caso, do mesmo tipo que o Scrapy montaria para o conteúdo."""
+    if body is None:
+        body = ler_fixture(caso.fixture)
+    request = Request(caso.url, meta=dict(caso.meta))
+    if caso.fixture.endswith('.html'):
+        return HtmlResponse(url=caso.url, body=body, encoding='utf-8', request=request)
+    if caso.fixture.endswith('.txt'):
+        return TextResponse(url=caso.url, body=body, encoding='utf-8', request=request)
+    return Response(url=caso.url, body=body, request=request)
@@ -0,0 +1,70 @@
+"""Custo por item do CsvWriterPipeline conforme o arquivo de saída cresce.
+
+Uso (a partir da pasta esaj/):
+    python -m benchmarks.csv_pipeline --itens 200000 --passo 20000 --legado 2000
+"""
+import argparse
+import csv
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from esaj.items import CjpgItem
+from esaj.pipelines import CsvWriterPipeline
+
+
+def fake_item(i):
+    return CjpgItem({
+        'numero_processo': f'{i:07d}-12.2023.8.26.0100',
+        'classe': 'Procedimento Comum Cível',
+        'assunto': 'Indenização por Dano Moral',
+        'magistrado': 'Fulano de Tal',
+        'foro': 'Foro Central Cível',
+        'vara': '1ª Vara Cível',
+        'data_disponibilizacao': '09/02/2024',
+        'ementa': 'Lorem ipsum dolor sit amet ' * 40,
+    })
+
+
+def bench_pipeline(total, step, buffer_size, folder):
+    CjpgItem.csv_file = os.path.join(folder, 'cjpg.csv')
+    pipeline = CsvWriterPipeline(buffer_size)
+    for start in range(0, total, step):
+        t0 = time.perf_counter()
+        for i in range(start, start + step):
+            pipeline.process_item(fake_item(i), None)
+        pipeline.spider_closed(None)
+        elapsed = time.perf_counter() - t0
+        print(f'pipeline  linhas {start:>8} a {start + step:>8}: {elapsed / step * 1e6:8.1f} µs/item')
+
+
+def bench_legacy(total, step, folder):
+    csv_file = os.path.join(folder, 'cjpg_legado.csv')
+    for start in range(0, total, step):
+        t0 = time.perf_counter()
+        for i in range(start, start + step):
+            data = dict(fake_item(i))
+            if os.path.exists(csv_file):
+                df = pd.concat([pd.read_csv(csv_file), pd.DataFrame([data])], ignore_index=True)
+            else:
+                df = pd.DataFrame([data])
+            df.to_csv(csv_file, index=False, quoting=csv.QUOTE_NONNUMERIC, encoding='utf-8')
+        elapsed = time.perf_counter() - t0
+        print(f'legado    linhas {start:>8} a {start + step:>8}: {elapsed / step * 1e6:8.1f} µs/item')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--itens', type=int, default=200000)
+    parser.add_argument('--passo', type=int, default=20000)
+    parser.add_argument('--buffer', type=int, default=500)
+    parser.add_argument('--legado', type=int, default=0,
+                        help='quantidade de linhas para medir também o add_to_csv antigo (lento)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        bench_pipeline(args.itens, args.passo, args.buffer, folder)
+        if args.legado:
+            bench_legacy(args.legado, max(args.legado // 5, 1), folder)
@@ -0,0 +1,61 @@
+"""Tempo de parse por página dos campos rotulados do cabeçalho (CPOPG/CPOSG).
+
+Compara as consultas antigas (uma XPath montada por campo, avaliada uma vez
+para o texto e outra para o link) com o campos_rotulados, que lê os blocos
+'unj-label' uma única vez com expressões já compiladas.
+
+Uso (a partir da pasta esaj/):
+    python -m benchmarks.header_parser --repeticoes 500
+"""
+import argparse
+import os
+import time
+
+from scrapy.http import HtmlResponse
+
+from esaj.spiders.helpers.selectors import campos_rotulados
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def legacy_cpopg(response):
+    bloco = '//div[contains(@class, "col-lg-4 col-xl-3 mb-2")][.//span[contains(@class, "unj-label") and contains(text(), "{}")]]//div/a'
+    response.xpath('//div[contains(@class, "col-lg-2 mb-2")][.//span[contains(@class, "unj-label") and contains(text(), "Outros assuntos")]]//div[@class="line-clamp__2"]/span/text()').get()
+    response.xpath('//div[contains(@class, "col-lg-12 col-xl-13")][.//span[contains(@class, "unj-label") and contains(text(), "Execução de Sentença")]]//div/span[contains(@class, "unj-larger")]/text()').get()
+    for rotulo in ('Processo principal', 'Apensado ao'):
+        response.xpath(bloco.format(rotulo) + '/text()').get()
+        response.xpath(bloco.format(rotulo) + '/@href').get()
+
+
+def legacy_cposg(response):
+    response.css('#maisDetalhes span:contains("Origem")').xpath('..').css('div div span::text').get()
+
+
+def registry(response):
+    campos_rotulados(response)
+
+
+def measure(function, url, body, repetitions):
+    # Resposta nova a cada repetição, como no crawl (sem reaproveitar a árvore já montada)
+    t0 = time.perf_counter()
+    for _ in range(repetitions):
+        response = HtmlResponse(url=url, body=body, encoding='utf-8')
+        response.selector.root
+        function(response)
+    return (time.perf_counter() - t0) / repetitions * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeticoes', type=int, default=500)
+    args = parser.parse_args()
+
+    for fixture, legacy in (('cpopg_show.html', legacy_cpopg), ('cposg_show.html', legacy_cposg)):
+        with open(os.path.join(FIXTURES, fixture), 'rb') as file:
+            body = file.read()
+        url = f'https://esaj.tjsp.jus.br/{fixture}'
+        # Custo de montar a árvore, descontado das duas medições
+        base = measure(lambda response: None, url, body, args.repeticoes)
+        old = measure(legacy, url, body, args.repeticoes) - base
+        new = measure(registry, url, body, args.repeticoes) - base
+        print(f'{fixture:<16} consultas antigas: {old:6.3f} ms/página   campos_rotulados: {new:6.3f} ms/página   ({old / new:.1f}x)')
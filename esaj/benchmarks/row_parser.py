@@ -0,0 +1,68 @@
+"""Tempo de parse por página dos blocos de resultado do CJSG/CJPG.
+
+Compara o get_detail antigo (um ':contains' por campo) com o parse_rows,
+que lê cada linha do bloco uma única vez.
+
+Uso (a partir da pasta esaj/):
+    python -m benchmarks.row_parser --repeticoes 200
+"""
+import argparse
+import os
+import time
+
+from scrapy.http import HtmlResponse
+
+from esaj.spiders.helpers.innertext import innertext_quick
+from esaj.spiders.helpers.rows import parse_rows
+from esaj.spiders.helpers.treatment import treatment
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+LABELS = {
+    'cjsg_resultados.html': ['Classe/Assunto:', 'Assunto:', 'Classe/Assunto:', 'Relator(a):', 'Órgão julgador:',
+                             'Comarca:', 'Data do julgamento:', 'Data de publicação:'],
+    'cjpg_resultados.html': ['Classe:', 'Assunto:', 'Magistrado:', 'Foro:', 'Vara:', 'Data de Disponibilização:'],
+}
+
+
+def legacy_get_detail(process, css_selector, search=''):
+    element = process.css(f'{css_selector} :contains("{search}")')
+    text = innertext_quick(element)[0]
+    pos = len(search) if text.find(search) > -1 else 0
+    final_text = text[pos:]
+    if final_text:
+        return treatment(final_text).strip()
+    return ''
+
+
+def legacy(response, labels):
+    for process in response.css('#tdResultados table table'):
+        for label in labels:
+            legacy_get_detail(process, 'tr', label)
+
+
+def single_pass(response, labels):
+    for process in response.css('#tdResultados table table'):
+        fields = parse_rows(process)
+        for label in labels:
+            fields.get(label, '')
+
+
+def measure(function, response, labels, repetitions):
+    t0 = time.perf_counter()
+    for _ in range(repetitions):
+        function(response, labels)
+    return (time.perf_counter() - t0) / repetitions * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeticoes', type=int, default=200)
+    args = parser.parse_args()
+
+    for fixture, labels in LABELS.items():
+        with open(os.path.join(FIXTURES, fixture), 'rb') as file:
+            response = HtmlResponse(url=f'https://esaj.tjsp.jus.br/{fixture}', body=file.read(), encoding='utf-8')
+        old = measure(legacy, response, labels, args.repeticoes)
+        new = measure(single_pass, response, labels, args.repeticoes)
+        print(f'{fixture:<22} get_detail: {old:7.2f} ms/página   parse_rows: {new:7.2f} ms/página   ({old / new:.1f}x)')
@@ -0,0 +1,151 @@
+"""Desempenho dos callbacks das spiders e dos pipelines sobre o corpus gravado.
+
+Para cada caso do corpus, o callback roda sobre uma resposta nova a cada
+repetição (a árvore HTML é montada dentro da medição, como no crawl) e são
+reportados páginas/s, itens/s, latência p50/p95/p99 e o pico de RSS do
+processo. Em seguida os itens produzidos passam pelo CsvWriterPipeline e o
+PDF de exemplo pelo pdf_to_text.
+
+Os arquivos gerados (CSV, PDFs) ficam em um diretório temporário.
+
+Uso (a partir da pasta esaj/):
+    python -m benchmarks.suite --repeticoes 200
+    python -m benchmarks.suite --salvar referencia.json
+    python -m benchmarks.suite --referencia referencia.json --tolerancia 0.25
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+import scrapy
+from scrapy.utils.test import get_crawler
+
+from benchmarks.corpus import CASOS, FIXTURES, ler_fixture, resposta
+from esaj.pipelines import CsvWriterPipeline
+from esaj.spiders.helpers.pdf import pdf_to_text
+
+
+def pico_rss_mb():
+    # ru_maxrss vem em KB no Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def resumo(nome, latencias, paginas, itens):
+    total = sum(latencias)
+    percentis = statistics.quantiles(latencias, n=100) if len(latencias) > 1 else latencias * 99
+    return {
+        'nome': nome,
+        'paginas_s': paginas / total if total else 0.0,
+        'itens_s': itens / total if total else 0.0,
+        'p50_ms': percentis[49] * 1000,
+        'p95_ms': percentis[94] * 1000,
+        'p99_ms': percentis[98] * 1000,
+        'rss_mb': pico_rss_mb(),
+    }
+
+
+def medir_callback(caso, repeticoes):
+    body = ler_fixture(caso.fixture)
+    latencias, itens, produzidos = [], 0, []
+    for _ in range(repeticoes):
+        # Spider nova a cada repetição, para que o estado (ex.: documentos já agendados) não se acumule
+        spider = caso.spider.from_crawler(get_crawler(caso.spider), **caso.argumentos)
+        callback = getattr(spider, caso.callback)
+        t0 = time.perf_counter()
+        resultado = list(callback(resposta(caso, body)) or [])
+        latencias.append(time.perf_counter() - t0)
+        produzidos = [item for item in resultado if not isinstance(item, scrapy.Request)]
+        itens += len(produzidos)
+    return resumo(caso.nome, latencias, repeticoes, itens), produzidos
+
+
+def medir_pipeline(itens, repeticoes):
+    latencias = []
+    for _ in range(repeticoes):
+        pipeline = CsvWriterPipeline(buffer_size=500)
+        t0 = time.perf_counter()
+        for item in itens:
+            pipeline.process_item(item.copy(), None)
+        pipeline.spider_closed(None)
+        latencias.append(time.perf_counter() - t0)
+    return resumo('pipeline.csv', latencias, 0, len(itens) * repeticoes)
+
+
+def medir_pdf(repeticoes):
+    pdf = os.path.join(FIXTURES, 'cposg_documento.pdf')
+    latencias = []
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        pdf_to_text(pdf)
+        latencias.append(time.perf_counter() - t0)
+    return resumo('pdf_to_text', latencias, repeticoes, repeticoes)
+
+
+def imprimir(resultados):
+    print(f'{"caso":<22} {"páginas/s":>10} {"itens/s":>10} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"RSS MB":>8}')
+    for r in resultados:
+        print(f'{r["nome"]:<22} {r["paginas_s"]:>10.1f} {r["itens_s"]:>10.1f} {r["p50_ms"]:>8.3f} '
+              f'{r["p95_ms"]:>8.3f} {r["p99_ms"]:>8.3f} {r["rss_mb"]:>8.1f}')
+
+
+def regressoes(resultados, referencia, tolerancia, folga_ms):
+    anteriores = {r['nome']: r for r in referencia}
+    piores = []
+    for r in resultados:
+        anterior = anteriores.get(r['nome'])
+        # A folga absoluta evita acusar ruído em callbacks que levam frações de ms
+        limite = max(anterior['p95_ms'] * (1 + tolerancia), anterior['p95_ms'] + folga_ms) if anterior else None
+        if limite is not None and r['p95_ms'] > limite:
+            piores.append(f'{r["nome"]}: p95 {anterior["p95_ms"]:.3f} ms -> {r["p95_ms"]:.3f} ms')
+    return piores
+
+
+def main(repeticoes, salvar=None, referencia=None, tolerancia=0.25, folga_ms=0.5):
+    if referencia:
+        with open(referencia, 'r', encoding='utf-8') as file:
+            referencia = json.load(file)
+    if salvar:
+        salvar = os.path.abspath(salvar)
+
+    resultados, itens = [], []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as pasta:
+        os.chdir(pasta)
+        try:
+            for caso in CASOS:
+                resultado, produzidos = medir_callback(caso, repeticoes)
+                resultados.append(resultado)
+                itens.extend(produzidos)
+            resultados.append(medir_pipeline(itens, max(1, repeticoes // 10)))
+            resultados.append(medir_pdf(max(2, repeticoes // 10)))
+        finally:
+            os.chdir(cwd)
+
+    imprimir(resultados)
+    if salvar:
+        with open(salvar, 'w', encoding='utf-8') as file:
+            json.dump(resultados, file, indent=2)
+    if referencia:
+        piores = regressoes(resultados, referencia, tolerancia, folga_ms)
+        for linha in piores:
+            print(f'REGRESSÃO {linha}')
+        return 1 if piores else 0
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeticoes', type=int, default=200)
+    parser.add_argument('--salvar', help='grava os resultados em JSON, para usar como referência depois')
+    parser.add_argument('--referencia', help='JSON de uma execução anterior; sai com erro se algum p95 piorar')
+    parser.add_argument('--tolerancia', type=float, default=0.25,
+                        help='piora aceita no p95 em relação à referência (0.25 = 25%%)')
+    parser.add_argument('--folga-ms', type=float, default=0.5,
+                        help='piora absoluta no p95 sempre aceita, em ms')
+    args = parser.parse_args()
+    sys.exit(main(args.repeticoes, args.salvar, args.referencia, args.tolerancia, args.folga_ms))
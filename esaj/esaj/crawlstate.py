@@ -0,0 +1,195 @@
+import hashlib
+import logging
+import os
+import re
+
+from scrapy import signals
+
+from esaj.signals import csv_flushed, output_pending, parquet_flushed, sqlite_flushed
+
+# Argumentos que identificam uma execução; duas execuções com os mesmos valores
+# continuam o mesmo journal
+ARGUMENTOS_JOB = ('search', 'start_date', 'end_date', 'shard_days', 'page', 'numero_processo', 'numeros_processo',
+                  'process_number', 'process_numbers', 'tribunal', 'incremental')
+
+# Stats que indicam páginas perdidas: a execução não é dada como concluída
+FALHAS = ('retry/max_reached', 'httperror/response_ignored_count', 'spider_exceptions/count', 'sessions/gave_up')
+
+
+def job_id(spider):
+    job = getattr(spider, 'job', None)
+    if not job:
+        valores = [f'{nome}={getattr(spider, nome)}' for nome in ARGUMENTOS_JOB
+                   if isinstance(getattr(spider, nome, None), (str, int))]
+        job = hashlib.sha1('&'.join(valores).encode('utf-8')).hexdigest()[:12]
+    return re.sub(r'[^\w.-]+', '_', str(job))
+
+
+class CrawlState:
+    """Journal das páginas e processos já concluídos por uma execução.
+
+    Cada marca é uma linha de <CRAWL_STATE_DIR>/<spider>-<job>.tsv. Uma marca
+    (Marca) espera os itens da sua página ou processo passarem por todos os
+    pipelines e fica pendente até todas as saídas gravarem esses itens: a cada
+    csv_flushed, parquet_flushed ou sqlite_flushed, os pipelines de saída dizem
+    se ainda guardam linhas fora do disco (output_pending) e só as marcas que
+    ficaram prontas antes da última gravação de cada um vão para o arquivo. O
+    journal nunca fica à frente dos CSVs, do Parquet nem do SQLite, mesmo com
+    itens parados no PdfTextPipeline. Uma
+    execução encerrada com 'finished' grava 'concluido' e a próxima com os
+    mesmos argumentos começa do zero; qualquer outro encerramento (erro, ban,
+    Ctrl-C, requisições que esgotaram as tentativas) é retomado de onde parou.
+    Com `continuo`, o journal nunca é concluído e só acumula marcas (fila que
+    cresce entre execuções, como o data/cjpg.csv lido pelo CPOPG). Com
+    `somente_leitura` (o plano de uma pesquisa, -a plano=1), o journal só é lido.
+    """
+
+    def __init__(self, path, stats=None, continuo=False, somente_leitura=False, signals=None):
+        self.path = path
+        self.stats = stats
+        self.signals = signals
+        self.continuo = continuo
+        self.somente_leitura = somente_leitura
+        self.paginas = {}
+        self.janelas_concluidas = set()
+        self.processos = set()
+        self.pendentes = []
+        # Quantas das pendentes cada pipeline de saída já tem em disco
+        self.gravadas = {}
+        # Itens ainda nos pipelines, por id, com a marca que seguram
+        self.aguardando = {}
+        self.load()
+
+    @classmethod
+    def from_spider(cls, spider, continuo=False, somente_leitura=False):
+        pasta = spider.settings.get('CRAWL_STATE_DIR')
+        if not pasta:
+            return None
+        state = cls(os.path.join(pasta, f'{spider.name}-{job_id(spider)}.tsv'), spider.crawler.stats, continuo,
+                    somente_leitura, spider.crawler.signals)
+        if somente_leitura:
+            return state
+        spider.crawler.signals.connect(state.item_gravado, signal=signals.item_scraped)
+        spider.crawler.signals.connect(state.item_gravado, signal=signals.item_dropped)
+        spider.crawler.signals.connect(state.item_perdido, signal=signals.item_error)
+        spider.crawler.signals.connect(state.commit, signal=csv_flushed)
+        spider.crawler.signals.connect(state.commit, signal=parquet_flushed)
+        spider.crawler.signals.connect(state.commit, signal=sqlite_flushed)
+        spider.crawler.signals.connect(state.spider_closed, signal=signals.spider_closed)
+        return state
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as file:
+            linhas = [linha.rstrip('\n').split('\t') for linha in file]
+        if ['concluido'] in linhas:
+            logging.info(f'Execução anterior de {self.path} foi concluída, começando do zero.')
+            if not self.somente_leitura:
+                os.remove(self.path)
+            return
+        for tipo, *valores in linhas:
+            if tipo == 'pagina':
+                janela, pagina = valores
+                self.paginas[janela] = max(int(pagina), self.paginas.get(janela, 0))
+            elif tipo == 'janela':
+                self.janelas_concluidas.add(valores[0])
+            elif tipo == 'processo':
+                self.processos.add(valores[0])
+        if self.stats:
+            self.stats.set_value('crawlstate/restored_pages', sum(self.paginas.values()))
+            self.stats.set_value('crawlstate/restored_processes', len(self.processos))
+        logging.info(f'Retomando {self.path}: {len(self.paginas)} janelas em andamento, '
+                     f'{len(self.janelas_concluidas)} concluídas, {len(self.processos)} processos concluídos.')
+
+    def ultima_pagina(self, janela):
+        return self.paginas.get(janela, 0)
+
+    def janela_concluida(self, janela):
+        return janela in self.janelas_concluidas
+
+    def processo_concluido(self, numero_processo):
+        return str(numero_processo) in self.processos
+
+    def marcar_pagina(self, janela, pagina, ultima=False):
+        self.paginas[janela] = max(pagina, self.paginas.get(janela, 0))
+        linhas = [('pagina', janela, str(pagina))]
+        if ultima:
+            self.janelas_concluidas.add(janela)
+            linhas.append(('janela', janela))
+        return Marca(self, linhas)
+
+    def marcar_processo(self, numero_processo):
+        self.processos.add(str(numero_processo))
+        return Marca(self, [('processo', str(numero_processo))])
+
+    def item_gravado(self, item, **kwargs):
+        _, marca = self.aguardando.pop(id(item), (None, None))
+        if marca is not None:
+            marca.liberar()
+
+    def item_perdido(self, item, **kwargs):
+        _, marca = self.aguardando.pop(id(item), (None, None))
+        if marca is not None:
+            marca.liberar(perdida=True)
+
+    def commit(self, *args, **kwargs):
+        if not self.pendentes:
+            return
+        respostas = self.signals.send_catch_log(signal=output_pending) if self.signals else []
+        # Uma saída sem nada fora do disco já gravou os itens de todas as pendentes; as outras
+        # ficam no que tinham na última vez
+        for saida, pendente in respostas:
+            if pendente is False:
+                self.gravadas[saida] = len(self.pendentes)
+        gravadas = min((self.gravadas.get(saida, 0) for saida, _ in respostas), default=len(self.pendentes))
+        if not gravadas:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as file:
+            for marca in self.pendentes[:gravadas]:
+                file.write('\t'.join(marca) + '\n')
+        self.pendentes = self.pendentes[gravadas:]
+        self.gravadas = {saida: total - gravadas for saida, total in self.gravadas.items()}
+
+    def spider_closed(self, spider, reason):
+        self.commit()
+        falhas = sum(self.stats.get_value(chave, 0) for chave in FALHAS) if self.stats else 0
+        if reason == 'finished' and not falhas and not self.continuo:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write('concluido\n')
+
+
+class Marca:
+    """Linhas do journal de uma página ou processo, que esperam os seus itens.
+
+    Cada item passado por `item()` (antes do yield) e cada `reter()` seguram a
+    marca, assim como a própria callback até chamar `liberar()` depois do
+    último item. Os itens são soltos pelo sinal item_scraped (ou item_dropped)
+    e as linhas só entram nas pendentes do CrawlState quando nada mais segura
+    a marca. Um item com erro em um pipeline (item_error) perde a marca: a
+    página ou o processo é refeito na próxima execução. Sem CrawlState
+    (`state` None), a marca não faz nada.
+    """
+
+    def __init__(self, state=None, linhas=()):
+        self.state = state
+        self.linhas = linhas
+        self.retida = 1
+        self.perdida = False
+
+    def item(self, item):
+        if self.state is not None:
+            self.reter()
+            self.state.aguardando[id(item)] = (item, self)
+        return item
+
+    def reter(self):
+        self.retida += 1
+
+    def liberar(self, perdida=False):
+        self.perdida = self.perdida or perdida
+        self.retida -= 1
+        if self.retida == 0 and not self.perdida and self.state is not None:
+            self.state.pendentes.extend(self.linhas)
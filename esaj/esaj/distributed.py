@@ -0,0 +1,314 @@
+import base64
+import json
+import logging
+import os
+import sqlite3
+import time
+from urllib.parse import urlparse
+
+from scrapy import signals
+from scrapy.core.scheduler import Scheduler
+from scrapy.exceptions import DontCloseSpider, NotConfigured
+from scrapy.utils.request import request_from_dict
+
+
+def backend(url):
+    """Backend da fila compartilhada a partir de DISTRIBUTED_BACKEND.
+
+    sqlite:///data/fila.sqlite3 (ou sqlite:////caminho/absoluto) para vários
+    processos na mesma máquina e testes; redis://host:6379/0 (ou rediss://) para
+    várias máquinas, em qualquer servidor compatível com Redis.
+    """
+    esquema = urlparse(url).scheme
+    if esquema == 'sqlite':
+        return SqliteBackend(url[len('sqlite:///'):])
+    if esquema in ('redis', 'rediss', 'unix'):
+        return RedisBackend(url)
+    raise ValueError(f'DISTRIBUTED_BACKEND sem suporte: {url}')
+
+
+def serializar(request, spider):
+    """request.to_dict() em JSON: bytes (corpo, cabeçalhos) em base64 e tuplas (ex.: o shard no meta) como listas."""
+    return json.dumps(para_json(request.to_dict(spider=spider)), separators=(',', ':')).encode('utf-8')
+
+
+def desserializar(dados, spider):
+    return request_from_dict(json.loads(dados, object_hook=de_json), spider=spider)
+
+
+def para_json(valor):
+    if isinstance(valor, bytes):
+        return {'__bytes__': base64.b64encode(valor).decode('ascii')}
+    if isinstance(valor, dict):
+        return {chave.decode('latin-1') if isinstance(chave, bytes) else chave: para_json(v) for chave, v in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [para_json(v) for v in valor]
+    return valor
+
+
+def de_json(objeto):
+    if objeto.keys() == {'__bytes__'}:
+        return base64.b64decode(objeto['__bytes__'])
+    return objeto
+
+
+class SqliteBackend:
+    """Fila e conjunto de fingerprints em um banco SQLite compartilhado pelos processos.
+
+    O pop é um único DELETE ... RETURNING, então dois processos nunca recebem
+    a mesma requisição. A coluna `andamento` dos vistos guarda quando a
+    requisição saiu da fila, até a resposta chegar.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        pasta = os.path.dirname(path)
+        if pasta:
+            os.makedirs(pasta, exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS fila (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                                'nome TEXT NOT NULL, prioridade INTEGER NOT NULL, dados BLOB NOT NULL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS ix_fila ON fila (nome, prioridade DESC, id)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS vistos (nome TEXT NOT NULL, fingerprint TEXT NOT NULL, '
+                                'andamento REAL, PRIMARY KEY (nome, fingerprint)) WITHOUT ROWID')
+        # Filas criadas antes da coluna andamento
+        if 'andamento' not in [linha[1] for linha in self.connection.execute('PRAGMA table_info(vistos)')]:
+            self.connection.execute('ALTER TABLE vistos ADD COLUMN andamento REAL')
+
+    def push(self, fila, dados, prioridade=0):
+        self.connection.execute('INSERT INTO fila (nome, prioridade, dados) VALUES (?, ?, ?)', (fila, prioridade, dados))
+
+    def pop(self, fila):
+        linha = self.connection.execute(
+            'DELETE FROM fila WHERE id = (SELECT id FROM fila WHERE nome = ? ORDER BY prioridade DESC, id LIMIT 1) '
+            'RETURNING dados', (fila,)).fetchone()
+        return linha[0] if linha else None
+
+    def vazia(self, fila):
+        return self.connection.execute('SELECT 1 FROM fila WHERE nome = ? LIMIT 1', (fila,)).fetchone() is None
+
+    def tamanho(self, fila):
+        return self.connection.execute('SELECT count(*) FROM fila WHERE nome = ?', (fila,)).fetchone()[0]
+
+    def visto(self, conjunto, fingerprint, expira=None):
+        """Marca o fingerprint; True se ele já estava no conjunto.
+
+        Um fingerprint que saiu da fila antes de `expira` (time.time()) e nunca
+        teve resposta é de uma requisição perdida: volta a valer como novo.
+        """
+        cursor = self.connection.execute(
+            'INSERT INTO vistos (nome, fingerprint) VALUES (?, ?) '
+            'ON CONFLICT (nome, fingerprint) DO UPDATE SET andamento = NULL WHERE andamento < ?',
+            (conjunto, fingerprint, expira if expira is not None else float('-inf')))
+        return cursor.rowcount == 0
+
+    def em_andamento(self, conjunto, fingerprint):
+        self.connection.execute('UPDATE vistos SET andamento = ? WHERE nome = ? AND fingerprint = ?',
+                                (time.time(), conjunto, fingerprint))
+
+    def concluido(self, conjunto, fingerprint):
+        self.connection.execute('UPDATE vistos SET andamento = NULL WHERE nome = ? AND fingerprint = ? '
+                                'AND andamento IS NOT NULL', (conjunto, fingerprint))
+
+    def limpar(self, *nomes):
+        with self.connection:
+            for nome in nomes:
+                self.connection.execute('DELETE FROM fila WHERE nome = ?', (nome,))
+                self.connection.execute('DELETE FROM vistos WHERE nome = ?', (nome,))
+
+    def close(self):
+        self.connection.close()
+
+
+class RedisBackend:
+    """Fila em um sorted set (ZPOPMIN, atômico) e fingerprints em um set (SADD).
+
+    O score ordena pela prioridade da requisição e, dentro dela, pela hora em
+    que entrou na fila. As requisições que saíram da fila e ainda não tiveram
+    resposta ficam em <conjunto>:andamento, um sorted set com a hora do pop.
+    Precisa do pacote `redis` (pip install redis).
+    """
+
+    def __init__(self, url, prefixo='esaj'):
+        try:
+            import redis
+        except ImportError:
+            raise NotConfigured('O backend Redis precisa do pacote redis: pip install redis')
+        self.client = redis.Redis.from_url(url)
+        self.prefixo = prefixo
+
+    def chave(self, nome):
+        return f'{self.prefixo}:{nome}'
+
+    def push(self, fila, dados, prioridade=0):
+        self.client.zadd(self.chave(fila), {dados: -prioridade * 10 ** 13 + time.time() * 1000})
+
+    def pop(self, fila):
+        resultado = self.client.zpopmin(self.chave(fila))
+        return resultado[0][0] if resultado else None
+
+    def vazia(self, fila):
+        return self.tamanho(fila) == 0
+
+    def tamanho(self, fila):
+        return self.client.zcard(self.chave(fila))
+
+    def visto(self, conjunto, fingerprint, expira=None):
+        if self.client.sadd(self.chave(conjunto), fingerprint) == 1:
+            return False
+        if expira is None:
+            return True
+        # Requisição perdida em um processo interrompido; o ZREM garante que só um processo a devolve à fila
+        andamento = self.chave(f'{conjunto}:andamento')
+        desde = self.client.zscore(andamento, fingerprint)
+        return not (desde is not None and desde < expira and self.client.zrem(andamento, fingerprint) == 1)
+
+    def em_andamento(self, conjunto, fingerprint):
+        self.client.zadd(self.chave(f'{conjunto}:andamento'), {fingerprint: time.time()})
+
+    def concluido(self, conjunto, fingerprint):
+        self.client.zrem(self.chave(f'{conjunto}:andamento'), fingerprint)
+
+    def limpar(self, *nomes):
+        self.client.delete(*(self.chave(nome) for nome in nomes), *(self.chave(f'{nome}:andamento') for nome in nomes))
+
+    def close(self):
+        self.client.close()
+
+
+class DistributedScheduler(Scheduler):
+    """Scheduler do Scrapy com as requisições iniciais em uma fila compartilhada.
+
+    Sem DISTRIBUTED_BACKEND, é o Scheduler padrão. Com ele, os processos que
+    alimentam a fila (DISTRIBUTED_FEED) mandam as requisições iniciais da spider
+    (um número de processo do CJPG/CJSG ou de uma lista, uma janela de datas)
+    para <spider>:fila no backend, passando pelo conjunto compartilhado de
+    fingerprints <spider>:vistos, que descarta o que algum processo já colocou
+    na fila, nesta ou em outra execução. Uma requisição que saiu da fila e
+    ficou sem resposta por DISTRIBUTED_INFLIGHT_TIMEOUT segundos (o processo
+    que a tirou foi interrompido) pode entrar na fila de novo. Todos os processos (com
+    DISTRIBUTED_CONSUME) tiram requisições dessa fila quando a fila local está
+    vazia. O que uma requisição gera (show.do, pastadigital, próximas páginas)
+    fica na fila local do processo que a baixou, junto com os cookies da sessão.
+    Um processo só fecha depois de DISTRIBUTED_IDLE_TIMEOUT segundos sem achar
+    nada nas duas filas.
+    """
+
+    def __init__(self, *args, backend=None, feed=False, consume=True, idle_timeout=60, inflight_timeout=3600,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.backend = backend
+        self.feed = feed
+        self.consume = consume
+        self.idle_timeout = idle_timeout
+        self.inflight_timeout = inflight_timeout
+        self.ultima_atividade = time.monotonic()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        scheduler = super().from_crawler(crawler)
+        url = crawler.settings.get('DISTRIBUTED_BACKEND')
+        if url:
+            scheduler.backend = backend(url)
+            scheduler.feed = crawler.settings.getbool('DISTRIBUTED_FEED')
+            scheduler.consume = crawler.settings.getbool('DISTRIBUTED_CONSUME', True)
+            scheduler.idle_timeout = crawler.settings.getfloat('DISTRIBUTED_IDLE_TIMEOUT', 60)
+            scheduler.inflight_timeout = crawler.settings.getfloat('DISTRIBUTED_INFLIGHT_TIMEOUT', 3600)
+            crawler.signals.connect(scheduler.spider_idle, signal=signals.spider_idle)
+            crawler.signals.connect(scheduler.response_received, signal=signals.response_received)
+        return scheduler
+
+    def open(self, spider):
+        resultado = super().open(spider)
+        if self.backend is not None:
+            self.fila = f'{spider.name}:fila'
+            self.vistos = f'{spider.name}:vistos'
+            if self.feed and spider.settings.getbool('DISTRIBUTED_RESET'):
+                logging.warning(f'Limpando a fila e os fingerprints de {spider.name} no backend distribuído.')
+                self.backend.limpar(self.fila, self.vistos)
+            self.ultima_atividade = time.monotonic()
+        return resultado
+
+    def close(self, reason):
+        if self.backend is not None:
+            self.stats.set_value('distributed/queue_size', self.backend.tamanho(self.fila))
+            self.backend.close()
+        return super().close(reason)
+
+    def compartilhada(self, request):
+        return (self.backend is not None and self.feed and request.meta.get('is_start_request')
+                and not request.meta.get('distributed'))
+
+    def enqueue_request(self, request):
+        if not self.compartilhada(request):
+            return super().enqueue_request(request)
+
+        if not request.dont_filter:
+            fingerprint = self.crawler.request_fingerprinter.fingerprint(request).hex()
+            if self.backend.visto(self.vistos, fingerprint, time.time() - self.inflight_timeout):
+                self.stats.inc_value('distributed/filtered')
+                return False
+        else:
+            fingerprint = None
+        # Ao sair da fila compartilhada, retries e redirecionamentos ficam na fila local. O fingerprint
+        # fica no meta para o consumidor marcar a requisição em andamento e depois concluída
+        request.meta['distributed'] = fingerprint or True
+        try:
+            dados = serializar(request, self.spider)
+        except (TypeError, ValueError) as e:
+            logging.warning(f'Requisição {request} não pode ir para a fila compartilhada ({e}), fica na fila local.')
+            self.stats.inc_value('distributed/unserializable')
+            return super().enqueue_request(request)
+        self.backend.push(self.fila, dados, request.priority)
+        self.stats.inc_value('distributed/enqueued')
+        return True
+
+    def next_request(self):
+        request = super().next_request()
+        if request is None and self.backend is not None and self.consume:
+            dados = self.backend.pop(self.fila)
+            try:
+                request = desserializar(dados, self.spider) if dados is not None else None
+            except ValueError as e:
+                # Ex.: fila alimentada por uma versão que gravava as requisições com pickle
+                logging.error(f'Requisição inválida na fila compartilhada, descartada: {e}')
+                self.stats.inc_value('distributed/invalid')
+            if request is not None:
+                if isinstance(request.meta.get('distributed'), str):
+                    self.backend.em_andamento(self.vistos, request.meta['distributed'])
+                self.stats.inc_value('distributed/dequeued')
+                self.stats.inc_value('scheduler/dequeued')
+        if request is not None:
+            self.ultima_atividade = time.monotonic()
+        return request
+
+    def has_pending_requests(self):
+        if super().has_pending_requests():
+            return True
+        return self.backend is not None and self.consume and not self.backend.vazia(self.fila)
+
+    def response_received(self, response, request, spider):
+        fingerprint = request.meta.get('distributed')
+        if isinstance(fingerprint, str) and self.backend is not None:
+            self.backend.concluido(self.vistos, fingerprint)
+
+    def spider_idle(self, spider):
+        # Outro processo ainda pode alimentar a fila (ou gerar retries); espera antes de fechar
+        if self.consume and time.monotonic() - self.ultima_atividade < self.idle_timeout:
+            raise DontCloseSpider
+
+
+class DistributedStartMiddleware:
+    """Nos processos que não alimentam a fila compartilhada, a spider não lê a sua lista de trabalho."""
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.get('DISTRIBUTED_BACKEND') or crawler.settings.getbool('DISTRIBUTED_FEED'):
+            raise NotConfigured
+        return cls()
+
+    async def process_start(self, start):
+        return
+        yield
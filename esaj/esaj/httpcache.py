@@ -0,0 +1,191 @@
+import csv
+import logging
+import os
+import re
+import shutil
+import time
+from pathlib import Path
+from urllib.parse import parse_qs
+
+from scrapy.extensions.httpcache import DummyPolicy, FilesystemCacheStorage
+from scrapy.utils.httpobj import urlparse_cached
+
+from esaj.tribunais import TRIBUNAL_PADRAO, tribunal_do_host
+
+# Páginas de processo do CPOPG/CPOSG; as demais (CJSG/CJPG, que dependem da
+# sessão para paginar, e a pasta digital) nunca passam pelo cache
+ENDPOINT = re.compile(r'/(cpopg|cposg)/(search|show)\.do$')
+PARAMETROS_NUMERO = ('dePesquisa', 'dadosConsulta.valorConsulta')
+
+
+def chave_cache(request):
+    """(endpoint, identificador) da requisição, ou None se ela não é cacheável.
+
+    O search.do é identificado pelo número do processo só com os dígitos e o
+    show.do pelo processo.codigo; o resto da query (conversationId etc.) muda
+    a cada pesquisa e não entra na chave. Fora do TJSP, o endpoint leva o
+    tribunal na frente (tjal/cpopg/show.do), já que o processo.codigo só é
+    único dentro de um e-SAJ.
+    """
+    url = urlparse_cached(request)
+    match = ENDPOINT.search(url.path)
+    if not match:
+        return None
+    parametros = parse_qs(url.query)
+    if match.group(2) == 'search':
+        numero = next((parametros[nome][0] for nome in PARAMETROS_NUMERO if parametros.get(nome, [''])[0]), '')
+        identificador = re.sub(r'\D', '', numero)
+    else:
+        identificador = parametros.get('processo.codigo', [''])[0]
+    if not identificador:
+        return None
+    endpoint = f'{match.group(1)}/{match.group(2)}.do'
+    tribunal = tribunal_do_host(url.hostname)
+    if tribunal and tribunal != TRIBUNAL_PADRAO:
+        endpoint = f'{tribunal}/{endpoint}'
+    return endpoint, identificador
+
+
+class EsajCachePolicy(DummyPolicy):
+    """Cacheia só o search.do/show.do do CPOPG/CPOSG, com validade por endpoint.
+
+    HTTPCACHE_ESAJ_TTL mapeia 'cpopg/show.do' etc. para segundos (0 = não expira).
+    Uma resposta vencida é baixada de novo e substitui a gravada.
+    """
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.ttl = settings.getdict('HTTPCACHE_ESAJ_TTL')
+
+    def should_cache_request(self, request):
+        if request.method != 'GET' or request.meta.get('dont_cache'):
+            return False
+        return super().should_cache_request(request) and chave_cache(request) is not None
+
+    def should_cache_response(self, response, request):
+        return super().should_cache_response(response, request) and response.status in (200, 301, 302)
+
+    def is_cached_response_fresh(self, cachedresponse, request):
+        endpoint, _ = chave_cache(request)
+        # O TTL vale para o endpoint em todos os tribunais (tjal/cpopg/show.do -> cpopg/show.do)
+        ttl = float(self.ttl.get('/'.join(endpoint.split('/')[-2:]), 0))
+        timestamp = request.meta.get('cache_timestamp')
+        return ttl <= 0 or timestamp is None or time.time() - timestamp < ttl
+
+    def is_cached_response_valid(self, cachedresponse, response, request):
+        return False
+
+
+class EsajCacheStorage(FilesystemCacheStorage):
+    """FilesystemCacheStorage com chave pelo processo e tamanho máximo em disco.
+
+    As entradas ficam em <HTTPCACHE_DIR>/<endpoint>/<aa>/<identificador>, ex.:
+    httpcache/cpopg/search.do/10/10012345620238260100.
+    Quando o total passa de HTTPCACHE_ESAJ_MAX_BYTES, as entradas mais antigas
+    são apagadas até sobrar 90% do limite.
+    """
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.max_bytes = settings.getint('HTTPCACHE_ESAJ_MAX_BYTES')
+        self.total_bytes = 0
+
+    def open_spider(self, spider):
+        super().open_spider(spider)
+        self.total_bytes = sum(tamanho for _, _, tamanho in self.entradas(spider))
+
+    def store_response(self, spider, request, response):
+        pasta = Path(self._get_request_path(spider, request))
+        # Uma entrada vencida é sobrescrita no mesmo lugar
+        anterior = self.tamanho(pasta) if pasta.exists() else 0
+        super().store_response(spider, request, response)
+        self.total_bytes += self.tamanho(pasta) - anterior
+        if 0 < self.max_bytes < self.total_bytes:
+            self.evict(spider)
+
+    def _get_request_path(self, spider, request):
+        chave = chave_cache(request)
+        if chave is None:
+            return super()._get_request_path(spider, request)
+        endpoint, identificador = chave
+        return str(Path(self.cachedir, endpoint, identificador[:2], identificador))
+
+    def entradas(self, spider):
+        pasta = Path(self.cachedir)
+        if not pasta.exists():
+            return []
+        return [(meta.stat().st_mtime, meta.parent, self.tamanho(meta.parent))
+                for meta in pasta.rglob('pickled_meta')]
+
+    def tamanho(self, pasta):
+        return sum(arquivo.stat().st_size for arquivo in pasta.iterdir() if arquivo.is_file())
+
+    def evict(self, spider):
+        limite = self.max_bytes * 0.9
+        removidas = 0
+        for _, pasta, tamanho in sorted(self.entradas(spider)):
+            if self.total_bytes <= limite:
+                break
+            shutil.rmtree(pasta, ignore_errors=True)
+            self.total_bytes -= tamanho
+            removidas += 1
+        spider.crawler.stats.inc_value('httpcache/evicted', removidas)
+        logging.info(f'Cache HTTP acima de {self.max_bytes} bytes, {removidas} entradas antigas removidas.')
+
+
+_codigos = {}
+
+
+def codigo_cache(settings, spider_name):
+    """Cache número do processo -> processo.codigo da spider, ou None se desativado."""
+    pasta = settings.get('CODIGO_PROCESSO_CACHE_DIR')
+    if not pasta:
+        return None
+    path = os.path.join(pasta, f'{spider_name}.csv')
+    cache = _codigos.get(path)
+    if cache is None:
+        cache = _codigos[path] = CodigoProcessoCache(path)
+    return cache
+
+
+class CodigoProcessoCache:
+    """Guarda o processo.codigo de cada número já resolvido pelo search.do.
+
+    Com ele, a próxima consulta do mesmo número vai direto ao show.do, sem
+    passar pela pesquisa nem pela lista de processos (.modal__lista-processos).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.codigos = None
+
+    def load(self):
+        self.codigos = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', newline='', encoding='utf-8') as file:
+                for row in csv.DictReader(file):
+                    self.codigos[row['numero_processo']] = row['codigo']
+
+    def get(self, numero_processo):
+        if self.codigos is None:
+            self.load()
+        return self.codigos.get(str(numero_processo).strip())
+
+    def set(self, numero_processo, codigo):
+        numero_processo = str(numero_processo).strip()
+        if not numero_processo or not codigo or self.get(numero_processo) == codigo:
+            return
+        self.codigos[numero_processo] = codigo
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        write_header = not os.path.exists(self.path)
+        with open(self.path, 'a', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file, quoting=csv.QUOTE_NONNUMERIC)
+            if write_header:
+                writer.writerow(['numero_processo', 'codigo'])
+            writer.writerow([numero_processo, codigo])
+
+
+def codigo_da_url(url):
+    match = re.search(r'[?&]processo\.codigo=([^&]+)', url)
+    return match.group(1) if match else None
@@ -7,6 +7,172 @@ import scrapy
 
 
 class EsajItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+    # Arquivo de saída (relativo ao diretório de execução) usado pelos pipelines
+    csv_file = None
+    # Colunas que identificam uma linha e o que fazer quando a chave já existe:
+    # 'append' grava de novo, 'skip' descarta e 'update' sobrescreve a linha gravada
+    key_fields = None
+    on_duplicate = 'append'
+    # Formatos gravados ('csv', 'parquet'); None segue o OUTPUT_FORMATS do settings.py
+    output_formats = None
+    # Coluna de data (dd/mm/aaaa) que define a partição mensal no Parquet
+    partition_field = None
+    # Tribunal das linhas; os itens dos outros tribunais são subclasses com os
+    # próprios arquivos (esaj.tribunais.item_do_tribunal)
+    tribunal = 'tjsp'
+
+
+class CjsgItem(EsajItem):
+    csv_file = 'data/sp/cjsg.csv'
+    key_fields = ('numero_processo',)
+    on_duplicate = 'skip'
+    partition_field = 'data_publicacao'
+
+    numero_processo = scrapy.Field()
+    classe = scrapy.Field()
+    assunto = scrapy.Field()
+    relator_a = scrapy.Field()
+    orgao_julgador = scrapy.Field()
+    comarca = scrapy.Field()
+    data_julgamento = scrapy.Field()
+    data_publicacao = scrapy.Field()
+    ementa = scrapy.Field()
+
+
+class CjpgItem(EsajItem):
+    csv_file = 'data/cjpg.csv'
+    key_fields = ('numero_processo', 'data_disponibilizacao')
+    on_duplicate = 'skip'
+    partition_field = 'data_disponibilizacao'
+
+    numero_processo = scrapy.Field()
+    classe = scrapy.Field()
+    assunto = scrapy.Field()
+    magistrado = scrapy.Field()
+    foro = scrapy.Field()
+    vara = scrapy.Field()
+    data_disponibilizacao = scrapy.Field()
+    ementa = scrapy.Field()
+
+
+class CpopgItem(EsajItem):
+    csv_file = 'data/cpopg.csv'
+    # Processos reconsultados (modo incremental) atualizam a linha em vez de repeti-la
+    key_fields = ('numero_processo',)
+    on_duplicate = 'update'
+
+    numero_processo = scrapy.Field()
+    situacao = scrapy.Field()
+    classe = scrapy.Field()
+    assunto = scrapy.Field()
+    area = scrapy.Field()
+    juiz = scrapy.Field()
+    valor_acao = scrapy.Field()
+    foro = scrapy.Field()
+    vara = scrapy.Field()
+    distribuicao = scrapy.Field()
+    controle = scrapy.Field()
+    partes_processo_1_tipo_participacao = scrapy.Field()
+    partes_processo_1_nome_parte = scrapy.Field()
+    partes_processo_1_advogados = scrapy.Field()
+    partes_processo_2_tipo_participacao = scrapy.Field()
+    partes_processo_2_nome_parte = scrapy.Field()
+    partes_processo_2_advogados = scrapy.Field()
+    outros_assuntos = scrapy.Field()
+    execucao_sentenca = scrapy.Field()
+    processo_principal = scrapy.Field()
+    link_processo_principal = scrapy.Field()
+    numero_processo_apensado = scrapy.Field()
+    link_processo_apensado = scrapy.Field()
+    link_consulta_sg = scrapy.Field()
+
+
+class CpopgParteItem(EsajItem):
+    csv_file = 'data/cpopg_partes.csv'
+    key_fields = ('numero_processo', 'ordem')
+    on_duplicate = 'update'
+
+    numero_processo = scrapy.Field()
+    ordem = scrapy.Field()
+    tipo_participacao = scrapy.Field()
+    nome_parte = scrapy.Field()
+    advogados = scrapy.Field()
+
+
+class CpopgMovimentacaoItem(EsajItem):
+    csv_file = 'data/cpopg_movimentacoes_primeiro_grau.csv'
+
+    numero_processo = scrapy.Field()
+    data = scrapy.Field()
+    titulo = scrapy.Field()
+    descricao = scrapy.Field()
+
+
+class CpopgEstadoItem(EsajItem):
+    # Marca d'água de cada processo, usada pelo modo incremental
+    csv_file = 'data/cpopg_estado.csv'
+    key_fields = ('numero_processo',)
+    on_duplicate = 'update'
+    # Relido pelo próprio modo incremental, fica sempre em CSV
+    output_formats = ('csv',)
+
+    numero_processo = scrapy.Field()
+    ultima_data = scrapy.Field()
+    hash_movimento = scrapy.Field()
+    hash_cabecalho = scrapy.Field()
+    data_consulta = scrapy.Field()
+
+
+class CpopgDeltaItem(EsajItem):
+    csv_file = 'data/cpopg_deltas.csv'
+
+    numero_processo = scrapy.Field()
+    data_consulta = scrapy.Field()
+    movimentos_novos = scrapy.Field()
+    cabecalho_alterado = scrapy.Field()
+
+
+class CposgItem(EsajItem):
+    csv_file = 'data/cposg/cposg.csv'
+    key_fields = ('numero_processo',)
+    on_duplicate = 'update'
+
+    numero_processo = scrapy.Field()
+    situacao = scrapy.Field()
+    classe = scrapy.Field()
+    assunto = scrapy.Field()
+    secao = scrapy.Field()
+    orgao_julgador = scrapy.Field()
+    area = scrapy.Field()
+    relator_a = scrapy.Field()
+    valor_acao = scrapy.Field()
+    comarca = scrapy.Field()
+
+
+class FirstInstanceItem(EsajItem):
+    csv_file = 'data/cposg/first_instance.csv'
+    key_fields = ('numero_processo',)
+    on_duplicate = 'update'
+
+    numero_processo = scrapy.Field()
+    n_processo_1_instancia = scrapy.Field()
+    tipo = scrapy.Field()
+    foro = scrapy.Field()
+    vara = scrapy.Field()
+    juiz = scrapy.Field()
+    obs = scrapy.Field()
+
+
+class CposgMovimentItem(EsajItem):
+    csv_file = 'data/cposg/cposg_moviments.csv'
+    pdf_folder = 'data/cposg/pdf'
+    key_fields = ('numero_processo', 'documento')
+    on_duplicate = 'update'
+
+    pdf_name = scrapy.Field()
+    numero_processo = scrapy.Field()
+    documento = scrapy.Field()
+    titulo = scrapy.Field()
+    descricao = scrapy.Field()
+    processo = scrapy.Field()
+    conteudo = scrapy.Field()
@@ -0,0 +1,109 @@
+import csv
+import logging
+import os
+
+_indexes = {}
+
+
+def key_index(item_cls, persist=False):
+    """Índice de chaves compartilhado (pipeline e spiders) do arquivo de saída do item."""
+    index = _indexes.get(item_cls.csv_file)
+    if index is None:
+        index = KeyIndex(item_cls.csv_file, item_cls.key_fields, persist)
+        index.load()
+        _indexes[item_cls.csv_file] = index
+    return index
+
+
+class KeyIndex:
+    """Conjunto em memória das chaves já gravadas em um CSV.
+
+    É carregado uma única vez por execução, lendo só as colunas da chave. Com
+    `persist`, as chaves também são salvas em `<csv>.idx`, que é usado no lugar
+    do CSV enquanto estiver mais novo que ele.
+    """
+
+    def __init__(self, csv_file, key_fields, persist=False):
+        self.csv_file = csv_file
+        self.key_fields = tuple(key_fields)
+        self.persist = persist
+        self.index_file = f'{csv_file}.idx'
+        self.keys = set()
+
+    def key(self, data):
+        return tuple(normalize(data.get(field)) for field in self.key_fields)
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key):
+        self.keys.add(key)
+
+    def load(self):
+        self.keys = set()
+        if self.persist and self.index_is_fresh():
+            with open(self.index_file, 'r', encoding='utf-8') as file:
+                self.keys = {tuple(line.rstrip('\n').split('\t')) for line in file}
+            return
+
+        if not os.path.exists(self.csv_file) or os.path.getsize(self.csv_file) == 0:
+            return
+        try:
+            with open(self.csv_file, 'r', newline='', encoding='utf-8') as file:
+                for row in csv.DictReader(file):
+                    self.keys.add(self.key(row))
+        except Exception as e:
+            logging.error(f'Error loading key index from {self.csv_file}: {e}')
+
+    def index_is_fresh(self):
+        if not os.path.exists(self.index_file):
+            return False
+        if not os.path.exists(self.csv_file):
+            return False
+        return os.path.getmtime(self.index_file) >= os.path.getmtime(self.csv_file)
+
+    def save(self):
+        if not self.persist or not os.path.exists(self.csv_file):
+            return
+        tmp_file = f'{self.index_file}.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as file:
+            for key in self.keys:
+                file.write('\t'.join(key) + '\n')
+        os.replace(tmp_file, self.index_file)
+
+
+class DocumentLedger:
+    """Documentos (numero_processo, documento) já gravados ou já agendados nesta execução.
+
+    Consultado antes de agendar a primeira das requisições que levam ao PDF.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.scheduled = set()
+
+    def key(self, process_number, document_number):
+        return self.index.key({'numero_processo': process_number, 'documento': document_number})
+
+    def __contains__(self, key):
+        return key in self.index or key in self.scheduled
+
+    def claim(self, process_number, document_number):
+        key = self.key(process_number, document_number)
+        if key in self:
+            return False
+        self.scheduled.add(key)
+        return True
+
+
+def normalize(value):
+    if value is None:
+        return ''
+    value = str(value).strip()
+    # Colunas numéricas relidas pelo pandas podem ter sido gravadas como float
+    if value.endswith('.0') and value[:-2].isdigit():
+        return value[:-2]
+    return value
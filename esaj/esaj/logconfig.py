@@ -0,0 +1,201 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from datetime import datetime
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.log import get_scrapy_root_handler
+
+# Atributos de todo LogRecord; o que passar disso veio de extra= e vai para o JSON
+_PADRAO = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName', 'suppressed'}
+
+_ativo = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Um objeto JSON por linha: horário, nível, logger, mensagem, origem e os extras."""
+
+    def format(self, record):
+        dados = {
+            'time': datetime.fromtimestamp(record.created).astimezone().isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+        }
+        for chave, valor in vars(record).items():
+            if chave not in _PADRAO:
+                # O Scrapy passa extra={'spider': spider}; basta o nome
+                dados[chave] = getattr(valor, 'name', valor) if chave == 'spider' else valor
+        if getattr(record, 'suppressed', 0):
+            dados['suppressed'] = record.suppressed
+        if record.exc_info:
+            dados['exc_info'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            dados['stack_info'] = self.formatStack(record.stack_info)
+        return json.dumps(dados, ensure_ascii=False, default=str)
+
+
+class LimiteRepeticoes(logging.Filter):
+    """Deixa passar no máximo `limite` registros de cada linha de código por `intervalo` segundos.
+
+    Os que passarem disso são descartados e contados; o primeiro registro da
+    janela seguinte sai com o atributo `suppressed` (quantos foram descartados).
+    A chave é o local da chamada e não a mensagem, que nas f-strings muda a cada
+    processo.
+    """
+
+    def __init__(self, limite, intervalo):
+        super().__init__()
+        self.limite = limite
+        self.intervalo = intervalo
+        self.janelas = {}
+
+    def filter(self, record):
+        if self.limite <= 0:
+            return True
+        chave = (record.pathname, record.lineno)
+        agora = time.monotonic()
+        janela = self.janelas.get(chave)
+        if janela is None or agora - janela[0] >= self.intervalo:
+            if janela is not None and janela[2]:
+                record.suppressed = janela[2]
+            self.janelas[chave] = [agora, 1, 0]
+            return True
+        if janela[1] < self.limite:
+            janela[1] += 1
+            return True
+        janela[2] += 1
+        return False
+
+
+class FilaHandler(logging.handlers.QueueHandler):
+    """QueueHandler que deixa a formatação (e o traceback) para a thread do listener.
+
+    Na thread do crawl sobra montar a mensagem, para os argumentos não mudarem
+    antes de o registro ser gravado.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if getattr(record, 'suppressed', 0):
+            record.msg = f'{record.msg} ({record.suppressed} repetições suprimidas)'
+        return record
+
+
+class FilaDeLogs:
+    """QueueHandler no root e os handlers de verdade atrás de um QueueListener."""
+
+    def __init__(self, handlers, limite, intervalo):
+        nivel = min(handler.level for handler in handlers)
+        self.handlers = handlers
+        self.fila = queue.SimpleQueue()
+        self.queue_handler = FilaHandler(self.fila)
+        self.queue_handler.setLevel(nivel)
+        self.queue_handler.addFilter(LimiteRepeticoes(limite, intervalo))
+        self.listener = logging.handlers.QueueListener(self.fila, *handlers, respect_handler_level=True)
+        self.usuarios = 0
+
+        logging.root.addHandler(self.queue_handler)
+        # Logs abaixo do nível dos handlers nem chegam a virar LogRecord
+        logging.root.setLevel(nivel)
+        self.listener.start()
+        atexit.register(self.parar)
+
+    def parar(self):
+        global _ativo
+        if _ativo is self:
+            _ativo = None
+        if self.queue_handler not in logging.root.handlers:
+            return
+        logging.root.removeHandler(self.queue_handler)
+        self.listener.stop()
+        # O que for logado depois do crawl (estatísticas, erros no fim do processo) vai direto
+        for handler in self.handlers:
+            logging.root.addHandler(handler)
+        logging.root.setLevel(logging.NOTSET)
+
+
+class QueueLogging:
+    """Tira a escrita dos logs da thread do reactor.
+
+    Os handlers do log (o arquivo LOG_FILE, com rotação por tamanho e um JSON
+    por linha, e o console) passam a ficar atrás de um QueueListener; no root
+    fica só um QueueHandler, com o LimiteRepeticoes. Na thread do crawl, um log
+    custa montar a mensagem e colocá-la na fila. A troca é feita quando o engine
+    começa, depois de o Scrapy instalar o handler dele, e desfeita quando o
+    último crawler do processo termina, com a fila esvaziada.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('LOG_ENABLED') or not settings.getbool('LOG_QUEUE_ENABLED'):
+            raise NotConfigured
+        extension = cls(settings)
+        crawler.signals.connect(extension.engine_started, signal=signals.engine_started)
+        crawler.signals.connect(extension.engine_stopped, signal=signals.engine_stopped)
+        return extension
+
+    def engine_started(self):
+        global _ativo
+        # O handler que o Scrapy instala (de novo a cada crawler) dá lugar à fila
+        scrapy_handler = get_scrapy_root_handler()
+        if scrapy_handler is not None and scrapy_handler in logging.root.handlers:
+            logging.root.removeHandler(scrapy_handler)
+        if _ativo is None:
+            _ativo = FilaDeLogs(handlers(self.settings, scrapy_handler),
+                                self.settings.getint('LOG_RATE_LIMIT', 20),
+                                self.settings.getfloat('LOG_RATE_LIMIT_INTERVAL', 60))
+        elif scrapy_handler is not None and scrapy_handler not in _ativo.handlers:
+            scrapy_handler.close()
+        _ativo.usuarios += 1
+
+    def engine_stopped(self):
+        if _ativo is None:
+            return
+        _ativo.usuarios -= 1
+        if _ativo.usuarios <= 0:
+            _ativo.parar()
+
+
+def handlers(settings, scrapy_handler):
+    nivel = settings.get('LOG_LEVEL')
+    texto = logging.Formatter(settings.get('LOG_FORMAT'), settings.get('LOG_DATEFORMAT'))
+    arquivo = settings.get('LOG_FILE')
+    if not arquivo:
+        # Sem arquivo, o console do Scrapy (com cores, se houver) continua igual
+        return [scrapy_handler or logging.StreamHandler()]
+
+    if scrapy_handler is not None:
+        scrapy_handler.close()
+    rotativo = logging.handlers.RotatingFileHandler(
+        arquivo,
+        mode='a' if settings.getbool('LOG_FILE_APPEND', True) else 'w',
+        maxBytes=settings.getint('LOG_MAX_BYTES'),
+        backupCount=settings.getint('LOG_BACKUP_COUNT'),
+        encoding=settings.get('LOG_ENCODING'),
+    )
+    rotativo.setFormatter(JsonFormatter() if settings.getbool('LOG_JSON') else texto)
+    rotativo.setLevel(nivel)
+    lista = [rotativo]
+
+    console = settings.get('LOG_CONSOLE_LEVEL')
+    if console:
+        stream = logging.StreamHandler(sys.stderr)
+        stream.setFormatter(texto)
+        stream.setLevel(console)
+        lista.append(stream)
+    return lista
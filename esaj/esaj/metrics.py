@@ -0,0 +1,359 @@
+import asyncio
+import functools
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager, nullcontext
+from urllib.parse import urlparse
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.httpobj import urlparse_cached
+from twisted.internet import task
+
+# Limites (em segundos) dos buckets dos histogramas, como no Prometheus
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float('inf'))
+
+_registros = {}
+
+
+def registro(crawler):
+    """Métricas do crawler, ou None quando o MetricsExtension está desligado."""
+    return _registros.get(id(crawler))
+
+
+def endpoint(url_or_request):
+    # https://esaj.tjsp.jus.br/cposg/show.do?... -> cposg/show.do
+    path = urlparse_cached(url_or_request).path if hasattr(url_or_request, 'meta') else urlparse(url_or_request).path
+    return '/'.join(path.strip('/').split('/')[-2:])
+
+
+@contextmanager
+def medir(crawler, nome, **labels):
+    """Soma a duração do bloco ao histograma `nome` (no-op sem o MetricsExtension)."""
+    metrics = registro(crawler) if crawler is not None else None
+    if metrics is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe(nome, labels, time.perf_counter() - inicio)
+
+
+def cronometrado(etapa):
+    """Decorator do process_item de um pipeline: histograma 'pipeline' com stage=<etapa>."""
+    def decorador(metodo):
+        if asyncio.iscoroutinefunction(metodo):
+            @functools.wraps(metodo)
+            async def envolvido(self, item, spider):
+                with medir_etapa(etapa, item, spider):
+                    return await metodo(self, item, spider)
+        else:
+            @functools.wraps(metodo)
+            def envolvido(self, item, spider):
+                with medir_etapa(etapa, item, spider):
+                    return metodo(self, item, spider)
+        return envolvido
+    return decorador
+
+
+def medir_etapa(etapa, item, spider):
+    crawler = getattr(spider, 'crawler', None)
+    if crawler is None or registro(crawler) is None:
+        return nullcontext()
+    return medir(crawler, 'pipeline', spider=spider.name, stage=etapa, item=type(item).__name__)
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, valor):
+        self.count += 1
+        self.sum += valor
+        for i, limite in enumerate(BUCKETS):
+            if valor <= limite:
+                self.buckets[i] += 1
+                break
+
+    def quantile(self, q):
+        # Interpolação linear dentro do bucket, como o histogram_quantile do Prometheus
+        alvo = q * self.count
+        acumulado = 0
+        for i, quantidade in enumerate(self.buckets):
+            if quantidade and acumulado + quantidade >= alvo:
+                inferior = BUCKETS[i - 1] if i else 0.0
+                superior = BUCKETS[i] if BUCKETS[i] != float('inf') else inferior
+                return inferior + (superior - inferior) * (alvo - acumulado) / quantidade
+            acumulado += quantidade
+        return 0.0
+
+
+class Metrics:
+    """Histogramas e contadores de uma execução, por nome e labels."""
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.profiler = None
+        self.profile_sample = 0.0
+
+    def observe(self, nome, labels, segundos):
+        chave = (nome, tuple(labels.items()))
+        histogram = self.histograms.get(chave)
+        if histogram is None:
+            histogram = self.histograms[chave] = Histogram()
+        histogram.observe(segundos)
+
+    def inc(self, nome, labels, valor=1):
+        chave = (nome, tuple(labels.items()))
+        self.counters[chave] = self.counters.get(chave, 0) + valor
+
+    def callback_profiler(self):
+        # Só uma amostra das respostas passa pelo cProfile (METRICS_PROFILE_SAMPLE)
+        if self.profiler is not None and hasattr(self.profiler, 'enable') and random.random() < self.profile_sample:
+            return self.profiler
+        return None
+
+
+class MetricsExtension:
+    """Junta as métricas de callbacks, downloads, pipelines e extração de PDF.
+
+    A cada METRICS_INTERVAL segundos, e no fechamento, copia contagem, soma e
+    p50/p95/p99 de cada histograma para as stats (metrics/<nome>/<labels>/...)
+    e grava tudo, mais as stats numéricas do Scrapy, no formato texto do
+    Prometheus em <METRICS_PROMETHEUS_DIR>/<spider>.prom (para o textfile
+    collector do node_exporter). Com METRICS_PROFILE=cprofile, uma amostra dos
+    callbacks roda sob o cProfile; com pyinstrument, a execução inteira é
+    amostrada. O relatório vai para <METRICS_PROMETHEUS_DIR>/<spider>.profile*.
+    """
+
+    def __init__(self, crawler, interval, folder, profile, profile_sample):
+        self.crawler = crawler
+        self.interval = interval
+        self.folder = folder
+        self.profile = profile
+        self.metrics = _registros[id(crawler)] = Metrics()
+        self.metrics.profile_sample = profile_sample
+        self.task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('METRICS_ENABLED'):
+            raise NotConfigured
+        extension = cls(
+            crawler,
+            crawler.settings.getfloat('METRICS_INTERVAL', 60),
+            crawler.settings.get('METRICS_PROMETHEUS_DIR', 'data/metrics'),
+            crawler.settings.get('METRICS_PROFILE', '').lower(),
+            crawler.settings.getfloat('METRICS_PROFILE_SAMPLE', 0.05),
+        )
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(extension.response_received, signal=signals.response_received)
+        crawler.signals.connect(extension.item_scraped, signal=signals.item_scraped)
+        return extension
+
+    def spider_opened(self, spider):
+        self.start_profiler()
+        if self.interval > 0:
+            self.task = task.LoopingCall(self.dump, spider)
+            self.task.start(self.interval, now=False)
+
+    def spider_closed(self, spider, reason):
+        if self.task is not None and self.task.running:
+            self.task.stop()
+        self.stop_profiler(spider)
+        self.dump(spider)
+        _registros.pop(id(self.crawler), None)
+
+    def response_received(self, response, request, spider):
+        self.metrics.inc('responses', {'spider': spider.name, 'endpoint': endpoint(request), 'status': response.status})
+
+    def item_scraped(self, item, response, spider):
+        self.metrics.inc('items', {'spider': spider.name, 'item': type(item).__name__})
+
+    def start_profiler(self):
+        if self.profile == 'cprofile':
+            import cProfile
+            self.metrics.profiler = cProfile.Profile()
+        elif self.profile == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                logging.error('METRICS_PROFILE=pyinstrument, mas o pyinstrument não está instalado (pip install pyinstrument).')
+                return
+            self.metrics.profiler = Profiler(async_mode='disabled')
+            self.metrics.profiler.start()
+        elif self.profile:
+            logging.warning(f'METRICS_PROFILE desconhecido: {self.profile} (use cprofile ou pyinstrument).')
+
+    def stop_profiler(self, spider):
+        profiler = self.metrics.profiler
+        if profiler is None:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        path = os.path.join(self.folder, f'{spider.name}.profile')
+        if self.profile == 'cprofile':
+            import pstats
+            profiler.dump_stats(f'{path}.pstats')
+            with open(f'{path}.txt', 'w', encoding='utf-8') as file:
+                pstats.Stats(profiler, stream=file).sort_stats('cumulative').print_stats(40)
+        else:
+            profiler.stop()
+            with open(f'{path}.txt', 'w', encoding='utf-8') as file:
+                file.write(profiler.output_text(unicode=True, color=False))
+        logging.info(f'Perfil da execução gravado em {path}.*')
+
+    def dump(self, spider):
+        stats = self.crawler.stats
+        for (nome, labels), histogram in list(self.metrics.histograms.items()):
+            prefixo = '/'.join(['metrics', nome] + [str(valor) for _, valor in labels])
+            stats.set_value(f'{prefixo}/count', histogram.count)
+            stats.set_value(f'{prefixo}/sum_ms', round(histogram.sum * 1000, 3))
+            for q in (0.5, 0.95, 0.99):
+                stats.set_value(f'{prefixo}/p{int(q * 100)}_ms', round(histogram.quantile(q) * 1000, 3))
+        for (nome, labels), valor in list(self.metrics.counters.items()):
+            stats.set_value('/'.join(['metrics', nome] + [str(v) for _, v in labels]), valor)
+        self.write_prometheus(spider)
+
+    def write_prometheus(self, spider):
+        linhas = []
+        for (nome, labels), histogram in sorted(self.metrics.histograms.items()):
+            acumulado = 0
+            for limite, quantidade in zip(BUCKETS, histogram.buckets):
+                acumulado += quantidade
+                le = '+Inf' if limite == float('inf') else repr(limite)
+                linhas.append(f'esaj_{nome}_seconds_bucket{formatar_labels(labels, le=le)} {acumulado}')
+            linhas.append(f'esaj_{nome}_seconds_sum{formatar_labels(labels)} {histogram.sum}')
+            linhas.append(f'esaj_{nome}_seconds_count{formatar_labels(labels)} {histogram.count}')
+        for (nome, labels), valor in sorted(self.metrics.counters.items(), key=lambda par: str(par[0])):
+            linhas.append(f'esaj_{nome}_total{formatar_labels(labels)} {valor}')
+        for chave, valor in sorted(self.crawler.stats.get_stats().items()):
+            if isinstance(valor, (int, float)) and not isinstance(valor, bool) and not chave.startswith('metrics/'):
+                linhas.append(f'esaj_scrapy_stat{formatar_labels((("spider", spider.name), ("stat", chave)))} {valor}')
+
+        os.makedirs(self.folder, exist_ok=True)
+        path = os.path.join(self.folder, f'{spider.name}.prom')
+        # Troca atômica: o collector nunca lê um arquivo pela metade
+        with open(f'{path}.tmp', 'w', encoding='utf-8') as file:
+            file.write('\n'.join(linhas) + '\n')
+        os.replace(f'{path}.tmp', path)
+
+
+def formatar_labels(labels, **extras):
+    pares = list(labels) + list(extras.items())
+    if not pares:
+        return ''
+    valores = ','.join(f'{nome}="{str(valor).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                       for nome, valor in pares)
+    return '{' + valores + '}'
+
+
+class CallbackTimingMiddleware:
+    """Mede o tempo gasto dentro de cada callback (histograma 'callback').
+
+    Os callbacks são geradores: o tempo é somado a cada item ou requisição
+    que eles produzem, sem contar o que o Scrapy faz com a saída.
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('METRICS_ENABLED'):
+            raise NotConfigured
+        return cls(crawler)
+
+    def labels(self, response, spider):
+        callback = getattr(response.request, 'callback', None) if response.request is not None else None
+        return {'spider': spider.name, 'callback': getattr(callback, '__name__', 'parse'),
+                'endpoint': endpoint(response.url)}
+
+    def process_spider_output(self, response, result, spider):
+        metrics = registro(self.crawler)
+        if metrics is None:
+            yield from result
+            return
+        profiler = metrics.callback_profiler()
+        total = 0.0
+        iterator = iter(result)
+        try:
+            while True:
+                inicio = time.perf_counter()
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    saida = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+                    total += time.perf_counter() - inicio
+                yield saida
+        finally:
+            metrics.observe('callback', self.labels(response, spider), total)
+
+    async def process_spider_output_async(self, response, result, spider):
+        metrics = registro(self.crawler)
+        profiler = metrics.callback_profiler() if metrics is not None else None
+        total = 0.0
+        iterator = result.__aiter__()
+        try:
+            while True:
+                inicio = time.perf_counter()
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    saida = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+                    total += time.perf_counter() - inicio
+                yield saida
+        finally:
+            if metrics is not None:
+                metrics.observe('callback', self.labels(response, spider), total)
+
+
+class DownloadTimingMiddleware:
+    """Histogramas 'download' (latência do e-SAJ) e 'wait' (fila do slot,
+    ritmo do RateControl/PDF e novas tentativas) por endpoint."""
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('METRICS_ENABLED'):
+            raise NotConfigured
+        return cls(crawler)
+
+    def process_request(self, request, spider):
+        request.meta.setdefault('metrics_start', time.perf_counter())
+        return None
+
+    def process_response(self, request, response, spider):
+        inicio = request.meta.pop('metrics_start', None)
+        metrics = registro(self.crawler)
+        if inicio is None or metrics is None or 'cached' in response.flags:
+            return response
+        total = time.perf_counter() - inicio
+        latencia = request.meta.get('download_latency', 0.0)
+        labels = {'spider': spider.name, 'endpoint': endpoint(request)}
+        metrics.observe('download', labels, latencia)
+        metrics.observe('wait', labels, max(0.0, total - latencia))
+        return response
+
+    def process_exception(self, request, exception, spider):
+        request.meta.pop('metrics_start', None)
+        return None
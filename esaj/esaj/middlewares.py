@@ -3,23 +3,89 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import time
+
 from scrapy import signals
+from scrapy.utils.defer import maybe_deferred_to_future
+from scrapy.utils.httpobj import urlparse_cached
+from twisted.internet.defer import DeferredSemaphore
+from twisted.internet.task import deferLater
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
+class PdfSlot:
+    def __init__(self, concurrency):
+        self.semaphore = DeferredSemaphore(concurrency)
+        self.next_start = 0.0
+
+    def reserve(self, delay):
+        # Returns how long the caller must wait for its turn and books the next one
+        now = time.monotonic()
+        wait = max(0.0, self.next_start - now)
+        self.next_start = now + wait + delay
+        return wait
+
+
 class PdfDownloadDelayMiddleware:
-    def __init__(self, delay):
+    """Paces PDF downloads without blocking the reactor.
+
+    Only PDF requests wait, on a Deferred, for a free place among
+    PDF_CONCURRENT_REQUESTS and for PDF_DOWNLOAD_DELAY seconds since the last
+    PDF started in the same slot; HTML pages are passed through untouched.
+    """
+
+    def __init__(self, delay, concurrency):
         self.delay = delay
+        self.concurrency = concurrency
+        self.slots = {}
 
     @classmethod
     def from_crawler(cls, crawler):
         delay = crawler.settings.getfloat('PDF_DOWNLOAD_DELAY', 3.0)
-        return cls(delay)
+        concurrency = crawler.settings.getint('PDF_CONCURRENT_REQUESTS', 1)
+        return cls(delay, concurrency)
+
+    def is_pdf_request(self, request):
+        path = urlparse_cached(request).path
+        return path.endswith('.pdf') or path.endswith('/getPDF.do')
+
+    def get_slot(self, request):
+        key = request.meta.get('download_slot') or urlparse_cached(request).hostname
+        if key not in self.slots:
+            self.slots[key] = PdfSlot(self.concurrency)
+        return key, self.slots[key]
+
+    async def process_request(self, request, spider):
+        # A retry or redirect built by RetryMiddleware/RedirectMiddleware (above
+        # this one) skips our process_response and comes back with the permit of
+        # the original request in its meta: give it back before taking a new one
+        self.release(request)
+        if not self.is_pdf_request(request):
+            return None
+
+        from twisted.internet import reactor
+
+        key, slot = self.get_slot(request)
+        await maybe_deferred_to_future(slot.semaphore.acquire())
+        request.meta['pdf_slot'] = key
+
+        wait = slot.reserve(self.delay)
+        if wait > 0:
+            await maybe_deferred_to_future(deferLater(reactor, wait, lambda: None))
+        return None
 
-    def process_request(self, request, spider):
-        if request.url.endswith('.pdf'):
-            time.sleep(self.delay)
+    def process_response(self, request, response, spider):
+        self.release(request)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        self.release(request)
+
+    def release(self, request):
+        key = request.meta.pop('pdf_slot', None)
+        if key is not None:
+            self.slots[key].semaphore.release()
 
 class EsajSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
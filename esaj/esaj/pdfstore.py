@@ -0,0 +1,90 @@
+import csv
+import hashlib
+import os
+
+_stores = {}
+
+
+def pdf_store(root):
+    store = _stores.get(root)
+    if store is None:
+        store = _stores[root] = PdfStore(root)
+    return store
+
+
+class PdfStore:
+    """PDFs gravados pelo hash SHA-256 do conteúdo, em subpastas <aa>/<bb>/.
+
+    O manifest.csv liga (numero_processo, documento) ao hash, e o texto extraído
+    de cada PDF fica ao lado dele em <hash>.txt, então um mesmo documento é
+    gravado e lido uma única vez. Nomes antigos (uuid na raiz da pasta)
+    continuam resolvidos por `path`.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.manifest_file = os.path.join(root, 'manifest.csv')
+        self.manifest = None
+
+    def shard(self, pdf_hash):
+        return os.path.join(self.root, pdf_hash[:2], pdf_hash[2:4])
+
+    def path(self, pdf_name):
+        sharded = os.path.join(self.shard(pdf_name), f'{pdf_name}.pdf')
+        legacy = os.path.join(self.root, f'{pdf_name}.pdf')
+        if not os.path.exists(sharded) and os.path.exists(legacy):
+            return legacy
+        return sharded
+
+    def text_path(self, pdf_name):
+        return os.path.join(self.shard(pdf_name), f'{pdf_name}.txt')
+
+    def put(self, body):
+        pdf_hash = hashlib.sha256(body).hexdigest()
+        pdf_path = self.path(pdf_hash)
+        if not os.path.exists(pdf_path):
+            os.makedirs(os.path.dirname(pdf_path), exist_ok=True)
+            tmp_path = f'{pdf_path}.tmp'
+            with open(tmp_path, 'wb') as pdf_file:
+                pdf_file.write(body)
+            os.replace(tmp_path, pdf_path)
+        return pdf_hash
+
+    def load_manifest(self):
+        self.manifest = {}
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file, 'r', newline='', encoding='utf-8') as file:
+                for row in csv.DictReader(file):
+                    self.manifest[(row['numero_processo'], row['documento'])] = row['sha256']
+
+    def lookup(self, process_number, document_number):
+        if self.manifest is None:
+            self.load_manifest()
+        return self.manifest.get((str(process_number), str(document_number)))
+
+    def record(self, process_number, document_number, pdf_hash):
+        key = (str(process_number), str(document_number))
+        if self.lookup(*key) == pdf_hash:
+            return
+        self.manifest[key] = pdf_hash
+
+        os.makedirs(self.root, exist_ok=True)
+        write_header = not os.path.exists(self.manifest_file)
+        with open(self.manifest_file, 'a', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file, quoting=csv.QUOTE_NONNUMERIC)
+            if write_header:
+                writer.writerow(['numero_processo', 'documento', 'sha256'])
+            writer.writerow([*key, pdf_hash])
+
+    def cached_text(self, pdf_name):
+        text_path = self.text_path(pdf_name)
+        if not os.path.exists(text_path):
+            return None
+        with open(text_path, 'r', encoding='utf-8') as file:
+            return file.read()
+
+    def save_text(self, pdf_name, text):
+        text_path = self.text_path(pdf_name)
+        os.makedirs(os.path.dirname(text_path), exist_ok=True)
+        with open(text_path, 'w', encoding='utf-8') as file:
+            file.write(text)
@@ -3,11 +3,447 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
+import asyncio
+import csv
+import logging
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
 
+from esaj.items import CposgMovimentItem
+from esaj.keyindex import key_index
+from esaj.metrics import cronometrado, medir
+from esaj.pdfstore import pdf_store
+from esaj.saidas import COLUNAS_TEXTO, caminho_parquet, formatos, particao_mes
+from esaj.signals import csv_flushed, output_pending, parquet_flushed, sqlite_flushed
+from esaj.spiders.helpers.pdf import pdf_to_text
+from esaj.sqlitestore import sqlite_store
+
 
 class EsajPipeline:
     def process_item(self, item, spider):
         return item
+
+
+class PdfTextPipeline:
+    """Extrai o texto dos PDFs do CPOSG em um pool de processos.
+
+    O item fica aguardando no pipeline enquanto o PDF é lido em outro processo,
+    sem parar o reactor. PDF_EXTRACT_MAX_PENDING limita quantos PDFs podem
+    estar na fila do pool ao mesmo tempo. O texto fica em cache no PdfStore,
+    então um PDF idêntico não é lido de novo.
+    """
+
+    def __init__(self, workers, max_pending, crawler=None):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.crawler = crawler
+        self.executor = None
+        self.pending = None
+        # Extrações em andamento por hash, para PDFs iguais chegando juntos
+        self.in_flight = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        workers = crawler.settings.getint('PDF_EXTRACT_WORKERS') or os.cpu_count() or 1
+        max_pending = crawler.settings.getint('PDF_EXTRACT_MAX_PENDING') or workers * 2
+        return cls(workers, max_pending, crawler)
+
+    def open_spider(self, spider):
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.pending = asyncio.Semaphore(self.max_pending)
+
+    def close_spider(self, spider):
+        self.executor.shutdown()
+
+    @cronometrado('pdf_text')
+    async def process_item(self, item, spider):
+        if not isinstance(item, CposgMovimentItem) or item.get('conteudo') or not item.get('pdf_name'):
+            return item
+
+        store = pdf_store(item.pdf_folder)
+        pdf_name = item['pdf_name']
+        text = store.cached_text(pdf_name)
+        if text is not None:
+            item['conteudo'] = text
+            return item
+
+        if pdf_name not in self.in_flight:
+            self.in_flight[pdf_name] = asyncio.ensure_future(self.extract(store, pdf_name))
+        try:
+            item['conteudo'] = await asyncio.shield(self.in_flight[pdf_name])
+        except Exception as e:
+            logging.error(f'Error extracting text from PDF {store.path(pdf_name)}: {e}')
+        return item
+
+    async def extract(self, store, pdf_name):
+        try:
+            async with self.pending:
+                with medir(self.crawler, 'pdf_extract', spider=self.crawler.spider.name if self.crawler else ''):
+                    future = self.executor.submit(pdf_to_text, store.path(pdf_name))
+                    text = await asyncio.wrap_future(future)
+            store.save_text(pdf_name, text)
+            return text
+        finally:
+            self.in_flight.pop(pdf_name, None)
+
+
+class CsvWriterPipeline:
+    """Acumula os itens em memória e anexa ao CSV em blocos de tamanho fixo.
+
+    Cada item é escrito uma única vez (append), então o custo por item não
+    cresce com o tamanho do arquivo de saída. Itens com `key_fields` são
+    conferidos contra o índice de chaves: repetidos são descartados ('skip') ou
+    guardados e aplicados em uma regravação do arquivo junto com a próxima
+    gravação dos buffers ('update').
+    """
+
+    def __init__(self, buffer_size, persist_index=False, crawler=None, formats=('csv',)):
+        self.buffer_size = buffer_size
+        self.crawler = crawler
+        self.formats = formats
+        self.persist_index = persist_index
+        self.buffers = {}
+        self.fieldnames = {}
+        self.pending = {}
+        self.updates = {}
+        self.indexes = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        pipeline = cls(
+            crawler.settings.getint('CSV_BUFFER_SIZE', 500),
+            crawler.settings.getbool('KEY_INDEX_PERSIST', False),
+            crawler,
+            crawler.settings.getlist('OUTPUT_FORMATS', ['csv']),
+        )
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(pipeline.output_pending, signal=output_pending)
+        return pipeline
+
+    def output_pending(self, *args, **kwargs):
+        return any(self.buffers.values()) or any(self.updates.values())
+
+    @cronometrado('csv')
+    def process_item(self, item, spider):
+        csv_file = getattr(item, 'csv_file', None)
+        if csv_file is None or 'csv' not in formatos(item, self.formats):
+            return item
+
+        if csv_file not in self.fieldnames:
+            self.fieldnames[csv_file] = self.read_header(csv_file) or list(item.fields)
+
+        row = ItemAdapter(item).asdict()
+        if item.key_fields and item.on_duplicate != 'append':
+            index = self.indexes.get(csv_file)
+            if index is None:
+                index = self.indexes[csv_file] = key_index(type(item), self.persist_index)
+
+            key = index.key(row)
+            if key in index:
+                if item.on_duplicate == 'update':
+                    self.upsert(csv_file, key, row)
+                    if sum(map(len, self.updates.values())) >= self.buffer_size:
+                        self.flush_all()
+                return item
+            index.add(key)
+            self.pending.setdefault(csv_file, {})[key] = row
+
+        buffer = self.buffers.setdefault(csv_file, [])
+        buffer.append(row)
+        if len(buffer) >= self.buffer_size:
+            self.flush_all()
+        return item
+
+    def upsert(self, csv_file, key, row):
+        buffered = self.pending.get(csv_file, {}).get(key)
+        if buffered is not None:
+            buffered.update(row)
+        else:
+            self.updates.setdefault(csv_file, {}).setdefault(key, {}).update(row)
+
+    def spider_closed(self, spider):
+        self.flush_all()
+        for index in self.indexes.values():
+            index.save()
+
+    def flush_all(self):
+        # Todos os arquivos de uma vez, para que quem escuta csv_flushed (ex.: CrawlState)
+        # saiba que nada do que já passou pelo pipeline está só em memória
+        for csv_file in list(self.buffers):
+            self.flush(csv_file)
+        # Chaves que já estavam no disco: as atualizações não podem ficar para o fechamento
+        for csv_file in list(self.updates):
+            self.apply_updates(csv_file)
+        if self.crawler is not None:
+            self.crawler.signals.send_catch_log(signal=csv_flushed)
+
+    def read_header(self, csv_file):
+        if not os.path.exists(csv_file) or os.path.getsize(csv_file) == 0:
+            return None
+        with open(csv_file, 'r', newline='', encoding='utf-8') as file:
+            return next(csv.reader(file), None)
+
+    def flush(self, csv_file):
+        rows = self.buffers.pop(csv_file, [])
+        self.pending.pop(csv_file, None)
+        if not rows:
+            return
+
+        data_folder = os.path.dirname(csv_file)
+        if data_folder and not os.path.exists(data_folder):
+            os.makedirs(data_folder)
+
+        try:
+            with medir(self.crawler, 'flush', stage='csv', file=csv_file):
+                self.append_rows(csv_file, rows)
+        except Exception as e:
+            logging.error(
+                f"Ocorreu um erro ao gravar {len(rows)} linhas no CSV. Arquivo CSV: {csv_file}. Erro: {e}\n"
+                f"Rastreamento de pilha:\n{traceback.format_exc()}")
+
+    def append_rows(self, csv_file, rows):
+        write_header = not os.path.exists(csv_file) or os.path.getsize(csv_file) == 0
+        with open(csv_file, 'a', newline='', encoding='utf-8') as file:
+            writer = csv.DictWriter(file, fieldnames=self.fieldnames[csv_file], restval='',
+                                    extrasaction='ignore', quoting=csv.QUOTE_NONNUMERIC)
+            if write_header:
+                writer.writeheader()
+            writer.writerows(rows)
+
+    def apply_updates(self, csv_file):
+        updates = self.updates.pop(csv_file, {})
+        if not updates or not os.path.exists(csv_file):
+            return
+
+        index = self.indexes[csv_file]
+        tmp_file = f'{csv_file}.tmp'
+        try:
+            with open(csv_file, 'r', newline='', encoding='utf-8') as source, \
+                    open(tmp_file, 'w', newline='', encoding='utf-8') as target:
+                reader = csv.DictReader(source)
+                writer = csv.DictWriter(target, fieldnames=reader.fieldnames, restval='',
+                                        extrasaction='ignore', quoting=csv.QUOTE_NONNUMERIC)
+                writer.writeheader()
+                for row in reader:
+                    update = updates.get(index.key(row))
+                    if update:
+                        row.update(update)
+                    writer.writerow(row)
+            os.replace(tmp_file, csv_file)
+        except Exception as e:
+            logging.error(
+                f"Ocorreu um erro ao atualizar {len(updates)} linhas do CSV. Arquivo CSV: {csv_file}. Erro: {e}\n"
+                f"Rastreamento de pilha:\n{traceback.format_exc()}")
+
+
+class ParquetWriterPipeline:
+    """Grava os itens em datasets Parquet, quando 'parquet' está em OUTPUT_FORMATS.
+
+    Cada saída vira <PARQUET_DIR>/<caminho do CSV>/spider=<nome>/mes=<aaaa-mm>/,
+    com o mês tirado de `partition_field` (data_publicacao no CJSG,
+    data_disponibilizacao no CJPG). As linhas entram no arquivo em row groups de
+    PARQUET_ROW_GROUP_SIZE, comprimidos com zstd; as colunas curtas usam
+    dicionário e as de texto longo (ementa, conteudo) só o zstd. O arquivo em
+    andamento começa com '.', invisível para quem lê o dataset. A cada
+    PARQUET_FILE_ROWS linhas recebidas (e no fechamento) todos os arquivos em
+    andamento são fechados e renomeados e o pipeline envia parquet_flushed,
+    para o journal (CrawlState) avançar sem nunca ficar à frente do Parquet.
+    As linhas só são acrescentadas: repetições de uma chave são resolvidas na
+    leitura (esaj.saidas.ler_tabela).
+    """
+
+    def __init__(self, folder, row_group_size, compression_level, crawler=None, file_rows=100000):
+        self.folder = folder
+        self.row_group_size = row_group_size
+        self.compression_level = compression_level
+        self.crawler = crawler
+        self.file_rows = file_rows
+        self.run_id = f'{time.strftime("%Y%m%d%H%M%S")}-{os.getpid()}'
+        self.sequence = 0
+        # Linhas recebidas desde que os arquivos foram fechados pela última vez
+        self.rows = 0
+        self.buffers = {}
+        self.writers = {}
+        self.schemas = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if 'parquet' not in crawler.settings.getlist('OUTPUT_FORMATS', ['csv']):
+            raise NotConfigured
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            logging.error("OUTPUT_FORMATS inclui 'parquet', mas o pyarrow não está instalado (pip install pyarrow).")
+            raise NotConfigured
+        pipeline = cls(
+            crawler.settings.get('PARQUET_DIR', 'data/parquet'),
+            crawler.settings.getint('PARQUET_ROW_GROUP_SIZE', 10000),
+            crawler.settings.getint('PARQUET_ZSTD_LEVEL', 6),
+            crawler,
+            crawler.settings.getint('PARQUET_FILE_ROWS', 100000),
+        )
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(pipeline.output_pending, signal=output_pending)
+        return pipeline
+
+    def output_pending(self, *args, **kwargs):
+        return bool(self.buffers or self.writers)
+
+    @cronometrado('parquet')
+    def process_item(self, item, spider):
+        csv_file = getattr(item, 'csv_file', None)
+        if csv_file is None or 'parquet' not in formatos(item, ['parquet']):
+            return item
+
+        if csv_file not in self.schemas:
+            import pyarrow as pa
+            self.schemas[csv_file] = pa.schema([(name, pa.string()) for name in item.fields])
+
+        row = ItemAdapter(item).asdict()
+        partition = (csv_file, spider.name,
+                     particao_mes(row.get(item.partition_field)) if item.partition_field else None)
+        buffer = self.buffers.setdefault(partition, [])
+        buffer.append(row)
+        self.rows += 1
+        if self.rows >= self.file_rows:
+            self.flush_all()
+        elif len(buffer) >= self.row_group_size:
+            self.write_row_group(partition)
+        return item
+
+    def partition_folder(self, partition):
+        csv_file, spider_name, month = partition
+        folder = os.path.join(caminho_parquet(csv_file, self.folder), f'spider={spider_name}')
+        return os.path.join(folder, f'mes={month}') if month else folder
+
+    def write_row_group(self, partition):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        rows = self.buffers.pop(partition, [])
+        if not rows:
+            return
+        schema = self.schemas[partition[0]]
+        columns = {name: [None if row.get(name) is None else str(row[name]) for row in rows] for name in schema.names}
+        table = pa.Table.from_pydict(columns, schema=schema)
+
+        try:
+            writer = self.writers.get(partition)
+            if writer is None:
+                folder = self.partition_folder(partition)
+                os.makedirs(folder, exist_ok=True)
+                self.sequence += 1
+                path = os.path.join(folder, f'.part-{self.run_id}-{self.sequence:05d}.parquet')
+                writer = pq.ParquetWriter(
+                    path, schema, compression='zstd', compression_level=self.compression_level,
+                    use_dictionary=[name for name in schema.names if name not in COLUNAS_TEXTO])
+                self.writers[partition] = (writer, path)
+            else:
+                writer, _ = writer
+            with medir(self.crawler, 'flush', stage='parquet', file=partition[0]):
+                writer.write_table(table, row_group_size=self.row_group_size)
+        except Exception as e:
+            logging.error(
+                f"Ocorreu um erro ao gravar {len(rows)} linhas no Parquet. Partição: {self.partition_folder(partition)}. "
+                f"Erro: {e}\nRastreamento de pilha:\n{traceback.format_exc()}")
+
+    def flush_all(self):
+        for partition in list(self.buffers):
+            self.write_row_group(partition)
+        for partition in list(self.writers):
+            self.close_writer(partition)
+        self.rows = 0
+        if self.crawler is not None:
+            self.crawler.signals.send_catch_log(signal=parquet_flushed)
+
+    def close_writer(self, partition):
+        writer, path = self.writers.pop(partition)
+        writer.close()
+        folder, name = os.path.split(path)
+        os.replace(path, os.path.join(folder, name[1:]))
+
+    def spider_closed(self, spider):
+        self.flush_all()
+
+
+class SqliteWriterPipeline:
+    """Grava os itens no banco SQLite (esaj/sqlitestore.py), quando 'sqlite' está em OUTPUT_FORMATS.
+
+    As linhas são acumuladas por tabela e gravadas em transações de até
+    SQLITE_BATCH_SIZE linhas, e também a cada csv_flushed. Cada transação
+    gravada envia sqlite_flushed, para o journal (CrawlState) avançar mesmo
+    sem o CSV; as linhas de uma transação que falhou continuam no buffer e
+    são tentadas de novo na próxima gravação, sem o journal passar à frente.
+    """
+
+    def __init__(self, path, batch_size, crawler=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.crawler = crawler
+        self.store = None
+        self.buffers = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if 'sqlite' not in crawler.settings.getlist('OUTPUT_FORMATS', ['csv']):
+            raise NotConfigured
+        pipeline = cls(
+            crawler.settings.get('SQLITE_PATH', 'data/esaj.sqlite3'),
+            crawler.settings.getint('SQLITE_BATCH_SIZE', 1000),
+            crawler,
+        )
+        crawler.signals.connect(pipeline.flush_all, signal=csv_flushed)
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(pipeline.output_pending, signal=output_pending)
+        return pipeline
+
+    def open_spider(self, spider):
+        self.store = sqlite_store(self.path)
+
+    def output_pending(self, *args, **kwargs):
+        return any(self.buffers.values())
+
+    @cronometrado('sqlite')
+    def process_item(self, item, spider):
+        if getattr(item, 'csv_file', None) is None or 'sqlite' not in formatos(item, ['sqlite']):
+            return item
+
+        buffer = self.buffers.setdefault(type(item), [])
+        buffer.append(ItemAdapter(item).asdict())
+        # Depois de uma transação que falhou, a nova tentativa espera outro lote
+        if len(buffer) % self.batch_size == 0:
+            self.flush(type(item))
+        return item
+
+    def flush(self, item_cls):
+        rows = self.buffers.get(item_cls)
+        if not rows:
+            return
+        try:
+            with medir(self.crawler, 'flush', stage='sqlite', file=item_cls.csv_file):
+                self.store.write(item_cls, rows)
+        except Exception as e:
+            # A transação foi desfeita: as linhas ficam no buffer e output_pending segura o journal
+            logging.error(
+                f"Ocorreu um erro ao gravar {len(rows)} linhas no SQLite. Tabela: {item_cls.csv_file}. Erro: {e}\n"
+                f"Rastreamento de pilha:\n{traceback.format_exc()}")
+            return
+        del self.buffers[item_cls]
+        if self.crawler is not None:
+            self.crawler.signals.send_catch_log(signal=sqlite_flushed)
+
+    def flush_all(self, *args, **kwargs):
+        for item_cls in list(self.buffers):
+            self.flush(item_cls)
+
+    def spider_closed(self, spider):
+        self.flush_all()
+        self.store.close()
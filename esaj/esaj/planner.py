@@ -0,0 +1,161 @@
+import json
+import logging
+import os
+from datetime import timedelta
+
+from esaj.crawlstate import job_id
+from esaj.tribunais import TRIBUNAL_PADRAO
+
+# Latência usada na estimativa enquanto nenhuma sondagem trouxe download_latency
+LATENCIA_PADRAO = 1.0
+
+RITMOS = {'inicial': 'no ritmo inicial', 'maximo': 'no ritmo máximo', 'fixo': 'com o DOWNLOAD_DELAY'}
+
+
+def ritmos(settings, familia):
+    """(nome, delay, concorrência) dos ritmos usados na estimativa de tempo.
+
+    Com o RATE_CONTROL_ENABLED, o slot da família começa no start_delay com a
+    concorrência mínima e, com o portal respondendo bem, chega ao min_delay
+    com a concorrência máxima: a estimativa sai entre os dois. Sem ele, vale o
+    DOWNLOAD_DELAY com CONCURRENT_REQUESTS_PER_DOMAIN.
+    """
+    limites = settings.getdict('RATE_CONTROL_FAMILIES').get(familia)
+    if settings.getbool('RATE_CONTROL_ENABLED') and limites:
+        inicial = min(max(limites['start_delay'], limites['min_delay']), limites['max_delay'])
+        return [('inicial', inicial, limites['min_concurrency']),
+                ('maximo', limites['min_delay'], limites['max_concurrency'])]
+    return [('fixo', settings.getfloat('DOWNLOAD_DELAY'), settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN'))]
+
+
+def duracao(janelas, delay, concorrencia, latencia):
+    """Segundos para baixar as janelas de um tribunal (um slot do downloader).
+
+    As páginas de uma janela saem uma depois da outra (cada uma vem da
+    anterior), então só janelas diferentes andam em paralelo. O slot solta no
+    máximo uma requisição a cada `delay` e mantém até `concorrencia` em voo.
+    """
+    if not janelas:
+        return 0.0
+    requisicoes = sum(janela['requisicoes'] for janela in janelas)
+    paralelas = max(1, min(concorrencia, len(janelas)))
+    por_segundo = paralelas / latencia
+    if delay > 0:
+        por_segundo = min(por_segundo, 1 / delay)
+    # A janela mais longa não termina antes de baixar as suas páginas em sequência
+    mais_longa = max(janela['requisicoes'] for janela in janelas) * max(latencia, delay)
+    return max(requisicoes / por_segundo, mais_longa)
+
+
+class PlanoCrawl:
+    """Plano de uma pesquisa do CJSG/CJPG montado a partir da primeira página de cada janela.
+
+    Cada janela (data inicial/final e tribunal) registra o total de resultados
+    e de páginas; as que passam de max_pages entram como divididas e as suas
+    metades são sondadas também, como na pesquisa de verdade. Quando a última
+    janela esperada responde, o plano sai no log com o número de requisições e
+    o tempo estimado nos ritmos do settings.py, e vai para
+    <PLAN_DIR>/<spider>-<job>.json.
+    """
+
+    def __init__(self, spider, warmup=True, nivel=logging.INFO):
+        self.spider = spider
+        self.warmup = warmup
+        self.nivel = nivel
+        self.janelas = {}
+        self.esperadas = set()
+        self.latencias = []
+        self.relatado = False
+
+    def esperar(self, chave):
+        if chave not in self.janelas:
+            self.esperadas.add(chave)
+
+    def registrar(self, chave, tribunal, shard, resultados, paginas, concluidas=0, latencia=None, dividida=False):
+        restantes = max(0, (paginas or 0) - concluidas)
+        # Aquecimento da sessão e a pesquisa; depois uma requisição por página que falta (a primeira
+        # vem na pesquisa, a não ser quando a janela é retomada do meio)
+        requisicoes = int(self.warmup) + 1 + restantes - (1 if concluidas == 0 else 0) if restantes else 0
+        self.janelas[chave] = {
+            'tribunal': tribunal,
+            'inicio': shard[0] if shard else None,
+            'fim': shard[1] if shard else None,
+            'resultados': resultados,
+            'paginas': paginas,
+            'paginas_concluidas': concluidas,
+            'dividida': dividida,
+            'requisicoes': 0 if dividida else requisicoes,
+        }
+        if latencia is not None:
+            self.latencias.append(latencia)
+        self.esperadas.discard(chave)
+        if not self.esperadas and not self.relatado:
+            self.relatar()
+
+    @property
+    def finais(self):
+        # Janelas que serão paginadas (as divididas viram as suas metades)
+        return [janela for janela in self.janelas.values() if not janela['dividida']]
+
+    @property
+    def latencia(self):
+        return sum(self.latencias) / len(self.latencias) if self.latencias else LATENCIA_PADRAO
+
+    def resumo(self):
+        finais = self.finais
+        settings = self.spider.settings
+        tribunais = sorted({janela['tribunal'] for janela in finais})
+        estimativas = {}
+        for nome, delay, concorrencia in ritmos(settings, self.spider.name):
+            # Cada tribunal tem o seu slot (esaj/ratecontrol.py), então andam em paralelo
+            segundos = max((duracao([j for j in finais if j['tribunal'] == t], delay, concorrencia, self.latencia)
+                            for t in tribunais), default=0.0)
+            estimativas[nome] = {'delay': delay, 'concorrencia': concorrencia, 'segundos': round(segundos)}
+        return {
+            'spider': self.spider.name,
+            'pesquisa': getattr(self.spider, 'search', None),
+            'tribunais': tribunais,
+            'resultados': sum(janela['resultados'] or 0 for janela in finais),
+            'paginas': sum(max(0, (janela['paginas'] or 0) - janela['paginas_concluidas']) for janela in finais),
+            'janelas': len(finais),
+            'janelas_divididas': len(self.janelas) - len(finais),
+            'janelas_sem_resposta': len(self.esperadas),
+            'requisicoes': sum(janela['requisicoes'] for janela in finais),
+            'latencia_media': round(self.latencia, 3),
+            'estimativas': estimativas,
+            'plano': [dict(janela, chave=chave) for chave, janela in sorted(self.janelas.items())],
+        }
+
+    def relatar(self):
+        self.relatado = True
+        resumo = self.resumo()
+        stats = self.spider.crawler.stats
+        for chave in ('resultados', 'paginas', 'janelas', 'requisicoes'):
+            stats.set_value(f'plan/{chave}', resumo[chave])
+        tempos = []
+        for nome, estimativa in resumo['estimativas'].items():
+            stats.set_value(f'plan/eta_seconds/{nome}', estimativa['segundos'])
+            tempos.append(f'{timedelta(seconds=estimativa["segundos"])} {RITMOS[nome]} '
+                          f'(delay {estimativa["delay"]}s, concorrência {estimativa["concorrencia"]})')
+        linhas = [f'Plano de {resumo["spider"]} ({", ".join(resumo["tribunais"]) or TRIBUNAL_PADRAO}): '
+                  f'{resumo["resultados"]} resultados em {resumo["paginas"]} páginas, {resumo["janelas"]} janelas '
+                  f'({resumo["janelas_divididas"]} divididas), {resumo["requisicoes"]} requisições, '
+                  f'latência média {resumo["latencia_media"]}s.',
+                  f'Tempo estimado: {"; ".join(tempos)}.']
+        if resumo['janelas_sem_resposta']:
+            linhas.append(f'{resumo["janelas_sem_resposta"]} janelas não responderam e ficaram fora do plano.')
+        caminho = self.salvar(resumo)
+        if caminho:
+            linhas.append(f'Janelas em {caminho}.')
+        logging.log(self.nivel, '\n'.join(linhas))
+        return resumo
+
+    def salvar(self, resumo):
+        pasta = self.spider.settings.get('PLAN_DIR')
+        if not pasta:
+            return None
+        os.makedirs(pasta, exist_ok=True)
+        caminho = os.path.join(pasta, f'{self.spider.name}-{job_id(self.spider)}.json')
+        with open(caminho, 'w', encoding='utf-8') as arquivo:
+            json.dump(resumo, arquivo, ensure_ascii=False, indent=2)
+        return caminho
@@ -0,0 +1,167 @@
+import logging
+import re
+
+from scrapy.core.downloader import Slot
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.httpobj import urlparse_cached
+from twisted.internet.error import TCPTimedOutError, TimeoutError
+
+from esaj.tribunais import TRIBUNAL_PADRAO, tribunal_do_host
+
+FAMILIAS = ('cjsg', 'cjpg', 'cpopg', 'cposg', 'pastadigital')
+
+# Páginas de bloqueio costumam ser curtas; acima disso o marcador não é procurado
+TAMANHO_MAXIMO_BLOQUEIO = 20000
+
+
+def familia(request):
+    partes = urlparse_cached(request).path.strip('/').split('/')
+    return partes[0] if partes and partes[0] in FAMILIAS else None
+
+
+class RitmoFamilia:
+    """Delay e concorrência de uma família de endpoints, ajustados em AIMD.
+
+    Cada janela de respostas boas (tantas quanto a concorrência atual) primeiro
+    reduz o delay em `passo` até o mínimo e depois soma 1 à concorrência.
+    Um 429/5xx, timeout ou página de bloqueio dobra o delay e divide a
+    concorrência por dois; latência média acima do alvo tira 1 da concorrência
+    (ou aumenta o delay em 25% quando ela já está no mínimo).
+    """
+
+    def __init__(self, nome, start_delay, min_delay, max_delay, min_concurrency, max_concurrency,
+                 target_latency, passo=0.25):
+        self.nome = nome
+        self.min_delay, self.max_delay = min_delay, max_delay
+        self.min_concurrency, self.max_concurrency = min_concurrency, max_concurrency
+        self.target_latency = target_latency
+        self.passo = passo
+        self.delay = min(max(start_delay, min_delay), max_delay)
+        self.concurrency = min_concurrency
+        self.latencia = None
+        self.sucessos = 0
+        self.penalidades = 0
+
+    def sucesso(self, latencia):
+        self.latencia = latencia if self.latencia is None else 0.7 * self.latencia + 0.3 * latencia
+        if self.latencia > self.target_latency:
+            self.sucessos = 0
+            if self.concurrency > self.min_concurrency:
+                self.concurrency -= 1
+            else:
+                self.delay = min(self.max_delay, self.delay * 1.25)
+            return
+
+        self.sucessos += 1
+        if self.sucessos < self.concurrency:
+            return
+        self.sucessos = 0
+        if self.delay > self.min_delay:
+            self.delay = max(self.min_delay, self.delay - self.passo)
+        elif self.concurrency < self.max_concurrency:
+            self.concurrency += 1
+
+    def penalidade(self):
+        self.sucessos = 0
+        self.penalidades += 1
+        self.delay = min(self.max_delay, max(self.delay * 2, self.min_delay, self.passo))
+        self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+
+
+class RateControlMiddleware:
+    """Coloca cada família do e-SAJ (cjsg, cjpg, cpopg, cposg, pastadigital) no
+    seu próprio slot do downloader e ajusta delay e concorrência de cada slot
+    pelas respostas que ele recebe, dentro dos limites de RATE_CONTROL_FAMILIES.
+
+    Cada tribunal é um servidor diferente: fora do TJSP, a família ganha um
+    ritmo e um slot próprios (tjal-cjsg), com os mesmos limites.
+    O estado atual de cada família fica nas stats ratecontrol/<família>/*.
+    """
+
+    def __init__(self, crawler, limites, marcadores, tamanho_minimo, jitter=0.0):
+        self.crawler = crawler
+        self.jitter = jitter
+        self.limites = limites
+        self.familias = {nome: RitmoFamilia(nome, **limites[nome]) for nome in FAMILIAS if nome in limites}
+        self.marcadores = re.compile('|'.join(re.escape(m) for m in marcadores).encode('utf-8'), re.I) \
+            if marcadores else None
+        self.tamanho_minimo = tamanho_minimo
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('RATE_CONTROL_ENABLED'):
+            raise NotConfigured
+        return cls(
+            crawler,
+            crawler.settings.getdict('RATE_CONTROL_FAMILIES'),
+            crawler.settings.getlist('RATE_CONTROL_BLOCK_MARKERS'),
+            crawler.settings.getint('RATE_CONTROL_BLANK_BYTES', 512),
+            0.5 if crawler.settings.getbool('RANDOMIZE_DOWNLOAD_DELAY') else 0.0,
+        )
+
+    def ritmo(self, request):
+        base = familia(request)
+        if base not in self.limites:
+            return None
+        tribunal = tribunal_do_host(urlparse_cached(request).hostname)
+        nome = base if tribunal in (None, TRIBUNAL_PADRAO) else f'{tribunal}-{base}'
+        if nome not in self.familias:
+            self.familias[nome] = RitmoFamilia(nome, **self.limites[base])
+        return self.familias[nome]
+
+    def process_request(self, request, spider):
+        ritmo = self.ritmo(request)
+        if ritmo is None:
+            return None
+        request.meta.setdefault('download_slot', f'esaj-{ritmo.nome}')
+        self.aplicar(request.meta['download_slot'], ritmo)
+        return None
+
+    def process_response(self, request, response, spider):
+        ritmo = self.ritmo(request)
+        if ritmo is None or 'cached' in response.flags:
+            return response
+
+        if response.status == 429 or response.status >= 500 or self.bloqueio(response):
+            ritmo.penalidade()
+            self.crawler.stats.inc_value(f'ratecontrol/{ritmo.nome}/penalties')
+            logging.warning(f'e-SAJ {ritmo.nome}: resposta {response.status} em {response.url}, '
+                            f'delay {ritmo.delay:.2f}s e concorrência {ritmo.concurrency}.')
+        else:
+            ritmo.sucesso(request.meta.get('download_latency', 0.0))
+        self.aplicar(request.meta.get('download_slot'), ritmo)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        ritmo = self.ritmo(request)
+        if ritmo is not None and isinstance(exception, (TimeoutError, TCPTimedOutError)):
+            ritmo.penalidade()
+            self.crawler.stats.inc_value(f'ratecontrol/{ritmo.nome}/penalties')
+            self.aplicar(request.meta.get('download_slot'), ritmo)
+        return None
+
+    def bloqueio(self, response):
+        # Captcha ou página em branco no lugar do HTML esperado
+        content_type = response.headers.get('Content-Type', b'').lower()
+        if response.status != 200 or b'html' not in content_type:
+            return False
+        if len(response.body.strip()) < self.tamanho_minimo:
+            return True
+        return (self.marcadores is not None and len(response.body) < TAMANHO_MAXIMO_BLOQUEIO
+                and self.marcadores.search(response.body) is not None)
+
+    def aplicar(self, chave, ritmo):
+        if chave is None:
+            return
+        slots = self.crawler.engine.downloader.slots
+        slot = slots.get(chave)
+        if slot is None:
+            slot = slots[chave] = Slot(ritmo.concurrency, ritmo.delay, self.jitter)
+        slot.delay = ritmo.delay
+        slot.concurrency = ritmo.concurrency
+
+        stats = self.crawler.stats
+        stats.set_value(f'ratecontrol/{ritmo.nome}/delay', round(ritmo.delay, 3))
+        stats.set_value(f'ratecontrol/{ritmo.nome}/concurrency', ritmo.concurrency)
+        if ritmo.latencia is not None:
+            stats.set_value(f'ratecontrol/{ritmo.nome}/latency_ms', round(ritmo.latencia * 1000))
@@ -0,0 +1,173 @@
+import csv
+import hashlib
+import logging
+import os
+import re
+
+# Colunas de texto longo: o dicionário só aumentaria o arquivo, ficam só com zstd
+COLUNAS_TEXTO = ('ementa', 'conteudo', 'descricao')
+
+DATA = re.compile(r'(\d{2})/(\d{2})/(\d{4})')
+
+
+def formatos(item, padrao):
+    """Formatos em que o item é gravado: os do próprio item ou os de OUTPUT_FORMATS."""
+    return item.output_formats or padrao
+
+
+def caminho_parquet(csv_file, pasta='data/parquet'):
+    """Dataset Parquet correspondente a um CSV de saída.
+
+    data/sp/cjsg.csv -> <pasta>/sp/cjsg, com as partições spider=<nome>/mes=<aaaa-mm>
+    dentro dele.
+    """
+    relativo = os.path.relpath(os.path.splitext(csv_file)[0], 'data')
+    return os.path.join(pasta, relativo)
+
+
+def particao_mes(valor):
+    match = DATA.search(valor or '')
+    return f'{match.group(3)}-{match.group(2)}' if match else 'sem_data'
+
+
+def dataset_parquet(caminho, pasta='data/parquet'):
+    import pyarrow.dataset as ds
+
+    if caminho.endswith('.csv'):
+        caminho = caminho_parquet(caminho, pasta)
+    if not os.path.exists(caminho):
+        raise FileNotFoundError(caminho)
+    return ds.dataset(caminho, format='parquet', partitioning='hive')
+
+
+def ler_coluna(caminho, coluna, pasta='data/parquet'):
+    """Valores de uma coluna de uma saída em CSV ou Parquet, em streaming.
+
+    `caminho` pode ser o CSV, um arquivo .parquet ou a pasta do dataset. Quando
+    o CSV não existe, lê o dataset Parquet equivalente (caminho_parquet). O CSV
+    é lido linha a linha sem montar um dict por linha, então o primeiro valor
+    sai antes de o arquivo (com as ementas) ser lido inteiro.
+    """
+    if caminho.endswith('.csv') and os.path.exists(caminho):
+        with open(caminho, 'r', newline='', encoding='utf-8') as arquivo:
+            leitor = csv.reader(arquivo)
+            cabecalho = next(leitor, [])
+            if coluna not in cabecalho:
+                raise ValueError(f'{caminho} não tem a coluna {coluna}')
+            posicao = cabecalho.index(coluna)
+            for linha in leitor:
+                if len(linha) > posicao:
+                    yield linha[posicao]
+        return
+
+    for lote in dataset_parquet(caminho, pasta).to_batches(columns=[coluna]):
+        yield from lote.column(0).to_pylist()
+
+
+def ler_tabela(item_cls, colunas=None, pasta='data/parquet'):
+    """DataFrame de uma saída (CSV ou Parquet) com uma linha por chave.
+
+    O Parquet só recebe linhas novas, então as versões de uma mesma chave
+    (key_fields) são resolvidas aqui como no CsvWriterPipeline: 'skip' fica
+    com a primeira e 'update' com a última.
+    """
+    import pandas as pd
+
+    if os.path.exists(item_cls.csv_file):
+        tabela = pd.read_csv(item_cls.csv_file, usecols=colunas, dtype=str, keep_default_na=False)
+    else:
+        tabela = dataset_parquet(item_cls.csv_file, pasta).to_table(columns=colunas).to_pandas()
+    if item_cls.key_fields and item_cls.on_duplicate != 'append' and set(item_cls.key_fields) <= set(tabela.columns):
+        manter = 'first' if item_cls.on_duplicate == 'skip' else 'last'
+        tabela = tabela.drop_duplicates(list(item_cls.key_fields), keep=manter, ignore_index=True)
+    return tabela
+
+
+def mesclar(pastas, destino='data'):
+    """Junta as saídas em CSV de vários nós do crawl distribuído em `destino`.
+
+    Cada pasta é a data/ de um nó. Para cada item, de cada tribunal, os CSVs
+    correspondentes (incluindo o que já estiver em `destino`) viram um só, sem
+    repetições.
+    """
+    from esaj.items import EsajItem
+    from esaj.tribunais import TRIBUNAIS, item_do_tribunal
+
+    for item_cls in (item_do_tribunal(item_cls, tribunal)
+                     for item_cls in EsajItem.__subclasses__() for tribunal in TRIBUNAIS):
+        relativo = os.path.relpath(item_cls.csv_file, 'data')
+        alvo = os.path.join(destino, relativo)
+        origens = []
+        for caminho in [alvo, *(os.path.join(pasta, relativo) for pasta in pastas)]:
+            if os.path.exists(caminho) and os.path.abspath(caminho) not in map(os.path.abspath, origens):
+                origens.append(caminho)
+        if origens:
+            linhas = mesclar_csv(item_cls, origens, alvo)
+            logging.info(f'{alvo}: {linhas} linhas de {len(origens)} arquivos.')
+
+
+def mesclar_csv(item_cls, origens, destino):
+    """Escreve em `destino` as linhas dos CSVs `origens`, na ordem, sem repetições.
+
+    Com key_fields, a chave decide como no CsvWriterPipeline: 'skip' fica com a
+    primeira linha e 'update' com a última. Sem chave (partes, movimentações),
+    as linhas de um processo vêm só do primeiro arquivo que tem esse processo,
+    já que dois nós que consultaram o mesmo processo gravaram o mesmo bloco; sem
+    a coluna numero_processo, só linhas idênticas são descartadas. Os arquivos
+    são lidos em streaming; em memória ficam as chaves (ou um hash de cada linha).
+    """
+    from esaj.keyindex import normalize
+
+    colunas = []
+    for origem in origens:
+        with open(origem, 'r', newline='', encoding='utf-8') as arquivo:
+            colunas += [coluna for coluna in next(csv.reader(arquivo), []) if coluna not in colunas]
+
+    chaves = item_cls.key_fields if item_cls.key_fields and item_cls.on_duplicate != 'append' else None
+
+    def identificar(linha):
+        if chaves:
+            return tuple(normalize(linha.get(campo)) for campo in chaves)
+        return hashlib.blake2b('\x1f'.join(linha.get(coluna) or '' for coluna in colunas).encode('utf-8'),
+                               digest_size=16).digest()
+
+    def linhas():
+        for numero, origem in enumerate(origens):
+            with open(origem, 'r', newline='', encoding='utf-8') as arquivo:
+                for linha in csv.DictReader(arquivo):
+                    yield numero, linha
+
+    # Primeira passada: posição da última versão de cada chave ('update') ou
+    # primeiro arquivo de cada processo (sem chave)
+    ultimas = donos = None
+    if chaves and item_cls.on_duplicate == 'update':
+        ultimas = {identificar(linha): posicao for posicao, (_, linha) in enumerate(linhas())}
+    elif not chaves and 'numero_processo' in colunas:
+        donos = {}
+        for numero, linha in linhas():
+            donos.setdefault(normalize(linha.get('numero_processo')), numero)
+
+    gravadas = 0
+    vistas = set()
+    temporario = f'{destino}.tmp'
+    os.makedirs(os.path.dirname(destino) or '.', exist_ok=True)
+    with open(temporario, 'w', newline='', encoding='utf-8') as arquivo:
+        writer = csv.DictWriter(arquivo, fieldnames=colunas, restval='', extrasaction='ignore',
+                                quoting=csv.QUOTE_NONNUMERIC)
+        writer.writeheader()
+        for posicao, (numero, linha) in enumerate(linhas()):
+            if donos is not None:
+                if donos[normalize(linha.get('numero_processo'))] != numero:
+                    continue
+            elif ultimas is not None:
+                if ultimas[identificar(linha)] != posicao:
+                    continue
+            else:
+                chave = identificar(linha)
+                if chave in vistas:
+                    continue
+                vistas.add(chave)
+            writer.writerow(linha)
+            gravadas += 1
+    os.replace(temporario, destino)
+    return gravadas
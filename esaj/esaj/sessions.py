@@ -0,0 +1,61 @@
+import logging
+
+import scrapy
+
+
+class SessionPool:
+    """Uma sessão do e-SAJ (cookiejar próprio) por pesquisa ou janela de datas.
+
+    A paginação do CJSG/CJPG (trocaDePagina.do) depende do estado guardado na
+    sessão pela última pesquisa, então cada janela precisa do seu cookiejar para
+    várias pesquisas paginarem em paralelo no mesmo crawler. Antes da pesquisa,
+    a sessão é aquecida com um GET na página do formulário (ESAJ_SESSION_WARMUP).
+    Quando uma página volta sem resultados nem paginação, a sessão expirou: a
+    janela ganha um cookiejar novo e a pesquisa é refeita, seguindo até a página
+    que faltava, no máximo ESAJ_SESSION_MAX_RENEWALS vezes.
+    """
+
+    def __init__(self, warmup_url=None, max_renewals=3, stats=None):
+        self.warmup_url = warmup_url
+        self.max_renewals = max_renewals
+        self.stats = stats
+        self.geracoes = {}
+
+    @classmethod
+    def from_spider(cls, spider, warmup_url):
+        settings = spider.settings
+        return cls(
+            warmup_url if settings.getbool('ESAJ_SESSION_WARMUP', True) else None,
+            settings.getint('ESAJ_SESSION_MAX_RENEWALS', 3),
+            spider.crawler.stats,
+        )
+
+    def jar(self, chave):
+        if chave not in self.geracoes:
+            self.geracoes[chave] = 0
+            self.inc_stat('sessions/opened')
+        return f'{chave}#{self.geracoes[chave]}'
+
+    def renew(self, chave):
+        """Troca o cookiejar da janela; False quando as renovações se esgotaram."""
+        if self.geracoes.get(chave, 0) >= self.max_renewals:
+            self.inc_stat('sessions/gave_up')
+            logging.warning(f'Sessão da janela {chave} expirou {self.max_renewals} vezes, desistindo.')
+            return False
+        self.geracoes[chave] = self.geracoes.get(chave, 0) + 1
+        self.inc_stat('sessions/renewed')
+        logging.info(f'Sessão da janela {chave} expirou, abrindo outra.')
+        return True
+
+    def warmup_request(self, chave, callback, meta, url=None):
+        """GET no formulário (o do tribunal da janela, em `url`) com o cookiejar da janela; o callback faz a pesquisa."""
+        meta = dict(meta, cookiejar=self.jar(chave), session=chave)
+        return scrapy.Request(url or self.warmup_url, callback, meta=meta, dont_filter=True)
+
+    def expired(self, response, selector):
+        # Página de paginação sem resultados e sem a barra de páginas
+        return not response.css(selector) and not response.css('.trocaDePagina')
+
+    def inc_stat(self, key):
+        if self.stats is not None:
+            self.stats.inc_value(key)
@@ -6,9 +6,7 @@
 #     https://docs.scrapy.org/en/latest/topics/settings.html
 #     https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 #     https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-import logging
 import os
-import sys
 
 BOT_NAME = "esaj"
 
@@ -46,9 +44,11 @@ DOWNLOAD_DELAY = 3
 
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-#SPIDER_MIDDLEWARES = {
-#    "esaj.middlewares.EsajSpiderMiddleware": 543,
-#}
+SPIDER_MIDDLEWARES = {
+    "esaj.distributed.DistributedStartMiddleware": 50,
+    # Closest to the spider, so only the callback itself is timed
+    "esaj.metrics.CallbackTimingMiddleware": 1000,
+}
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
@@ -58,15 +58,76 @@ DOWNLOAD_DELAY = 3
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
-#    "scrapy.extensions.telnet.TelnetConsole": None,
-#}
+EXTENSIONS = {
+    "esaj.logconfig.QueueLogging": 0,
+    "esaj.metrics.MetricsExtension": 500,
+}
+
+# Timings of callbacks, downloads (latency and time waiting for the slot/pacing),
+# pipeline stages, CSV/Parquet/SQLite flushes and PDF extraction, as histograms
+# per spider and endpoint (see esaj/metrics.py). Every METRICS_INTERVAL seconds
+# they are copied to the stats (metrics/...) and written in Prometheus text
+# format to METRICS_PROMETHEUS_DIR/<spider>.prom.
+METRICS_ENABLED = True
+METRICS_INTERVAL = 60
+METRICS_PROMETHEUS_DIR = "data/metrics"
+# "cprofile" profiles a METRICS_PROFILE_SAMPLE fraction of the callbacks;
+# "pyinstrument" (pip install pyinstrument) samples the whole crawl
+METRICS_PROFILE = ""
+METRICS_PROFILE_SAMPLE = 0.05
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-#ITEM_PIPELINES = {
-#    "esaj.pipelines.EsajPipeline": 300,
-#}
+ITEM_PIPELINES = {
+    "esaj.pipelines.PdfTextPipeline": 200,
+    "esaj.pipelines.ParquetWriterPipeline": 250,
+    "esaj.pipelines.SqliteWriterPipeline": 260,
+    "esaj.pipelines.CsvWriterPipeline": 300,
+}
+
+# Output formats: "csv", "parquet" (needs `pip install pyarrow`) and/or "sqlite".
+# Parquet datasets go to PARQUET_DIR, mirroring the CSV paths, partitioned by
+# spider and by month of the item's partition_field, zstd-compressed
+OUTPUT_FORMATS = ["csv"]
+PARQUET_DIR = "data/parquet"
+PARQUET_ROW_GROUP_SIZE = 10000
+# Files in progress are hidden (.part-*) and closed every PARQUET_FILE_ROWS rows;
+# the crawl journal only advances past rows in closed files
+PARQUET_FILE_ROWS = 100000
+PARQUET_ZSTD_LEVEL = 6
+# SQLite database (WAL mode) with one table per output, written in transactions
+# of up to SQLITE_BATCH_SIZE rows (see esaj/sqlitestore.py)
+SQLITE_PATH = "data/esaj.sqlite3"
+SQLITE_BATCH_SIZE = 1000
+
+# Processes used to extract text from CPOSG PDFs (0 = one per CPU) and how many
+# PDFs may be queued for extraction at the same time (0 = twice the workers)
+PDF_EXTRACT_WORKERS = 0
+PDF_EXTRACT_MAX_PENDING = 0
+
+# Number of rows kept in memory per output file before appending them to the CSV
+CSV_BUFFER_SIZE = 500
+# Keep a <file>.csv.idx copy of each output's primary keys so the next run
+# does not need to re-read the CSV to rebuild the dedup/upsert index
+KEY_INDEX_PERSIST = False
+
+# Distributed crawl (see esaj/distributed.py): with a backend, the spider's start
+# requests (its work-list) go through a queue and a fingerprint set shared by
+# every process using the same backend, "sqlite:///data/fila.sqlite3" on one
+# machine or "redis://host:6379/0" (pip install redis) across machines. Only
+# processes with DISTRIBUTED_FEED read the work-list and fill the queue;
+# DISTRIBUTED_CONSUME=False makes a process only fill it. DISTRIBUTED_RESET
+# empties the spider's queue and fingerprints before feeding
+SCHEDULER = "esaj.distributed.DistributedScheduler"
+DISTRIBUTED_BACKEND = ""
+DISTRIBUTED_FEED = False
+DISTRIBUTED_CONSUME = True
+DISTRIBUTED_RESET = False
+# Seconds an idle process waits for new requests in the shared queue before closing
+DISTRIBUTED_IDLE_TIMEOUT = 60
+# Seconds after which a request taken from the shared queue with no response yet
+# (its process was interrupted) may be fed to the queue again
+DISTRIBUTED_INFLIGHT_TIMEOUT = 3600
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
@@ -83,11 +144,27 @@ AUTOTHROTTLE_MAX_DELAY = 180
 
 # Enable and configure HTTP caching (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
-#HTTPCACHE_ENABLED = True
+# Only CPOPG/CPOSG search.do and show.do are cached (see esaj/httpcache.py),
+# keyed by process number / processo.codigo instead of the full query string
+HTTPCACHE_ENABLED = True
 #HTTPCACHE_EXPIRATION_SECS = 0
-#HTTPCACHE_DIR = "httpcache"
+HTTPCACHE_DIR = "httpcache"
 #HTTPCACHE_IGNORE_HTTP_CODES = []
-#HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
+HTTPCACHE_POLICY = "esaj.httpcache.EsajCachePolicy"
+HTTPCACHE_STORAGE = "esaj.httpcache.EsajCacheStorage"
+# Seconds each cached endpoint stays valid (0 = never expires)
+HTTPCACHE_ESAJ_TTL = {
+    "cpopg/search.do": 30 * 24 * 3600,
+    "cposg/search.do": 30 * 24 * 3600,
+    "cpopg/show.do": 12 * 3600,
+    "cposg/show.do": 12 * 3600,
+}
+# Oldest entries are evicted when the cache grows past this size
+HTTPCACHE_ESAJ_MAX_BYTES = 2 * 1024 ** 3
+
+# Process number -> processo.codigo resolved by search.do, one CSV per spider,
+# so repeated lookups go straight to show.do (empty disables it)
+CODIGO_PROCESSO_CACHE_DIR = "data/codigos"
 
 # Set settings whose default value is deprecated to a future-proof value
 REQUEST_FINGERPRINTER_IMPLEMENTATION = "2.7"
@@ -95,42 +172,66 @@ TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
 FEED_EXPORT_ENCODING = "utf-8"
 
 DOWNLOADER_MIDDLEWARES = {
+    # First in line, so the wait includes PDF pacing and the download slot queue
+    'esaj.metrics.DownloadTimingMiddleware': 100,
     'esaj.middlewares.PdfDownloadDelayMiddleware': 543,
+    # Before RetryMiddleware (550) sees the response, so 429/5xx reach the controller
+    'esaj.ratecontrol.RateControlMiddleware': 580,
 }
 
-PDF_DOWNLOAD_DELAY = 3.0
-
-LOG_ENABLED = True
-LOG_LEVEL = 'WARNING'
-LOG_FILE = 'scrapy.log'
-
-logging.basicConfig(level=logging.ERROR)
-
-info_logger = logging.getLogger('info_logger')
-info_handler = logging.FileHandler('scrapy_info.log')
-info_handler.setLevel(logging.INFO)
-
-info_handler_stdout = logging.StreamHandler(sys.stdout)
-info_handler_stdout.setLevel(logging.INFO)
-
-info_logger.addHandler(info_handler)
-info_logger.addHandler(info_handler_stdout)
-
-warning_logger = logging.getLogger('warning_logger')
-warning_handler = logging.FileHandler('scrapy_warnings.log')
-warning_handler.setLevel(logging.WARNING)
+# Per-family pacing of e-SAJ endpoints (see esaj/ratecontrol.py): each family
+# gets its own download slot whose delay/concurrency move between these bounds,
+# speeding up while responses are healthy and backing off on 429/5xx, timeouts,
+# captcha/blank pages or latency above target_latency (seconds). DOWNLOAD_DELAY
+# above only applies to other hosts. Keep AutoThrottle disabled while this is on.
+RATE_CONTROL_ENABLED = True
+RATE_CONTROL_FAMILIES = {
+    "cjsg": {"start_delay": 3, "min_delay": 0.5, "max_delay": 60,
+             "min_concurrency": 1, "max_concurrency": 4, "target_latency": 2.0},
+    "cjpg": {"start_delay": 3, "min_delay": 0.5, "max_delay": 60,
+             "min_concurrency": 1, "max_concurrency": 4, "target_latency": 2.0},
+    "cpopg": {"start_delay": 2, "min_delay": 0.25, "max_delay": 60,
+              "min_concurrency": 1, "max_concurrency": 6, "target_latency": 2.0},
+    "cposg": {"start_delay": 2, "min_delay": 0.25, "max_delay": 60,
+              "min_concurrency": 1, "max_concurrency": 6, "target_latency": 2.0},
+    "pastadigital": {"start_delay": 3, "min_delay": 1, "max_delay": 120,
+                     "min_concurrency": 1, "max_concurrency": 2, "target_latency": 10.0},
+}
+# HTML responses shorter than this, or short pages containing one of the
+# markers, are treated as a block (captcha / blank page)
+RATE_CONTROL_BLANK_BYTES = 512
+RATE_CONTROL_BLOCK_MARKERS = ["captcha"]
 
-warning_handler_stdout = logging.StreamHandler(sys.stderr)
-warning_handler_stdout.setLevel(logging.WARNING)
+# CJSG/CJPG searches get one cookiejar per date window (see esaj/sessions.py),
+# warmed up on the search form page and renewed this many times on expiry
+ESAJ_SESSION_WARMUP = True
+ESAJ_SESSION_MAX_RENEWALS = 3
 
-warning_logger.addHandler(warning_handler)
-warning_logger.addHandler(warning_handler_stdout)
+# Journal of completed pages/windows (CJSG/CJPG) and processes (CPOPG/CPOSG)
+# used to resume an interrupted crawl (see esaj/crawlstate.py); empty disables it
+CRAWL_STATE_DIR = "data/estado"
 
-error_logger = logging.getLogger('error_logger')
-error_handler = logging.FileHandler('scrapy_errors.log')
-error_handler.setLevel(logging.ERROR)
+# Where CJSG/CJPG write the plan of a search (results, pages, windows, requests
+# and estimated time, see esaj/planner.py); -a plano=1 stops after it
+PLAN_DIR = "data/planos"
 
-error_handler_stdout = logging.StreamHandler(sys.stderr)
-error_handler_stdout.setLevel(logging.ERROR)
+# Hard floor for PDF downloads (pastadigital/getPDF.do), on top of the
+# pastadigital family above: at most this many PDFs in flight, this far apart
+PDF_DOWNLOAD_DELAY = 1.0
+PDF_CONCURRENT_REQUESTS = 2
 
-error_logger.addHandler(error_handler)
+LOG_ENABLED = True
+LOG_LEVEL = 'WARNING'
+LOG_FILE = 'scrapy.log'
+# Log records are put on a queue and written by a background thread (see
+# esaj/logconfig.py): LOG_FILE as one JSON object per line, rotated every
+# LOG_MAX_BYTES keeping LOG_BACKUP_COUNT old files, plus plain text on stderr
+# from LOG_CONSOLE_LEVEL up. The same log call (file and line) is written at
+# most LOG_RATE_LIMIT times per LOG_RATE_LIMIT_INTERVAL seconds
+LOG_QUEUE_ENABLED = True
+LOG_JSON = True
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+LOG_CONSOLE_LEVEL = 'WARNING'
+LOG_RATE_LIMIT = 20
+LOG_RATE_LIMIT_INTERVAL = 60
@@ -0,0 +1,14 @@
+# Sinais próprios do projeto, enviados pelo crawler.signals
+
+# Enviado pelo CsvWriterPipeline depois que todos os buffers foram gravados em disco
+csv_flushed = object()
+
+# Enviado pelo ParquetWriterPipeline depois que todos os arquivos em andamento foram fechados
+parquet_flushed = object()
+
+# Enviado pelo SqliteWriterPipeline depois de cada transação gravada no banco
+sqlite_flushed = object()
+
+# Perguntado pelo CrawlState a cada gravação: cada pipeline de saída responde se ainda guarda
+# linhas que não estão em disco (buffer ou arquivo ainda não fechado)
+output_pending = object()
@@ -0,0 +1,246 @@
+import logging
+import urllib.parse
+
+import scrapy
+from scrapy import signals
+from scrapy.utils.httpobj import urlparse_cached
+
+from esaj.crawlstate import CrawlState, Marca
+from esaj.planner import PlanoCrawl
+from esaj.sessions import SessionPool
+from esaj.spiders.helpers.shards import date_windows, format_date, parse_date, split_window, total_pages, total_results
+from esaj.tribunais import TRIBUNAIS, TRIBUNAL_PADRAO, item_do_tribunal, lista_tribunais, tribunal_do_host, \
+    tribunal_do_numero, url
+
+
+class EsajSpider(scrapy.Spider):
+    """Base das spiders do e-SAJ, parametrizada pelo tribunal.
+
+    Com `-a tribunal=tjal` a spider consulta o e-SAJ do TJAL e com uma lista
+    (`-a tribunal=tjsp,tjal,tjce`) consulta todos na mesma execução, dividindo
+    o downloader e os pipelines. Cada requisição leva o tribunal no meta; as
+    URLs saem de `url(tribunal, caminho)` e os itens de `item(classe, tribunal)`,
+    que grava em data/<uf>/ (o TJSP fica nos caminhos de sempre). Os tribunais
+    disponíveis estão em esaj.tribunais.TRIBUNAIS.
+    """
+
+    allowed_domains = [TRIBUNAIS[TRIBUNAL_PADRAO]['host']]
+
+    # Número da página atual na barra de paginação das pesquisas (CJSG/CJPG)
+    pagina_atual = '.trocaDePagina .paginaAtual::text'
+
+    # Pesquisas de jurisprudência (CJSG/CJPG): formulário usado no aquecimento da sessão, primeira
+    # página da pesquisa e paginação ({pagina}), além dos resultados na pesquisa e na paginação
+    caminho_formulario = None
+    caminho_pesquisa = None
+    caminho_pagina = None
+    seletor_resultados = '#tdResultados table table'
+    seletor_resultados_pagina = '#tdResultados table table'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tribunais = lista_tribunais(getattr(self, 'tribunal', TRIBUNAL_PADRAO))
+        self.allowed_domains = [TRIBUNAIS[tribunal]['host'] for tribunal in self.tribunais]
+
+    def url(self, tribunal, caminho):
+        return url(tribunal, caminho)
+
+    def item(self, item_cls, tribunal):
+        return item_do_tribunal(item_cls, tribunal)
+
+    def tribunal_da_resposta(self, response):
+        return (response.meta.get('tribunal') or tribunal_do_host(urlparse_cached(response).hostname)
+                or self.tribunais[0])
+
+    def tribunal_do_processo(self, numero_processo):
+        # Pelo J.TR do número CNJ, quando ele é de um dos tribunais da execução
+        tribunal = tribunal_do_numero(numero_processo)
+        return tribunal if tribunal in self.tribunais else self.tribunais[0]
+
+    def chave_janela(self, shard=None, tribunal=TRIBUNAL_PADRAO):
+        # Chave da pesquisa no journal (CrawlState) e no SessionPool
+        chave = '-'.join(shard) if shard else 'pesquisa'
+        return chave if tribunal == TRIBUNAL_PADRAO else f'{tribunal}:{chave}'
+
+    def janela_concluida(self, inicio=None, fim=None, tribunal=TRIBUNAL_PADRAO):
+        shard = (format_date(inicio), format_date(fim)) if inicio is not None else None
+        return self.crawl_state is not None and self.crawl_state.janela_concluida(self.chave_janela(shard, tribunal))
+
+    def marca_pagina(self, response, tribunal):
+        # Marca da página no journal (CrawlState); sem CRAWL_STATE_DIR, uma marca que não grava nada
+        if self.crawl_state is None:
+            return Marca()
+        return self.crawl_state.marcar_pagina(self.chave_janela(response.meta.get('shard'), tribunal),
+                                              self.get_current_page(response), ultima=not self.has_next_page(response))
+
+    def marca_processo(self, numero_processo):
+        return Marca() if self.crawl_state is None else self.crawl_state.marcar_processo(numero_processo)
+
+    def janelas_pendentes(self, start_date=None, end_date=None, shard_days=30):
+        """(tribunal, inicio, fim) das janelas ainda não concluídas; sem datas, a pesquisa inteira de cada tribunal."""
+        janelas = []
+        for tribunal in self.tribunais:
+            if start_date and end_date:
+                janelas += [(tribunal, inicio, fim)
+                            for inicio, fim in date_windows(parse_date(start_date), parse_date(end_date), int(shard_days))
+                            if not self.janela_concluida(inicio, fim, tribunal)]
+            elif not self.janela_concluida(tribunal=tribunal):
+                janelas.append((tribunal, None, None))
+        # O plano só é dado como completo quando todas elas responderem
+        for tribunal, inicio, fim in janelas:
+            shard = (format_date(inicio), format_date(fim)) if inicio is not None else None
+            self.planejamento.esperar(self.chave_janela(shard, tribunal))
+        return janelas
+
+    @property
+    def apenas_plano(self):
+        # -a plano=1: só a primeira página de cada janela, para o plano da pesquisa (dry-run)
+        return str(getattr(self, 'plano', '')).lower() in ('1', 'true', 'sim', 's')
+
+    @property
+    def planejamento(self):
+        if not hasattr(self, '_planejamento'):
+            self._planejamento = PlanoCrawl(self, self.settings.getbool('ESAJ_SESSION_WARMUP', True),
+                                            logging.WARNING if self.apenas_plano else logging.INFO)
+            self.crawler.signals.connect(self.plano_incompleto, signal=signals.spider_closed)
+        return self._planejamento
+
+    def sondagem(self, response, dividida=False):
+        """Registra no plano o total de resultados e de páginas da resposta da pesquisa de uma janela."""
+        if 'page' in response.meta:
+            return
+        shard = response.meta.get('shard')
+        tribunal = self.tribunal_da_resposta(response)
+        chave = self.chave_janela(shard, tribunal)
+        self.planejamento.registrar(
+            chave, tribunal, shard, total_results(response), total_pages(response, self.results_per_page),
+            concluidas=self.crawl_state.ultima_pagina(chave) if self.crawl_state is not None else 0,
+            latencia=response.meta.get('download_latency'), dividida=dividida,
+        )
+
+    def plano_incompleto(self, spider, reason):
+        # Janelas que falharam (ou execução interrompida): o plano sai com o que respondeu
+        if not self._planejamento.relatado and self._planejamento.janelas:
+            self._planejamento.relatar()
+
+    def has_next_page(self, response):
+        if response.css('[title="Próxima página"]'):
+            return True
+
+    def get_current_page(self, response):
+        return int(response.css(self.pagina_atual).get('1').strip())
+
+    def next_page(self, response):
+        return self.get_current_page(response) + 1
+
+    def parametros_pesquisa(self, pesquisa, inicio, fim):
+        """Query string da pesquisa, com o termo e as datas já codificados."""
+        raise NotImplementedError
+
+    @property
+    def crawl_state(self):
+        if not hasattr(self, '_crawl_state'):
+            # Só leitura no plano (-a plano=1), que não pode mexer no journal
+            self._crawl_state = CrawlState.from_spider(self, somente_leitura=self.apenas_plano)
+        return self._crawl_state
+
+    @property
+    def sessoes(self):
+        if not hasattr(self, '_sessoes'):
+            self._sessoes = SessionPool.from_spider(self, self.url(self.tribunais[0], self.caminho_formulario))
+        return self._sessoes
+
+    def seletor(self, response):
+        return self.seletor_resultados_pagina if 'page' in response.meta else self.seletor_resultados
+
+    def requisicao_pesquisa(self, inicio=None, fim=None, resume_page=None, aquecida=False, tribunal=None):
+        tribunal = tribunal or self.tribunais[0]
+        pesquisa = urllib.parse.quote(getattr(self, 'search'))
+        meta = {'tribunal': tribunal}
+        if inicio is not None:
+            inicio, fim = format_date(inicio), format_date(fim)
+            meta['shard'] = (inicio, fim)
+        else:
+            inicio, fim = '', ''
+        chave = self.chave_janela(meta.get('shard'), tribunal)
+        self.planejamento.esperar(chave)
+        if not aquecida and self.sessoes.warmup_url:
+            return self.sessoes.warmup_request(chave, self.sessao_pronta,
+                                               {'shard': meta.get('shard'), 'resume_page': resume_page, 'tribunal': tribunal},
+                                               self.url(tribunal, self.caminho_formulario))
+        meta['cookiejar'] = self.sessoes.jar(chave)
+        meta['session'] = chave
+        # Janela interrompida em outra execução (ou com a sessão expirada): sessão nova e direto para a página
+        if not resume_page and self.crawl_state:
+            resume_page = self.crawl_state.ultima_pagina(chave) + 1
+        if resume_page and resume_page > 1:
+            meta['resume_page'] = resume_page
+        inicio, fim = urllib.parse.quote(inicio, safe=''), urllib.parse.quote(fim, safe='')
+        url = self.url(tribunal, self.caminho_pesquisa) + '?' + self.parametros_pesquisa(pesquisa, inicio, fim)
+        return scrapy.Request(url, self.parse, meta=meta, dont_filter=True)
+
+    def requisicao_pagina(self, response, pagina):
+        tribunal = self.tribunal_da_resposta(response)
+        return scrapy.Request(
+            url=self.url(tribunal, self.caminho_pagina.format(pagina=pagina)),
+            headers={'Accept': 'text/html; charset=latin1;'},
+            meta={
+                'tribunal': tribunal,
+                'shard': response.meta.get('shard'),
+                'cookiejar': response.meta.get('cookiejar'),
+                'session': response.meta.get('session'),
+                'page': pagina,
+            },
+            callback=self.parse,
+            # A URL é a mesma em todas as janelas: só a sessão diferencia as páginas
+            dont_filter=True,
+        )
+
+    def dividir_janela(self, response):
+        """Metades de uma janela com mais de max_pages páginas, pesquisadas do zero; None quando não divide."""
+        shard = response.meta.get('shard')
+        if shard is None or self.caminho_pesquisa not in response.url:
+            return None
+        paginas = total_pages(response, self.results_per_page)
+        if paginas is None or paginas <= int(getattr(self, 'max_pages', 100)):
+            return None
+        metades = split_window(parse_date(shard[0]), parse_date(shard[1]))
+        if metades is None:
+            return None
+        tribunal = self.tribunal_da_resposta(response)
+        logging.info(f'A janela {self.chave_janela(shard, tribunal)} tem {paginas} páginas, dividindo em duas.')
+        # Metades concluídas numa execução anterior não são pesquisadas de novo
+        return [self.requisicao_pesquisa(inicio, fim, tribunal=tribunal) for inicio, fim in metades
+                if not self.janela_concluida(inicio, fim, tribunal)]
+
+    def sessao_pronta(self, response):
+        shard = response.meta.get('shard')
+        yield self.requisicao_pesquisa(*(map(parse_date, shard) if shard else ()), resume_page=response.meta.get('resume_page'),
+                                       aquecida=True, tribunal=self.tribunal_da_resposta(response))
+
+    def renovar_sessao(self, response):
+        # Refaz a pesquisa em outro cookiejar e segue da página que voltou vazia
+        if self.sessoes.renew(response.meta.get('session')):
+            shard = response.meta.get('shard')
+            yield self.requisicao_pesquisa(*(map(parse_date, shard) if shard else ()), resume_page=response.meta.get('page'),
+                                           tribunal=self.tribunal_da_resposta(response))
+
+    def desvio_da_pagina(self, response):
+        """Requisições que substituem a leitura dos resultados da resposta, ou None para ler a página.
+
+        A janela grande demais vira as suas metades, o plano (-a plano=1) para na
+        primeira página, a janela retomada segue até a página em que parou e a
+        página que voltou vazia (sessão expirada) refaz a pesquisa.
+        """
+        metades = self.dividir_janela(response)
+        self.sondagem(response, dividida=metades is not None)
+        if metades is not None:
+            return metades
+        if self.apenas_plano:
+            return []
+        resume_page = response.meta.get('resume_page')
+        if resume_page and self.get_current_page(response) < resume_page:
+            return [self.requisicao_pagina(response, resume_page)]
+        if 'page' in response.meta and self.sessoes.expired(response, self.seletor(response)):
+            return list(self.renovar_sessao(response))
+        return None
@@ -1,63 +1,124 @@
-from io import BytesIO
-
-import pdfplumber
 import scrapy
 import re
 import logging
-import pandas as pd
-import csv
-import os
-import traceback
-
-from bs4 import BeautifulSoup
+from datetime import datetime
+
+from esaj.crawlstate import CrawlState
+from esaj.httpcache import codigo_cache, codigo_da_url
+from esaj.items import CjpgItem, CpopgDeltaItem, CpopgEstadoItem, CpopgItem, CpopgMovimentacaoItem, CpopgParteItem
+from esaj.saidas import ler_coluna
+from esaj.spiders.base import EsajSpider
+from esaj.spiders.helpers.incremental import carregar_estado, hash_movimento, hash_valores, movimentos_novos
 from esaj.spiders.helpers.innertext import innertext_quick
+from esaj.spiders.helpers.numeros import iter_numeros_processo
+from esaj.spiders.helpers.partes import extrair_partes
+from esaj.spiders.helpers.selectors import campos_rotulados
 from esaj.spiders.helpers.treatment import treatment
+from esaj.sqlitestore import sqlite_store
 
-class CpopgSpider(scrapy.Spider):
+class CpopgSpider(EsajSpider):
     name = "cpopg"
-    allowed_domains = ["esaj.tjsp.jus.br"]
-    url_base = "https://esaj.tjsp.jus.br/cpopg"
 
     def start_requests(self):
         numero_processo = getattr(self, "numero_processo", None)
-        url = "https://esaj.tjsp.jus.br/cpopg/search.do"
+        # Lista (ou iterável, quando a spider é iniciada pelo automation.py) de números para rodar em lote
+        numeros_processo = getattr(self, "numeros_processo", None)
 
         if numero_processo:
+            tribunal = self.tribunal_do_processo(numero_processo)
+            url = self.url(tribunal, 'cpopg/search.do')
             parametros = f'?conversationId=&cbPesquisa=NUMPROC&numeroDigitoAnoUnificado=&foroNumeroUnificado=&dadosConsulta.valorConsultaNuUnificado=&dadosConsulta.valorConsultaNuUnificado=UNIFICADO&dadosConsulta.valorConsulta={numero_processo}&dadosConsulta.tipoNuProcesso=SAJ'
-            yield scrapy.Request(url + parametros, callback=self.parse, meta={'numero_processo': numero_processo})
+            yield scrapy.Request(url + parametros, callback=self.parse,
+                                 meta={'numero_processo': numero_processo, 'tribunal': tribunal})
+        elif numeros_processo is not None:
+            # Cada número vai ao e-SAJ do seu tribunal (pelo J.TR do número CNJ)
+            for numero_processo in self.pendentes(numeros_processo):
+                yield self.requisicao_processo(numero_processo)
         else:
-            caminho_csv_cpopg = 'data/cpopg.csv'
-            if os.path.exists(caminho_csv_cpopg) and os.path.getsize(caminho_csv_cpopg) > 0:
-                df_cpopg = pd.read_csv(caminho_csv_cpopg, encoding='utf-8')
-                ultimo_numero_processo = df_cpopg['numero_processo'].iloc[-1]
-            else:
-                ultimo_numero_processo = None
-
-            df_cjpg = pd.read_csv('data/cjpg.csv', encoding='utf-8')
-
-            if ultimo_numero_processo in df_cjpg['numero_processo'].values:
-                indice_inicial = df_cjpg[df_cjpg['numero_processo'] == ultimo_numero_processo].index[0] + 1
-            else:
-                indice_inicial = 0
-
-            # Fazer requisições para processos do cjpg
-            for _, linha in df_cjpg.iloc[indice_inicial:].iterrows():
-                numero_processo = linha['numero_processo']
-                if not df_cpopg['numero_processo'].str.contains(numero_processo).any():
-                    parametros = f'?conversationId=&paginaConsulta=0&cbPesquisa=NUMPROC&numeroDigitoAnoUnificado=&foroNumeroUnificado=&dePesquisaNuUnificado=&dePesquisaNuUnificado=UNIFICADO&dePesquisa={numero_processo}&tipoNuProcesso=SAJ'
-                    yield scrapy.Request(url + parametros, callback=self.parse,
-                                         meta={'numero_processo': numero_processo})
-                    
+            # Processos do CJPG de cada tribunal; os já concluídos em execuções anteriores ficam no journal (CrawlState)
+            for tribunal in self.tribunais:
+                for numero_processo in self.pendentes(self.fila_cjpg(tribunal)):
+                    yield self.requisicao_processo(numero_processo, tribunal)
+
+    @property
+    def crawl_state(self):
+        if not hasattr(self, '_crawl_state'):
+            # Sem lista de números a fila é o data/cjpg.csv, que só cresce: o journal nunca recomeça. O modo
+            # incremental revisita todos os processos a cada execução, então o journal vale só para retomá-la
+            lote = getattr(self, 'numero_processo', None) or getattr(self, 'numeros_processo', None) is not None
+            self._crawl_state = CrawlState.from_spider(self, continuo=not lote and not self.modo_incremental)
+        return self._crawl_state
+
+    def pendentes(self, numeros):
+        for numero_processo in iter_numeros_processo(numeros):
+            if self.crawl_state is not None and self.crawl_state.processo_concluido(numero_processo):
+                self.crawler.stats.inc_value('crawlstate/skipped_processes')
+                continue
+            yield numero_processo
+
+    def fila_cjpg(self, tribunal):
+        cjpg, cpopg = self.item(CjpgItem, tribunal), self.item(CpopgItem, tribunal)
+        # Com o SQLite, só os processos do CJPG que ainda não estão no CPOPG, consultando os índices
+        if 'sqlite' in self.settings.getlist('OUTPUT_FORMATS') and not self.modo_incremental:
+            store = sqlite_store(self.settings.get('SQLITE_PATH'))
+            if not store.is_empty(cjpg):
+                return store.pending_processes(cjpg, cpopg)
+        # data/cjpg.csv (data/<uf>/cjpg.csv), ou o dataset Parquet equivalente quando o CSV não existe
+        return ler_coluna(cjpg.csv_file, 'numero_processo', self.settings.get('PARQUET_DIR'))
+
+    @property
+    def modo_incremental(self):
+        # -a incremental=1: só grava movimentações novas e cabeçalhos alterados
+        return str(getattr(self, 'incremental', '')).lower() in ('1', 'true', 'sim', 's')
+
+    @property
+    def estado_processos(self):
+        if not hasattr(self, '_estado_processos'):
+            self._estado_processos = {}
+            if self.modo_incremental:
+                for tribunal in self.tribunais:
+                    self._estado_processos.update(carregar_estado(self.item(CpopgEstadoItem, tribunal).csv_file))
+        return self._estado_processos
+
+    @property
+    def codigos(self):
+        if not hasattr(self, '_codigos'):
+            self._codigos = codigo_cache(self.settings, self.name)
+        return self._codigos
+
+    def requisicao_processo(self, numero_processo, tribunal=None):
+        tribunal = tribunal or self.tribunal_do_processo(numero_processo)
+        meta = {'numero_processo': numero_processo, 'tribunal': tribunal}
+        # Número já resolvido em outra execução: vai direto ao show.do
+        codigo = self.codigos.get(numero_processo) if self.codigos else None
+        if codigo:
+            self.crawler.stats.inc_value('cpopg/codigo_cache/hit')
+            return scrapy.Request(self.url(tribunal, f'cpopg/show.do?processo.codigo={codigo}'), callback=self.parse,
+                                  meta=meta)
+        parametros = f'?conversationId=&paginaConsulta=0&cbPesquisa=NUMPROC&numeroDigitoAnoUnificado=&foroNumeroUnificado=&dePesquisaNuUnificado=&dePesquisaNuUnificado=UNIFICADO&dePesquisa={numero_processo}&tipoNuProcesso=SAJ'
+        return scrapy.Request(self.url(tribunal, 'cpopg/search.do') + parametros, callback=self.parse, meta=meta)
 
     def parse(self, response):
         numero_processo = response.meta.get('numero_processo')
+        tribunal = self.tribunal_da_resposta(response)
         if response.css('.modal__lista-processos'):
             code_process = response.css('.modal__lista-processos__item__header #processoSelecionado::attr("value")').get('')
-            url = f'https://esaj.tjsp.jus.br/cpopg/show.do?processo.codigo={code_process}'
-            yield scrapy.Request(url, callback=self.parse, meta={'numero_processo': numero_processo})
+            url = self.url(tribunal, f'cpopg/show.do?processo.codigo={code_process}')
+            yield scrapy.Request(url, callback=self.parse, meta={'numero_processo': numero_processo, 'tribunal': tribunal})
             return
 
-        data = {
+        codigo = codigo_da_url(response.url)
+        if codigo and self.codigos:
+            self.codigos.set(numero_processo, codigo)
+
+        # Vai para o journal depois que todos os itens do processo forem gravados
+        marca = self.marca_processo(numero_processo)
+
+        partes = extrair_partes(response)
+        campos = campos_rotulados(response)
+        principal = campos.get('Processo principal', {})
+        apensado = campos.get('Apensado ao', {})
+        data = self.item(CpopgItem, tribunal)({
             'numero_processo': numero_processo,
             'situacao': '|'.join(response.css('.unj-tag::text').getall()).strip(),
             'classe': response.css('#classeProcesso span::text,#classeProcesso::text').get(default="").strip(),
@@ -69,44 +130,69 @@ class CpopgSpider(scrapy.Spider):
             'vara': response.css('#varaProcesso::text').get(default="").strip(),
             'distribuicao': response.css('#dataHoraDistribuicaoProcesso::text').get(default="").strip(),
             'controle': response.css('#numeroControleProcesso::text').get(default="").strip(),
-            'partes_processo_1_tipo_participacao': response.css('.mensagemExibindo.tipoDeParticipacao::text').getall()[0].strip()  if len(self.extrair_partes_advogados(response)) > 0 else '',
-            'partes_processo_1_nome_parte': '|'.join(self.extrair_partes_advogados(response)[0]['nomes_parte']) if len(self.extrair_partes_advogados(response)) > 0 else '',
-            'partes_processo_1_advogados': '|'.join(self.extrair_partes_advogados(response)[0]['advogados_parte']) if len(self.extrair_partes_advogados(response)) > 0 else '',
-            'partes_processo_2_tipo_participacao': response.css('.mensagemExibindo.tipoDeParticipacao::text').getall()[1].strip() if len(self.extrair_partes_advogados(response)) > 1 else '',
-            'partes_processo_2_nome_parte': '|'.join(self.extrair_partes_advogados(response)[1]['nomes_parte']) if len(self.extrair_partes_advogados(response)) > 1 else '',
-            'partes_processo_2_advogados': '|'.join(self.extrair_partes_advogados(response)[1]['advogados_parte']) if len(self.extrair_partes_advogados(response)) > 1 else '',
-            'outros_assuntos': response.xpath('//div[contains(@class, "col-lg-2 mb-2")][.//span[contains(@class, "unj-label") and contains(text(), "Outros assuntos")]]//div[@class="line-clamp__2"]/span/text()').get(),
-            'execucao_sentenca': re.sub(r'\s*\(.*?\)\s*', '', response.xpath('//div[contains(@class, "col-lg-12 col-xl-13")][.//span[contains(@class, "unj-label") and contains(text(), "Execução de Sentença")]]//div/span[contains(@class, "unj-larger")]/text()').get(default="").strip()),
-            'processo_principal': response.xpath('//div[contains(@class, "col-lg-4 col-xl-3 mb-2")][.//span[contains(@class, "unj-label") and contains(text(), "Processo principal")]]//div/a/text()').get(),
-            'link_processo_principal': self.link_processo_principal(response),
-            'numero_processo_apensado': self.numero_processo_apensado(response),
-            'link_processo_apensado': self.link_processo_apensado(response),
-            'link_consulta_sg': self.link_consulta_sg(response),
-        }
-        self.adicionar_csv(data, 'cpopg')
-
-        movements = self.extrair_movimentos(response, numero_processo)
-        for movement in movements:
-            self.adicionar_csv(movement, 'cpopg_movimentacoes_primeiro_grau')
-
-    def link_processo_principal(self, response):
-        link_relativo = response.xpath('//div[contains(@class, "col-lg-4 col-xl-3 mb-2")][.//span[contains(@class, "unj-label") and contains(text(), "Processo principal")]]//div/a/@href').get()
-        if link_relativo:
-            return f"{self.url_base}{link_relativo}"
-        return None
+            **self.partes_achatadas(partes),
+            'outros_assuntos': campos.get('Outros assuntos', {}).get('texto'),
+            'execucao_sentenca': re.sub(r'\s*\(.*?\)\s*', '', campos.get('Execução de Sentença', {}).get('texto', '')),
+            'processo_principal': principal.get('texto'),
+            'link_processo_principal': self.link_absoluto(principal.get('link'), tribunal),
+            'numero_processo_apensado': apensado.get('texto'),
+            'link_processo_apensado': self.link_absoluto(apensado.get('link'), tribunal),
+            'link_consulta_sg': self.link_consulta_sg(response, tribunal),
+        })
+        movimentos = self.extrair_movimentos(response, numero_processo, tribunal)
+        hash_cabecalho = hash_valores([*data.values(), *(hash_valores(parte.values()) for parte in partes)])
+        estado = self.estado_processos.get(numero_processo)
+        if estado is None:
+            novos, cabecalho_alterado = movimentos, True
+        else:
+            novos = movimentos_novos(movimentos, estado)
+            cabecalho_alterado = estado.get('hash_cabecalho') != hash_cabecalho
+
+        if cabecalho_alterado:
+            yield marca.item(data)
+            for ordem, parte in enumerate(partes, start=1):
+                yield marca.item(self.item(CpopgParteItem, tribunal)({
+                    'numero_processo': numero_processo,
+                    'ordem': ordem,
+                    'tipo_participacao': parte['tipo_participacao'],
+                    'nome_parte': parte['nome_parte'],
+                    'advogados': '|'.join(parte['advogados']),
+                }))
+
+        for movement in novos:
+            yield marca.item(movement)
+
+        data_consulta = datetime.now().isoformat(timespec='seconds')
+        yield marca.item(self.item(CpopgEstadoItem, tribunal)({
+            'numero_processo': numero_processo,
+            'ultima_data': movimentos[0]['data'] if movimentos else '',
+            'hash_movimento': hash_movimento(movimentos[0]) if movimentos else '',
+            'hash_cabecalho': hash_cabecalho,
+            'data_consulta': data_consulta,
+        }))
+
+        if self.modo_incremental:
+            self.crawler.stats.inc_value('cpopg/incremental/movimentos_novos', len(novos))
+            if not cabecalho_alterado:
+                self.crawler.stats.inc_value('cpopg/incremental/cabecalho_sem_alteracao')
+            logging.info(f'{numero_processo}: {len(novos)} movimentações novas, '
+                         f'cabeçalho {"alterado" if cabecalho_alterado else "sem alteração"}.')
+            yield marca.item(self.item(CpopgDeltaItem, tribunal)({
+                'numero_processo': numero_processo,
+                'data_consulta': data_consulta,
+                'movimentos_novos': len(novos),
+                'cabecalho_alterado': cabecalho_alterado,
+            }))
+
+        marca.liberar()
 
-    def link_processo_apensado(self, response):
-        link_relativo = response.xpath(
-            '//div[contains(@class, "col-lg-4 col-xl-3 mb-2")][.//span[contains(@class, "unj-label") and contains(text(), "Apensado ao")]]//div/a/@href').get()
+    def link_absoluto(self, link_relativo, tribunal):
         if link_relativo:
-            return f"{self.url_base}{link_relativo}"
+            return self.url(tribunal, f"cpopg{link_relativo}")
         return None
 
-    def numero_processo_apensado(self, response):
-        return response.xpath(
-            '//div[contains(@class, "col-lg-4 col-xl-3 mb-2")][.//span[contains(@class, "unj-label") and contains(text(), "Apensado ao")]]//div/a/text()').get()
-
-    def extrair_movimentos(self, response, numero_processo):
+    def extrair_movimentos(self, response, numero_processo, tribunal):
+        item_cls = self.item(CpopgMovimentacaoItem, tribunal)
         movimentos = []
         for linha in response.css('#tabelaTodasMovimentacoes tr'):
             data = linha.css('.dataMovimentacao::text').get(default="").strip()
@@ -117,16 +203,16 @@ class CpopgSpider(scrapy.Spider):
 
             descricao = linha.css('.descricaoMovimentacao span::text').get(default="").strip()
 
-            movimento = {
+            movimento = item_cls({
                 'numero_processo': numero_processo,
                 'data': data,
                 'titulo': titulo,
                 'descricao': descricao
-            }
+            })
             movimentos.append(movimento)
         return movimentos
 
-    def link_consulta_sg(self, response):
+    def link_consulta_sg(self, response, tribunal):
         caminho = response.css('.linkConsultaSG::attr("href")').get()
         if not caminho:
             return ""
@@ -142,38 +228,14 @@ class CpopgSpider(scrapy.Spider):
         if not nu_processo or not cd_processo_sg or not cd_foro_sg or not is_processo_origem_cr:
             return ""
 
-        return f"{self.url_base}/abrirConsultaProcessoSG.do?nuProcesso={nu_processo}&cdProcessoSg={cd_processo_sg}&cdForoSg={cd_foro_sg}&isProcessoOrigemCr={is_processo_origem_cr}"
-
-    def extrair_partes_advogados(self, response):
-        partes_advogados = []
-        for elemento in response.css('.nomeParteEAdvogado'):
-            partes_texto = elemento.get().split('<br>')
-            partes_limpas = [
-                re.sub(r'[\n\t\xa0]', '', BeautifulSoup(part, 'html.parser').get_text().strip())
-                for part in partes_texto if part.strip()
-            ]
-            nomes_parte = [partes_limpas[0]] if partes_limpas else []
-            advogados_parte = [re.sub(r'^Advogado:|^Advogada:', '', part).strip() for part in partes_limpas[1:]]
-            partes_advogados.append({
-                'nomes_parte': nomes_parte,
-                'advogados_parte': advogados_parte
-            })
-        return partes_advogados
-
-    def adicionar_csv(self, dados, file_name='file'):
-        data_folder = 'data'
-        if not os.path.exists(data_folder):
-            os.makedirs(data_folder)
-
-        csv_file = os.path.join(data_folder, f'{file_name}.csv')
-        try:
-            if os.path.exists(csv_file) and os.path.getsize(csv_file) > 0:
-                df = pd.read_csv(csv_file)
-            else:
-                df = pd.DataFrame(columns=dados.keys())
-
-            df = pd.concat([df, pd.DataFrame([dados])], ignore_index=True)
-            df.to_csv(csv_file, index=False, quoting=csv.QUOTE_NONNUMERIC, encoding='utf-8')
-        except Exception as e:
-            logging.error(
-                f"Ocorreu um erro ao adicionar informações do PDF ao CSV. Tipo de dado: PDF info. Erro: {e}. Arquivo CSV: {csv_file}, Informações do csv: {dados}\nRastreamento de pilha:\n{traceback.format_exc()}")
+        return self.url(tribunal, "cpopg/abrirConsultaProcessoSG.do") + f"?nuProcesso={nu_processo}&cdProcessoSg={cd_processo_sg}&cdForoSg={cd_foro_sg}&isProcessoOrigemCr={is_processo_origem_cr}"
+
+    def partes_achatadas(self, partes):
+        # Colunas das duas primeiras partes mantidas no cpopg.csv; a lista completa vai para cpopg_partes.csv
+        colunas = {}
+        for ordem in (1, 2):
+            parte = partes[ordem - 1] if len(partes) >= ordem else None
+            colunas[f'partes_processo_{ordem}_tipo_participacao'] = parte['tipo_participacao'] if parte else ''
+            colunas[f'partes_processo_{ordem}_nome_parte'] = parte['nome_parte'] if parte else ''
+            colunas[f'partes_processo_{ordem}_advogados'] = '|'.join(parte['advogados']) if parte else ''
+        return colunas
@@ -1,50 +1,119 @@
-from io import BytesIO
-
-import pdfplumber
 import scrapy
 import re
-import uuid
 import logging
-import pandas as pd
-import csv
-import os
-from time import sleep
+from esaj.crawlstate import CrawlState
+from esaj.httpcache import codigo_cache, codigo_da_url
+from esaj.items import CjsgItem, CposgItem, CposgMovimentItem, FirstInstanceItem
+from esaj.keyindex import DocumentLedger, key_index
+from esaj.pdfstore import pdf_store
+from esaj.saidas import ler_coluna
+from esaj.spiders.base import EsajSpider
 from esaj.spiders.helpers.innertext import innertext_quick
-from esaj.spiders.helpers.treatment import treatment
+from esaj.spiders.helpers.numeros import iter_numeros_processo
+from esaj.spiders.helpers.selectors import campos_rotulados
+from esaj.sqlitestore import SqliteKeyIndex, sqlite_store
 
-class CposgSpider(scrapy.Spider):
+class CposgSpider(EsajSpider):
     name = "cposg"
-    allowed_domains = ["esaj.tjsp.jus.br"]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Journal mark of the process held by each document still being downloaded
+        self.pending_documents = {}
 
     # TODO: Adicionar buscar por URL
     def start_requests(self):
         process_number = getattr(self, "process_number", None)
-        url_base = "https://esaj.tjsp.jus.br/cposg/search.do"
+        # Comma separated string, or any iterable when started from automation.py
+        process_numbers = getattr(self, "process_numbers", None)
 
         if process_number:
-            parameters = f'?conversationId=&paginaConsulta=0&cbPesquisa=NUMPROC&numeroDigitoAnoUnificado=&foroNumeroUnificado=&dePesquisaNuUnificado=&dePesquisaNuUnificado=UNIFICADO&dePesquisa={process_number}&tipoNuProcesso=SAJ'
-            url = url_base + parameters
-
-            yield scrapy.Request(url, callback=self.parse, meta={'process_number': process_number})
+            yield self.search_request(process_number)
+        elif process_numbers is not None:
+            for process_number in self.pending(process_numbers):
+                yield self.search_request(process_number)
         else:
-            with open('data/cjsg.csv', 'r', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    process_number = row['numero_processo']
-                    parameters = f'?conversationId=&paginaConsulta=0&cbPesquisa=NUMPROC&numeroDigitoAnoUnificado=&foroNumeroUnificado=&dePesquisaNuUnificado=&dePesquisaNuUnificado=UNIFICADO&dePesquisa={process_number}&tipoNuProcesso=SAJ'
-                    url = url_base + parameters
-                    yield scrapy.Request(url, callback=self.parse, meta={'process_number': process_number})
+            # Where the CJSG spider writes for each court (data/sp/cjsg.csv, data/<uf>/cjsg.csv) or, when it
+            # does not exist, its Parquet dataset
+            for court in self.tribunais:
+                process_numbers = ler_coluna(self.item(CjsgItem, court).csv_file, 'numero_processo',
+                                             self.settings.get('PARQUET_DIR'))
+                for process_number in self.pending(process_numbers):
+                    yield self.search_request(process_number, court)
+
+    @property
+    def crawl_state(self):
+        if not hasattr(self, '_crawl_state'):
+            # Without a list of numbers the queue is the CJSG output, which only grows: never restart the journal
+            batch = getattr(self, 'process_number', None) or getattr(self, 'process_numbers', None) is not None
+            self._crawl_state = CrawlState.from_spider(self, continuo=not batch)
+        return self._crawl_state
+
+    def pending(self, process_numbers):
+        for process_number in iter_numeros_processo(process_numbers):
+            if self.crawl_state is not None and self.crawl_state.processo_concluido(process_number):
+                self.crawler.stats.inc_value('crawlstate/skipped_processes')
+                continue
+            yield process_number
+
+    def document_scheduled(self, mark, process_number, document):
+        # The process only goes to the journal after the rows of all its documents are written
+        if self.crawl_state is not None:
+            mark.reter()
+            self.pending_documents[(process_number, document)] = mark
+
+    def document_saved(self, process_number, document, item):
+        mark = self.pending_documents.pop((process_number, document), None)
+        if mark is None:
+            return item
+        mark.item(item)
+        mark.liberar()
+        return item
+
+    def document_failed(self, failure):
+        # Errback of the requests that lead to the PDF
+        logging.error(f'Error downloading PDF: {failure.value}')
+        self.document_lost(failure.request.meta)
+
+    def document_lost(self, meta):
+        # The process stays out of the journal, so the next run fetches the document again
+        self.crawler.stats.inc_value('cposg/documents/failed')
+        mark = self.pending_documents.pop((meta.get('process_number'), meta.get('cddocumento')), None)
+        if mark is not None:
+            mark.liberar(perdida=True)
+
+    def search_request(self, process_number, court=None):
+        # Without a court, the one in the CNJ number (J.TR) when it is part of this run
+        court = court or self.tribunal_do_processo(process_number)
+        meta = {'process_number': process_number, 'tribunal': court}
+        # Number already resolved by a previous run: go straight to show.do
+        code = self.process_codes.get(process_number) if self.process_codes else None
+        if code:
+            self.crawler.stats.inc_value('cposg/codigo_cache/hit')
+            return scrapy.Request(self.url(court, f'cposg/show.do?processo.codigo={code}'),
+                                  callback=self.parse, meta=meta)
+        url_base = self.url(court, 'cposg/search.do')
+        parameters = f'?conversationId=&paginaConsulta=0&cbPesquisa=NUMPROC&numeroDigitoAnoUnificado=&foroNumeroUnificado=&dePesquisaNuUnificado=&dePesquisaNuUnificado=UNIFICADO&dePesquisa={process_number}&tipoNuProcesso=SAJ'
+        return scrapy.Request(url_base + parameters, callback=self.parse, meta=meta)
 
 
     def parse(self, response):
         process_number = response.meta.get('process_number')
+        court = self.tribunal_da_resposta(response)
         if response.css('.modal__lista-processos'):
             code_process = response.css('.modal__lista-processos__item__header #processoSelecionado::attr("value")').get('')
-            url = f'https://esaj.tjsp.jus.br/cposg/show.do?processo.codigo={code_process}'
-            yield scrapy.Request(url, callback=self.parse, meta={'process_number': process_number})
+            url = self.url(court, f'cposg/show.do?processo.codigo={code_process}')
+            yield scrapy.Request(url, callback=self.parse, meta={'process_number': process_number, 'tribunal': court})
             return
 
-        data = {
+        code = codigo_da_url(response.url)
+        if code and self.process_codes:
+            self.process_codes.set(process_number, code)
+
+        # Goes to the journal once the process and document rows have been written
+        mark = self.marca_processo(process_number)
+        fields = campos_rotulados(response)
+        data = self.item(CposgItem, court)({
             'numero_processo': process_number,
             'situacao': response.css('#situacaoProcesso::text').get(default="").strip(),
             'classe': response.css('#classeProcesso span::text').get(default="").strip(),
@@ -54,11 +123,15 @@ class CposgSpider(scrapy.Spider):
             'area': response.css('#areaProcesso span::text').get(default="").strip(),
             'relator_a': response.css('#relatorProcesso span::text').get(default="").strip(),
             'valor_acao': response.css('#valorAcaoProcesso span::text').get(default="").strip(),
-            'comarca': response.css('#maisDetalhes span:contains("Origem")').xpath('..').css('div div span::text').get()
-        }
-        self.add_to_csv(data, 'cposg')
-        self.first_instance(response)
+            'comarca': fields.get('Origem', {}).get('texto')
+        })
+        yield mark.item(data)
+
+        first_instance = self.first_instance(response, court)
+        if first_instance:
+            yield mark.item(first_instance)
 
+        movement_cls = self.item(CposgMovimentItem, court)
         link_movements = response.css('.descricaoMovimentacaoProcesso a.linkMovVincProc')
         for link_movement in link_movements:
             title = link_movement.css('::text').get(default="").strip()
@@ -66,35 +139,74 @@ class CposgSpider(scrapy.Spider):
             document_origin = link_movement.attrib['cddocumento']
             resource_origin = link_movement.attrib['name']
             process = response.css('input[name="cdProcesso"]::attr(value)').get(default="")
-            url = (
-                f'https://esaj.tjsp.jus.br/cposg/verificarAcessoMovimentacao.do?cdDocumento={document_origin}'
+
+            if not self.document_ledger(court).claim(process_number, document_origin):
+                self.crawler.stats.inc_value('cposg/documents/skipped')
+                continue
+
+            # PDF already stored by a previous run whose row never reached the CSV
+            pdf_hash = pdf_store(movement_cls.pdf_folder).lookup(process_number, document_origin)
+            if pdf_hash:
+                self.crawler.stats.inc_value('cposg/documents/restored')
+                yield mark.item(movement_cls({
+                    'pdf_name': pdf_hash,
+                    'numero_processo': process_number,
+                    'documento': document_origin,
+                    'titulo': title,
+                    'descricao': description,
+                    'processo': process,
+                    'conteudo': '',
+                }))
+                continue
+
+            self.crawler.stats.inc_value('cposg/documents/scheduled')
+            self.document_scheduled(mark, process_number, document_origin)
+            url = self.url(court, (
+                f'cposg/verificarAcessoMovimentacao.do?cdDocumento={document_origin}'
                 f'&origemRecurso={resource_origin}&cdProcesso={process}'
+            ))
+            yield scrapy.Request(
+                url=url,
+                callback=self.open_pdf,
+                errback=self.document_failed,
+                meta={
+                    'process_number': process_number,
+                    'tribunal': court,
+                    'cdprocesso': process,
+                    'cddocumento': document_origin,
+                    'title': title,
+                    'description': description
+                },
             )
 
-            if self.process_and_document_exist_in_csv(process_number, document_origin, 'data/cposg/cposg_moviments.csv'):
-                yield scrapy.Request(
-                    url=url,
-                    callback=self.open_pdf,
-                    meta={
-                        'process_number': process_number,
-                        'cdprocesso': process,
-                        'cddocumento': document_origin,
-                        'title': title,
-                        'description': description
-                    },
-                )
-
-    def process_and_document_exist_in_csv(process_number, document_number, csv_file):
-        if os.path.exists(csv_file):
-            df = pd.read_csv(csv_file)
-            return df[(df['numero_processo'] == process_number) & (df['documento'] == document_number)].any().any()
-        return False
+        mark.liberar()
+
+    @property
+    def process_codes(self):
+        if not hasattr(self, '_process_codes'):
+            self._process_codes = codigo_cache(self.settings, self.name)
+        return self._process_codes
+
+    def document_ledger(self, court):
+        # One ledger per court, since each one writes its own movements file
+        if not hasattr(self, '_document_ledgers'):
+            self._document_ledgers = {}
+        if court not in self._document_ledgers:
+            item_cls = self.item(CposgMovimentItem, court)
+            if 'sqlite' in self.settings.getlist('OUTPUT_FORMATS'):
+                # One indexed lookup per document instead of loading every key of the CSV
+                index = SqliteKeyIndex(sqlite_store(self.settings.get('SQLITE_PATH')), item_cls)
+            else:
+                index = key_index(item_cls, self.settings.getbool('KEY_INDEX_PERSIST'))
+            self._document_ledgers[court] = DocumentLedger(index)
+        return self._document_ledgers[court]
 
     def open_pdf(self, response):
-        yield scrapy.Request(url=response.body.decode('utf-8'), callback=self.pdf_viewer, meta=response.meta)
+        yield scrapy.Request(url=response.body.decode('utf-8'), callback=self.pdf_viewer, errback=self.document_failed,
+                             meta=response.meta)
 
 
-    def first_instance(self, response):
+    def first_instance(self, response, court):
         table = response.css('table:contains("Nº de 1ª instância")').xpath('following-sibling::table[1]')
         process_number_and_type = innertext_quick(table.css('td:nth-child(1)'))
 
@@ -106,7 +218,7 @@ class CposgSpider(scrapy.Spider):
             type = ''
 
         try:
-            data = {
+            return self.item(FirstInstanceItem, court)({
                 'numero_processo': response.css('#numeroProcesso::text').get('').strip(),
                 'n_processo_1_instancia': n_processo_1_instancia,
                 'tipo': type,
@@ -114,8 +226,7 @@ class CposgSpider(scrapy.Spider):
                 'vara': table.css('td:nth-child(3)::text').get('').strip(),
                 'juiz': table.css('td:nth-child(4)::text').get('').strip(),
                 'obs': table.css('td:nth-child(5)::text').get('').strip(),
-            }
-            self.add_to_csv(data, 'first_instance')
+            })
         except Exception as e:
             logging.error(f'Error saving first instance data: {e}')
 
@@ -125,83 +236,32 @@ class CposgSpider(scrapy.Spider):
         match = re.search(r'"parametros":"([^"]*)"', html_script)
         parameters = match.group(1) if match else None
 
-        url = (f'https://esaj.tjsp.jus.br/pastadigital/getPDF.do?{parameters}')
-        yield scrapy.Request(url=url, callback=self.save_pdf, meta=response.meta)
+        url = self.url(self.tribunal_da_resposta(response), f'pastadigital/getPDF.do?{parameters}')
+        yield scrapy.Request(url=url, callback=self.save_pdf, errback=self.document_failed, meta=response.meta)
 
 
     def save_pdf(self, response):
         try:
-            data_folder = 'data/cposg/pdf'
-            if not os.path.exists(data_folder):
-                os.makedirs(data_folder)
-
-            if check_moviments_exists_in_csv(response.meta.get('process_number'), response.meta.get('cddocumento')):
-                return
+            process_number = response.meta.get('process_number')
+            document_number = response.meta.get('cddocumento')
 
-            file_name = str(uuid.uuid4())
-            with open(f'{os.path.join(data_folder,file_name)}.pdf', 'wb') as pdf_file:
-                pdf_file.write(response.body)
+            item_cls = self.item(CposgMovimentItem, self.tribunal_da_resposta(response))
+            store = pdf_store(item_cls.pdf_folder)
+            file_name = store.put(response.body)
+            store.record(process_number, document_number, file_name)
 
-            pdf_data = {
+            pdf_data = item_cls({
                 'pdf_name': file_name,
-                'numero_processo': response.meta.get('process_number'),
-                'documento': response.meta.get('cddocumento'),
+                'numero_processo': process_number,
+                'documento': document_number,
                 'titulo': response.meta.get('title'),
                 'descricao': response.meta.get('description'),
                 'processo': response.meta.get('cdprocesso'),
-                'conteudo': self.pdf_to_text(response.body)
-            }
-            self.add_to_csv(pdf_data, 'cposg_moviments')
+                # Preenchido pelo PdfTextPipeline, fora do reactor
+                'conteudo': '',
+            })
+            yield self.document_saved(process_number, document_number, pdf_data)
 
         except Exception as e:
             logging.error(f'Error saving PDF: {e}')
-
-    def add_to_csv(self, data, file_name):
-        data_folder = 'data/cposg'
-        if not os.path.exists(data_folder):
-            os.makedirs(data_folder)
-
-        csv_file = os.path.join(data_folder, f'{file_name}.csv')
-        try:
-            if os.path.exists(csv_file):
-                df = pd.read_csv(csv_file)
-                if data['numero_processo'] in df['numero_processo'].values:
-                    for key, value in data.items():
-                        df.loc[df['numero_processo'] == data['numero_processo'], key] = value
-                else:
-                    df = pd.concat([df, pd.DataFrame([data])], ignore_index=True)
-            else:
-                df = pd.DataFrame([data])
-
-            df.to_csv(csv_file, index=False, quoting=csv.QUOTE_NONNUMERIC, encoding='utf-8')
-        except Exception as e:
-            logging.error(f"The error occurred while adding information from the PDF to the CSV. {e}")
-
-
-    def pdf_to_text(self, pdf_content):
-        with pdfplumber.open(BytesIO(pdf_content)) as pdf:
-            extracted_text = ""
-            for page in pdf.pages:
-                extracted_text += page.extract_text()
-
-        extracted_text = ' '.join(extracted_text.split())
-        extracted_text = extracted_text.replace('\n', ' ')
-        extracted_text = extracted_text.replace('\t', '')
-
-        extracted_text = re.sub(r'[;,\'\"\r]', '', extracted_text)
-        extracted_text = re.sub(r'\s+', ' ', extracted_text)
-
-        return treatment(extracted_text)
-
-
-    def check_process_and_document_and_content(self, row, process_number, document_number):
-        return (row['numero_processo'] == process_number) and (row['documento'] == document_number) and (row['conteudo'] != '')
-
-
-    def check_moviments_exists_in_csv(self, process_number, document_number):
-        csv_file = 'data/cposg/cposg.csv'
-        if os.path.exists(csv_file):
-            df = pd.read_csv(csv_file)
-            return df.apply(self.check_process_and_document_and_content, axis=1,
-                            args=(process_number, document_number)).any()
-        return False
+            self.document_lost(response.meta)
@@ -0,0 +1,56 @@
+import csv
+import hashlib
+import logging
+import os
+
+from esaj.spiders.helpers.shards import parse_date
+
+
+def hash_valores(valores):
+    return hashlib.sha1('\x1f'.join('' if valor is None else str(valor) for valor in valores).encode('utf-8')).hexdigest()
+
+
+def hash_movimento(movimento):
+    return hash_valores((movimento['data'], movimento['titulo'], movimento['descricao']))
+
+
+def carregar_estado(csv_file):
+    """Marca d'água de cada processo já visitado, lida do CSV de estado."""
+    estado = {}
+    if not os.path.exists(csv_file) or os.path.getsize(csv_file) == 0:
+        return estado
+    try:
+        with open(csv_file, 'r', newline='', encoding='utf-8') as file:
+            for row in csv.DictReader(file):
+                estado[row['numero_processo']] = row
+    except Exception as e:
+        logging.error(f'Erro ao carregar o estado incremental de {csv_file}: {e}')
+    return estado
+
+
+def movimentos_novos(movimentos, estado):
+    """Movimentações acima da marca d'água do processo (a lista vem da mais nova para a mais antiga).
+
+    Quando a última movimentação conhecida não aparece mais na página, cai para
+    a comparação por data: só entram as posteriores à última data gravada.
+    """
+    if not estado or not estado.get('hash_movimento'):
+        return list(movimentos)
+
+    for posicao, movimento in enumerate(movimentos):
+        if hash_movimento(movimento) == estado['hash_movimento']:
+            return list(movimentos[:posicao])
+
+    logging.warning(f'Marca d\'água de {estado["numero_processo"]} não encontrada, comparando pela data.')
+    ultima_data = data_ou_none(estado.get('ultima_data'))
+    if ultima_data is None:
+        return list(movimentos)
+    return [movimento for movimento in movimentos
+            if (data_ou_none(movimento['data']) or ultima_data) > ultima_data]
+
+
+def data_ou_none(texto):
+    try:
+        return parse_date(texto)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,22 @@
+import re
+
+NAO_DIGITOS = re.compile(r'\D')
+
+
+def iter_numeros_processo(numeros):
+    """Números de processo sem repetição, na ordem em que chegam, sem ler a fonte toda antes."""
+    if isinstance(numeros, str):
+        numeros = numeros.split(',')
+
+    # Só os dígitos, como int: metade da memória de guardar as strings, e o mesmo
+    # número com ou sem máscara conta como repetido
+    vistos = set()
+    for numero in numeros:
+        numero = str(numero).strip()
+        if not numero:
+            continue
+        digitos = NAO_DIGITOS.sub('', numero)
+        chave = int(digitos) if digitos else numero
+        if chave not in vistos:
+            vistos.add(chave)
+            yield numero
@@ -0,0 +1,41 @@
+import re
+
+from esaj.spiders.helpers.selectors import SELETORES
+from esaj.spiders.helpers.treatment import treatment
+
+ROTULO_ADVOGADO = re.compile(r'^Advogad[oa]:\s*')
+
+
+def extrair_partes(response):
+    """Lista com todas as partes do processo, na ordem da página.
+
+    Cada parte é um dict com tipo_participacao, nome_parte e advogados (lista).
+    O texto de cada célula é lido uma única vez, separando nome e advogados
+    pelos <br>.
+    """
+    root = response.selector.root
+    # A tabela completa fica oculta na página, mas já vem no HTML; a de partes
+    # principais só é usada quando ela não existe
+    linhas = SELETORES['linhas_todas_partes'](root) or SELETORES['linhas_partes'](root)
+
+    partes = []
+    for linha in linhas:
+        trechos = [treatment(trecho) for trecho in trechos_celula(SELETORES['nome_parte_e_advogado'](linha)[0])]
+        trechos = [trecho for trecho in trechos if trecho]
+        partes.append({
+            'tipo_participacao': treatment(SELETORES['tipo_participacao'](linha)),
+            'nome_parte': trechos[0] if trechos else '',
+            'advogados': [ROTULO_ADVOGADO.sub('', trecho) for trecho in trechos[1:]],
+        })
+    return partes
+
+
+def trechos_celula(celula):
+    trechos = [[celula.text or '']]
+    for filho in celula:
+        if filho.tag == 'br':
+            trechos.append([])
+        elif isinstance(filho.tag, str):
+            trechos[-1].append(''.join(filho.itertext()))
+        trechos[-1].append(filho.tail or '')
+    return [''.join(trecho) for trecho in trechos]
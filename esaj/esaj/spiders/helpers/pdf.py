@@ -0,0 +1,13 @@
+import re
+
+import pdfplumber
+
+from esaj.spiders.helpers.treatment import treatment
+
+
+def pdf_to_text(pdf_path):
+    # Executado nos processos do PdfTextPipeline: recebe o caminho para não copiar o PDF entre processos
+    with pdfplumber.open(pdf_path) as pdf:
+        extracted_text = ' '.join(page.extract_text() or '' for page in pdf.pages)
+
+    return treatment(re.sub(r'[;,\'\"\r]', '', extracted_text))
@@ -0,0 +1,20 @@
+from esaj.spiders.helpers.treatment import treatment
+
+
+def parse_rows(process):
+    """Mapa rótulo -> valor das linhas de um bloco de resultado do CJSG/CJPG.
+
+    Cada <tr> é lido uma única vez. O rótulo é o primeiro texto da linha quando
+    termina em ':' (ex.: 'Relator(a):') e o valor é o restante do texto da
+    linha, como o get_detail fazia com um ':contains' por campo.
+    """
+    fields = {}
+    for row in process.root.xpath('./tr | ./tbody/tr'):
+        texts = [text.strip() for text in row.xpath('.//text()')]
+        texts = [text for text in texts if text]
+        if not texts or not texts[0].endswith(':'):
+            continue
+        label = texts[0]
+        if label not in fields:
+            fields[label] = treatment(''.join(texts[1:]))
+    return fields
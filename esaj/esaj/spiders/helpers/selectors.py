@@ -0,0 +1,36 @@
+from lxml import etree
+
+from esaj.spiders.helpers.treatment import treatment
+
+# Expressões compiladas uma única vez, no import, e usadas direto sobre a
+# árvore lxml da resposta (response.selector.root)
+SELETORES = {
+    # Cabeçalho do processo (CPOPG e CPOSG): <span class="unj-label">Rótulo</span><div>valor</div>
+    'rotulos': etree.XPath('//span[contains(concat(" ", normalize-space(@class), " "), " unj-label ")]'),
+    'valor_rotulo': etree.XPath('following-sibling::*[1]'),
+    'link': etree.XPath('string((.//a/@href)[1])'),
+    # Partes do processo (CPOPG)
+    'linhas_todas_partes': etree.XPath('//table[@id="tableTodasPartes"]//tr[td[contains(@class, "nomeParteEAdvogado")]]'),
+    'linhas_partes': etree.XPath('//tr[td[contains(@class, "nomeParteEAdvogado")]]'),
+    'tipo_participacao': etree.XPath('string(.//span[contains(@class, "tipoDeParticipacao")])'),
+    'nome_parte_e_advogado': etree.XPath('./td[contains(@class, "nomeParteEAdvogado")]'),
+}
+
+
+def campos_rotulados(response):
+    """Mapa rótulo -> {'texto', 'link'} dos campos do cabeçalho do processo.
+
+    Os blocos são percorridos uma única vez por página; o texto e o link
+    (primeiro <a>, quando houver) saem da mesma leitura.
+    """
+    campos = {}
+    for rotulo in SELETORES['rotulos'](response.selector.root):
+        nome = treatment(rotulo.text_content())
+        valor = SELETORES['valor_rotulo'](rotulo)
+        if not nome or nome in campos or not valor:
+            continue
+        campos[nome] = {
+            'texto': treatment(valor[0].text_content()),
+            'link': SELETORES['link'](valor[0]),
+        }
+    return campos
@@ -0,0 +1,50 @@
+import math
+import re
+from datetime import datetime, timedelta
+
+DATE_FORMAT = '%d/%m/%Y'
+
+
+def parse_date(text):
+    return datetime.strptime(text, DATE_FORMAT).date()
+
+
+def format_date(date):
+    return date.strftime(DATE_FORMAT)
+
+
+def date_windows(start, end, days):
+    """Janelas [inicio, fim] consecutivas e sem sobreposição cobrindo de start a end."""
+    if days < 1:
+        raise ValueError(f'shard_days deve ser pelo menos 1 (recebido: {days})')
+    windows = []
+    while start <= end:
+        window_end = min(start + timedelta(days=days - 1), end)
+        windows.append((start, window_end))
+        start = window_end + timedelta(days=1)
+    return windows
+
+
+def split_window(start, end):
+    if start >= end:
+        return None
+    middle = start + (end - start) // 2
+    return [(start, middle), (middle + timedelta(days=1), end)]
+
+
+def total_results(response):
+    total = response.css('#totalResultadoAba-A::attr(value)').get()
+    if not total:
+        text = ' '.join(response.xpath('//*[contains(text(), "Resultados")]/text()').getall())
+        match = re.search(r'Resultados\s+\d+\s+a\s+\d+\s+de\s+([\d.]+)', text)
+        total = match.group(1) if match else None
+    if not total:
+        return None
+    return int(total.replace('.', ''))
+
+
+def total_pages(response, results_per_page):
+    total = total_results(response)
+    if total is None:
+        return None
+    return math.ceil(total / results_per_page)
@@ -1,3 +1,3 @@
-import re
 def treatment(text):
-    return re.sub(r'[\n\r\t\s]+', ' ', text).strip()
+    # Mesmo resultado de re.sub(r'[\n\r\t\s]+', ' ', text).strip(), sem regex
+    return ' '.join(text.split())
\ No newline at end of file
@@ -0,0 +1,151 @@
+import logging
+import os
+import sqlite3
+
+from esaj.keyindex import normalize
+from esaj.tribunais import TRIBUNAL_PADRAO
+
+_stores = {}
+
+
+def sqlite_store(path):
+    """Banco compartilhado (pipeline e spiders) de um caminho."""
+    store = _stores.get(path)
+    if store is None:
+        store = _stores[path] = SqliteStore(path)
+    return store
+
+
+def table_name(item_cls):
+    # data/cposg/cposg_moviments.csv -> cposg_moviments; data/al/cposg/cposg_moviments.csv -> tjal_cposg_moviments
+    name = os.path.splitext(os.path.basename(item_cls.csv_file))[0]
+    return name if item_cls.tribunal == TRIBUNAL_PADRAO else f'{item_cls.tribunal}_{name}'
+
+
+class SqliteStore:
+    """As saídas das spiders como tabelas de um banco SQLite.
+
+    Cada item vira uma tabela com o nome do seu CSV. Os key_fields ganham um
+    índice único e o on_duplicate do item vira o ON CONFLICT do INSERT ('skip'
+    mantém a linha gravada, 'update' sobrescreve os campos preenchidos no item
+    novo), como no CsvWriterPipeline. As tabelas com numero_processo também
+    ganham um índice nele, usado nas consultas de existência e nas listas de
+    trabalho. O banco fica em modo WAL, então dá para ler durante a coleta.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.tables = {}
+
+    def table(self, item_cls):
+        name = table_name(item_cls)
+        if name not in self.tables:
+            self.create_table(name, item_cls)
+            self.tables[name] = self.upsert_sql(name, item_cls)
+        return name
+
+    def columns(self, name):
+        return [row[1] for row in self.connection.execute(f'PRAGMA table_info("{name}")')]
+
+    def create_table(self, name, item_cls):
+        fields = list(item_cls.fields)
+        with self.connection:
+            self.connection.execute(f'CREATE TABLE IF NOT EXISTS "{name}" ({", ".join(f"{quote(f)} TEXT" for f in fields)})')
+            # Campos novos no item entram como colunas novas
+            existing = set(self.columns(name))
+            for field in fields:
+                if field not in existing:
+                    self.connection.execute(f'ALTER TABLE "{name}" ADD COLUMN {quote(field)} TEXT')
+            if unique_key(item_cls):
+                keys = ', '.join(quote(f) for f in item_cls.key_fields)
+                self.connection.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "ux_{name}" ON "{name}" ({keys})')
+            if 'numero_processo' in fields and tuple(item_cls.key_fields or ())[:1] != ('numero_processo',):
+                self.connection.execute(
+                    f'CREATE INDEX IF NOT EXISTS "ix_{name}_numero_processo" ON "{name}" ("numero_processo")')
+
+    def upsert_sql(self, name, item_cls):
+        fields = list(item_cls.fields)
+        sql = f'INSERT INTO "{name}" ({", ".join(quote(f) for f in fields)}) VALUES ({", ".join("?" for _ in fields)})'
+        if not unique_key(item_cls):
+            return sql
+        keys = ', '.join(quote(f) for f in item_cls.key_fields)
+        updates = [f'{quote(f)} = COALESCE(excluded.{quote(f)}, {quote(f)})' for f in fields if f not in item_cls.key_fields]
+        if item_cls.on_duplicate == 'skip' or not updates:
+            return f'{sql} ON CONFLICT ({keys}) DO NOTHING'
+        return f'{sql} ON CONFLICT ({keys}) DO UPDATE SET {", ".join(updates)}'
+
+    def write(self, item_cls, rows):
+        """Grava as linhas em uma única transação."""
+        name = self.table(item_cls)
+        keys = set(item_cls.key_fields or ())
+        values = [[normalize(row.get(f)) if f in keys else value(row.get(f)) for f in item_cls.fields] for row in rows]
+        with self.connection:
+            self.connection.executemany(self.tables[name], values)
+
+    def contains(self, item_cls, key):
+        name = self.table(item_cls)
+        where = ' AND '.join(f'{quote(f)} = ?' for f in item_cls.key_fields)
+        return self.connection.execute(f'SELECT 1 FROM "{name}" WHERE {where} LIMIT 1', key).fetchone() is not None
+
+    def is_empty(self, item_cls):
+        return self.connection.execute(f'SELECT 1 FROM "{self.table(item_cls)}" LIMIT 1').fetchone() is None
+
+    def pending_processes(self, source_cls, target_cls):
+        """Números de processo da tabela de origem que ainda não estão na de destino."""
+        source, target = self.table(source_cls), self.table(target_cls)
+        # Em blocos pela ordem do índice, sem deixar uma leitura aberta enquanto o pipeline grava
+        sql = (f'SELECT DISTINCT s."numero_processo" FROM "{source}" s WHERE s."numero_processo" > ? '
+               f'AND NOT EXISTS (SELECT 1 FROM "{target}" t WHERE t."numero_processo" = s."numero_processo") '
+               f'ORDER BY s."numero_processo" LIMIT 1000')
+        ultimo = ''
+        while True:
+            bloco = [numero for (numero,) in self.connection.execute(sql, (ultimo,))]
+            if not bloco:
+                return
+            yield from bloco
+            ultimo = bloco[-1]
+
+    def close(self):
+        """Fecha a conexão (o SQLite faz o checkpoint do WAL) e tira o banco de _stores."""
+        try:
+            self.connection.execute('PRAGMA optimize')
+        except sqlite3.Error as e:
+            logging.warning(f'PRAGMA optimize falhou em {self.path}: {e}')
+        self.connection.close()
+        if _stores.get(self.path) is self:
+            del _stores[self.path]
+
+
+class SqliteKeyIndex:
+    """Mesma interface do KeyIndex, consultando o índice único da tabela no lugar de um set."""
+
+    def __init__(self, store, item_cls):
+        self.store = store
+        self.item_cls = item_cls
+        self.key_fields = tuple(item_cls.key_fields)
+
+    def key(self, data):
+        return tuple(normalize(data.get(field)) for field in self.key_fields)
+
+    def __contains__(self, key):
+        return self.store.contains(self.item_cls, key)
+
+
+def unique_key(item_cls):
+    return bool(item_cls.key_fields) and item_cls.on_duplicate != 'append'
+
+
+def quote(name):
+    return f'"{name}"'
+
+
+def value(data):
+    if data is None or isinstance(data, (str, int, float)):
+        return data
+    return str(data)
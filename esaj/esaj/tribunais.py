@@ -0,0 +1,78 @@
+import os
+import re
+
+TRIBUNAL_PADRAO = 'tjsp'
+
+# Tribunais que usam o e-SAJ: host do portal, pasta das saídas em data/ (uf) e
+# o segmento J.TR do número CNJ (NNNNNNN-DD.AAAA.J.TR.OOOO)
+TRIBUNAIS = {
+    'tjsp': {'host': 'esaj.tjsp.jus.br', 'uf': 'sp', 'cnj': '826'},
+    'tjac': {'host': 'esaj.tjac.jus.br', 'uf': 'ac', 'cnj': '801'},
+    'tjal': {'host': 'www2.tjal.jus.br', 'uf': 'al', 'cnj': '802'},
+    'tjam': {'host': 'consultasaj.tjam.jus.br', 'uf': 'am', 'cnj': '804'},
+    'tjce': {'host': 'esaj.tjce.jus.br', 'uf': 'ce', 'cnj': '806'},
+    'tjms': {'host': 'esaj.tjms.jus.br', 'uf': 'ms', 'cnj': '812'},
+}
+
+NAO_DIGITOS = re.compile(r'\D')
+
+_itens = {}
+
+
+def lista_tribunais(valor):
+    """'tjsp' ou 'tjsp,tjal' (ou uma lista) -> ['tjsp', 'tjal'], conferindo se existem."""
+    nomes = valor.split(',') if isinstance(valor, str) else list(valor)
+    nomes = [nome.strip().lower() for nome in nomes if nome.strip()] or [TRIBUNAL_PADRAO]
+    desconhecidos = [nome for nome in nomes if nome not in TRIBUNAIS]
+    if desconhecidos:
+        raise ValueError(f'Tribunal sem e-SAJ configurado: {", ".join(desconhecidos)} '
+                         f'(disponíveis: {", ".join(sorted(TRIBUNAIS))})')
+    return list(dict.fromkeys(nomes))
+
+
+def url(tribunal, caminho):
+    return f'https://{TRIBUNAIS[tribunal]["host"]}/{caminho}'
+
+
+def tribunal_do_host(host):
+    return next((nome for nome, tribunal in TRIBUNAIS.items() if tribunal['host'] == host), None)
+
+
+def tribunal_do_numero(numero):
+    """Tribunal pelo J.TR de um número CNJ (com ou sem máscara), ou None."""
+    digitos = NAO_DIGITOS.sub('', str(numero))
+    if len(digitos) != 20:
+        return None
+    return next((nome for nome, tribunal in TRIBUNAIS.items() if tribunal['cnj'] == digitos[13:16]), None)
+
+
+def caminho_do_tribunal(caminho, tribunal):
+    """data/sp/cjsg.csv e data/cjpg.csv -> data/<uf>/cjsg.csv e data/<uf>/cjpg.csv.
+
+    O TJSP continua nos caminhos de sempre.
+    """
+    if tribunal == TRIBUNAL_PADRAO:
+        return caminho
+    partes = os.path.normpath(os.path.relpath(caminho, 'data')).split(os.sep)
+    if partes[0] == TRIBUNAIS[TRIBUNAL_PADRAO]['uf']:
+        partes = partes[1:]
+    return os.path.join('data', TRIBUNAIS[tribunal]['uf'], *partes)
+
+
+def item_do_tribunal(item_cls, tribunal):
+    """Subclasse do item com os arquivos de saída do tribunal.
+
+    Os pipelines só olham para a classe do item (csv_file, key_fields,
+    pdf_folder), então cada tribunal ganha os seus arquivos, índices de chave e
+    tabelas sem mudar nada neles.
+    """
+    if tribunal == TRIBUNAL_PADRAO:
+        return item_cls
+    chave = (item_cls, tribunal)
+    if chave not in _itens:
+        atributos = {'__module__': item_cls.__module__, 'tribunal': tribunal,
+                     'csv_file': caminho_do_tribunal(item_cls.csv_file, tribunal)}
+        if getattr(item_cls, 'pdf_folder', None):
+            atributos['pdf_folder'] = caminho_do_tribunal(item_cls.pdf_folder, tribunal)
+        _itens[chave] = type(f'{item_cls.__name__}{tribunal.capitalize()}', (item_cls,), atributos)
+    return _itens[chave]